@@ -1,14 +1,36 @@
-from flask import Flask, request, jsonify, send_from_directory, session, send_file
+from flask import Flask, Response, request, jsonify, send_from_directory, session, send_file, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from datetime import datetime, timedelta
-from sqlalchemy import inspect, text
+from sqlalchemy import event as sqlalchemy_event, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
+import base64
+import csv
 import io
 import os
-
+import tempfile
+
+import atexit
+import click
+import bisect
+import calendar
+import collections
+import functools
+import hashlib
+import heapq
+import random
+import re
 import threading
+import time
+import traceback
+import unicodedata
 import json
+import math
+import http.client
+import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 try:
     from croniter import croniter
@@ -26,6 +48,7 @@ except ImportError:
 
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
+import socket
 
 
 app = Flask(__name__, static_folder='static', static_url_path='')
@@ -100,6 +123,10 @@ class SystemHost(db.Model):
     cpu_arch = db.Column(db.String(50))    # CPU架构
     created_at = db.Column(db.DateTime, default=datetime.now)
 
+    __table_args__ = (
+        db.Index('idx_system_host_system', 'system_id'),
+    )
+
 
 class SystemMiddleware(db.Model):
     """系统中间件表"""
@@ -110,6 +137,11 @@ class SystemMiddleware(db.Model):
     quantity = db.Column(db.Integer, default=1)  # 数量
     created_at = db.Column(db.DateTime, default=datetime.now)
 
+    __table_args__ = (
+        db.Index('idx_system_middleware_system', 'system_id'),
+    )
+
+
 class SystemIntegration(db.Model):
     """系统集成关系表"""
     id = db.Column(db.Integer, primary_key=True)
@@ -119,6 +151,11 @@ class SystemIntegration(db.Model):
     network_type = db.Column(db.String(20))  # internal (内网) / external (外网)
     created_at = db.Column(db.DateTime, default=datetime.now)
 
+    __table_args__ = (
+        db.Index('idx_system_integration_system', 'system_id'),
+    )
+
+
 class Event(db.Model):
 
     """运维事件表"""
@@ -142,11 +179,28 @@ class Event(db.Model):
     resolved_at = db.Column(db.DateTime)  # 解决时间
     closed_at = db.Column(db.DateTime)  # 关闭时间
     progress_status = db.Column(db.String(20), default='未解决') # 处置进度: 未解决, 已解决, 已挂起
+    fingerprint = db.Column(db.String(40))  # 归一化的 系统+类型+标题 指纹，用于归并重复事件
+    parent_id = db.Column(db.Integer, db.ForeignKey('event.id'))  # 被归并到的父事件
+    duplicate_count = db.Column(db.Integer, default=0)  # 父事件：已归并的重复事件数
+    last_occurred_at = db.Column(db.DateTime)  # 父事件：最近一次重复发生时间
     
     processes = db.relationship('EventProcess', backref='event', lazy=True, cascade='all, delete-orphan')
 
     attachments = db.relationship('EventAttachment', backref='event', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('idx_event_occurred_id', 'occurred_at', 'id'),  # 事件列表按 (发生时间, ID) 倒序分页、趋势统计
+        db.Index('idx_event_status_occurred', 'status', 'occurred_at'),  # 按状态筛选的事件列表、概览计数
+        db.Index('idx_event_progress_occurred', 'progress_status', 'occurred_at'),
+        db.Index('idx_event_type_occurred', 'event_type', 'occurred_at'),  # 按类型筛选、概览按类型分组
+        db.Index('idx_event_severity_occurred', 'severity', 'occurred_at'),  # 按严重程度筛选、概览按严重程度分组
+        db.Index('idx_event_system_id', 'system_id'),
+        db.Index('idx_event_created_at', 'created_at'),  # 概览最近事件
+        db.Index('idx_event_resolved_at', 'resolved_at'),  # 概览平均响应时间
+        db.Index('idx_event_fingerprint', 'fingerprint', 'last_occurred_at'),  # 创建事件时查找可归并的父事件
+        db.Index('idx_event_parent_occurred', 'parent_id', 'occurred_at'),  # 折叠重复事件的列表与子事件查询
+    )
+
 class EventProcess(db.Model):
     """事件处置流程表"""
     id = db.Column(db.Integer, primary_key=True)
@@ -158,6 +212,10 @@ class EventProcess(db.Model):
     operated_at = db.Column(db.DateTime, default=datetime.now)  # 操作时间
     remarks = db.Column(db.Text)  # 备注
 
+    __table_args__ = (
+        db.Index('idx_event_process_event', 'event_id', 'step_no'),
+    )
+
 class EventAttachment(db.Model):
     """事件附件表"""
     id = db.Column(db.Integer, primary_key=True)
@@ -169,6 +227,11 @@ class EventAttachment(db.Model):
     uploaded_by = db.Column(db.String(50))
     uploaded_at = db.Column(db.DateTime, default=datetime.now)
 
+    __table_args__ = (
+        db.Index('idx_event_attachment_event', 'event_id'),
+    )
+
+
 class SystemConfig(db.Model):
     """系统配置表"""
     id = db.Column(db.Integer, primary_key=True)
@@ -230,6 +293,12 @@ class PlanTask(db.Model):
     
     preparations = db.relationship('PlanTaskPreparation', backref='task', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('idx_plan_task_reminder', 'reminder_sent', 'reminder_enabled', 'status', 'plan_time'),  # 提醒调度与追赶查询
+        db.Index('idx_plan_task_status_plan_time', 'status', 'plan_time'),  # 任务列表按状态筛选、按计划时间排序
+        db.Index('idx_plan_task_updated_at', 'updated_at'),  # 调度器增量同步
+    )
+
 
 
 class PlanTaskPreparation(db.Model):
@@ -241,6 +310,10 @@ class PlanTaskPreparation(db.Model):
     estimated_minutes = db.Column(db.Integer)
     order_no = db.Column(db.Integer, default=1)
 
+    __table_args__ = (
+        db.Index('idx_plan_task_prep_task', 'task_id', 'order_no'),
+    )
+
 class NotificationAudit(db.Model):
     """通知审计日志表"""
     id = db.Column(db.Integer, primary_key=True)
@@ -254,122 +327,913 @@ class NotificationAudit(db.Model):
     status = db.Column(db.String(20))  # 成功/失败
     error_msg = db.Column(db.Text)
     sent_at = db.Column(db.DateTime, default=datetime.now)
+    outbox_id = db.Column(db.Integer, db.ForeignKey('notification_outbox.id'), nullable=True)  # 对应的发件箱消息
+    attempt_no = db.Column(db.Integer)  # 第几次投递尝试
+    task_ids = db.Column(db.Text)  # 汇总通知涉及的全部任务ID，逗号分隔
+    latency_ms = db.Column(db.Integer)  # Webhook 请求往返耗时（毫秒）
+
+    __table_args__ = (
+        db.Index('idx_notification_audit_sent_at', 'sent_at'),  # 审计日志按时间筛选与倒序分页
+        db.Index('idx_notification_audit_outbox', 'outbox_id'),
+    )
 
+class SchedulerLease(db.Model):
+    """后台调度租约表：多进程部署时保证只有一个进程运行提醒调度与通知投递"""
+    name = db.Column(db.String(50), primary_key=True)  # 租约名称
+    holder = db.Column(db.String(100))  # 当前持有者（主机名:进程号:随机串）
+    expires_at = db.Column(db.DateTime)  # 租约到期时间，过期后其他进程可接管
+    heartbeat_at = db.Column(db.DateTime)  # 最近一次续约时间
+    revision = db.Column(db.Integer, default=0)  # 计划任务变更版本号，用于跨进程通知调度器
 
+class NotificationOutbox(db.Model):
+    """通知发件箱表：调度器写入渲染好的消息，投递线程负责发送与重试"""
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('plan_task.id'), nullable=True)
+    task_ids = db.Column(db.Text)  # 汇总通知涉及的全部任务ID，逗号分隔
+    task_title = db.Column(db.String(200))
+    robot_name = db.Column(db.String(100))
+    webhook_url = db.Column(db.String(500))
+    msg_type = db.Column(db.String(20), default='markdown')
+    title = db.Column(db.String(200))
+    content = db.Column(db.Text)
+    status = db.Column(db.String(20), default='待发送')  # 待发送/已发送/死信
+    attempts = db.Column(db.Integer, default=0)  # 已尝试次数
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now)  # 下次投递时间
+    due_at = db.Column(db.DateTime)  # 提醒时间点，用于统计提醒延迟
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    sent_at = db.Column(db.DateTime)
 
-def ensure_plan_task_schema():
-    """确保计划任务相关表和字段存在（兼容旧版SQLite数据库）。"""
-    with app.app_context():
-        # 确保所有模型对应的表存在
-        db.create_all()
+    __table_args__ = (
+        db.Index('idx_outbox_status_next_attempt', 'status', 'next_attempt_at'),  # 投递线程取到期消息
+        db.Index('idx_outbox_status_created', 'status', 'created_at'),  # 发件箱列表
+    )
 
-        inspector = inspect(db.engine)
-        table_names = set(inspector.get_table_names())
+class EventNoSequence(db.Model):
+    """事件编号日序列表：每天一行，last_value 为当天已分配的最大序号"""
+    __tablename__ = 'event_no_sequence'
+    day = db.Column(db.String(8), primary_key=True)  # YYYYMMDD
+    last_value = db.Column(db.Integer, nullable=False, default=0)
 
-        # 如果旧库没有表，显式创建
-        if 'plan_task' not in table_names:
-            PlanTask.__table__.create(db.engine, checkfirst=True)
-        if 'plan_task_preparation' not in table_names:
-            PlanTaskPreparation.__table__.create(db.engine, checkfirst=True)
-        if 'notification_audit' not in table_names:
-            NotificationAudit.__table__.create(db.engine, checkfirst=True)
-        if 'system_integration' not in table_names:
-            SystemIntegration.__table__.create(db.engine, checkfirst=True)
 
+class ChangeLog(db.Model):
+    """数据变更日志：事件、计划任务、通知审计每次提交时记录一行，id 即变更版本号，供 /api/stream 推送"""
+    __tablename__ = 'change_log'
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # event / plan_task / audit
+    entity_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10), nullable=False)  # created / updated / deleted
+    created_at = db.Column(db.DateTime, default=datetime.now)
 
+    __table_args__ = (
+        db.Index('idx_change_log_created', 'created_at'),
+        {'sqlite_autoincrement': True},  # 清理旧记录后版本号也不会回退复用
+    )
 
-        # 补齐 plan_task 缺失字段
-        inspector = inspect(db.engine)
-        plan_cols = {col['name'] for col in inspector.get_columns('plan_task')}
-        column_defs = {
-            'schedule_type': 'VARCHAR(20)',
-            'schedule_value': 'VARCHAR(100)',
-            'plan_time': 'DATETIME',
-            'reminder_minutes': 'INTEGER',
-            'reminder_enabled': 'BOOLEAN',
-            'alert_robot': 'VARCHAR(100)',
-            'webhook_url': 'VARCHAR(500)',
-            'reminder_message': 'TEXT',
-            'result_status': 'VARCHAR(20)',
-            'result_notes': 'TEXT',
-            'actual_start': 'DATETIME',
-            'actual_finish': 'DATETIME',
-            'created_by': 'VARCHAR(50)',
-            'reminder_sent': 'BOOLEAN DEFAULT 0'
-        }
 
 
-        for col, ddl in column_defs.items():
-            if col not in plan_cols:
-                with db.engine.begin() as conn:
-                    conn.exec_driver_sql(f"ALTER TABLE plan_task ADD COLUMN {col} {ddl}")
-
-        # 补齐 system_host 缺失字段
-        host_cols = {col['name'] for col in inspector.get_columns('system_host')}
-        host_column_defs = {
-            'os_version': 'VARCHAR(100)',
-            'cpu_cores': 'VARCHAR(50)',
-            'memory_gb': 'VARCHAR(50)',
-            'disk_gb': 'VARCHAR(50)',
-            'cpu_arch': 'VARCHAR(50)'
-        }
-        for col, ddl in host_column_defs.items():
-            if col not in host_cols:
-                with db.engine.begin() as conn:
-                    conn.exec_driver_sql(f"ALTER TABLE system_host ADD COLUMN {col} {ddl}")
+# ==================== 重复事件归并 ====================
 
-        # 补齐 event 缺失字段
+# 同一指纹的新事件在父事件最近一次发生后多少分钟内到达时归并到父事件，0 表示不归并
+EVENT_DEDUP_WINDOW_MINUTES = int(os.getenv('EVENT_DEDUP_WINDOW_MINUTES', '30'))
+# 仍可接收归并的父事件状态
+EVENT_DEDUP_OPEN_STATUSES = ('待处理', '处理中')
+# 标题中每次告警都会变化的部分：十六进制 ID、数字、IP、时间等，统一替换为 0
+EVENT_TITLE_VOLATILE_RE = re.compile(r'0x[0-9a-f]+|\b(?=[0-9a-f]*\d)[0-9a-f]{8,}\b|\d+(?:[.:\-/]\d+)*')
+EVENT_TITLE_SEPARATOR_RE = re.compile(r'[\W_]+')
 
-        event_cols = {col['name'] for col in inspector.get_columns('event')}
-        event_column_defs = {
-            'progress_status': "VARCHAR(20) DEFAULT '未解决'",
-            'event_category': "VARCHAR(50)",
-            'system_name': "VARCHAR(100)"
-        }
-        for col, ddl in event_column_defs.items():
-            if col not in event_cols:
-                with db.engine.begin() as conn:
-                    conn.exec_driver_sql(f"ALTER TABLE event ADD COLUMN {col} {ddl}")
 
-        # 补齐 event_process 缺失字段
-        process_cols = {col['name'] for col in inspector.get_columns('event_process')}
-        process_column_defs = {
-            'operated_at': "DATETIME DEFAULT CURRENT_TIMESTAMP"
-        }
-        for col, ddl in process_column_defs.items():
-            if col not in process_cols:
+def normalize_event_title(title):
+    """归一化事件标题：全半角统一、转小写、易变数字替换为 0、标点与空白合并为单个空格"""
+    text = unicodedata.normalize('NFKC', title or '').lower()
+    text = EVENT_TITLE_VOLATILE_RE.sub('0', text)
+    return EVENT_TITLE_SEPARATOR_RE.sub(' ', text).strip()
+
+
+def event_fingerprint(system_id, event_type, title):
+    """事件指纹：业务系统 + 事件类型 + 归一化标题的 SHA1"""
+    key = f"{system_id}|{(event_type or '').strip()}|{normalize_event_title(title)}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def find_duplicate_parent(fingerprint, occurred_at):
+    """查找可归并的父事件：同指纹、未归并到其他事件、仍在处理中，且最近一次发生在归并窗口内"""
+    if EVENT_DEDUP_WINDOW_MINUTES <= 0:
+        return None
+    window = timedelta(minutes=EVENT_DEDUP_WINDOW_MINUTES)
+    return Event.query.filter(
+        Event.fingerprint == fingerprint,
+        Event.parent_id.is_(None),
+        Event.status.in_(EVENT_DEDUP_OPEN_STATUSES),
+        Event.last_occurred_at >= occurred_at - window,
+        Event.last_occurred_at <= occurred_at + window
+    ).order_by(Event.last_occurred_at.desc()).first()
+
+
+# 中日韩统一表意文字（含扩展A与兼容区）
+CJK_CHARS = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+SEARCH_TOKEN_RE = re.compile(f'[{CJK_CHARS}]+|[^\\W_{CJK_CHARS}]+')
+
+
+def segment_search_text(text):
+    """将文本切分为检索词：连续汉字切为重叠二元组并在末尾补一个单字，其余按单词切分并转小写
+
+    "数据库连接超时" -> "数据 据库 库连 连接 接超 超时 时"，末尾单字保证单个汉字也能以前缀方式检索。
+    """
+    tokens = []
+    for run in SEARCH_TOKEN_RE.findall(text or ''):
+        if re.match(f'[{CJK_CHARS}]', run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run.lower())
+    return ' '.join(tokens)
+
+
+class EventSearchIndex:
+    """事件全文检索索引
+
+    检索范围：事件标题、系统名称、描述、解决方案、根本原因，以及处置流程的动作与结果。
+    - SQLite：FTS5 虚拟表 event_fts（rowid 即事件ID），写入前按 segment_search_text 切分汉字，按 bm25 排序
+    - MySQL：影子表 event_search + FULLTEXT 索引（ngram 分词器），按 MATCH 相关度排序
+    - 其他数据库或 SQLite 未编译 FTS5 时退化为 LIKE 匹配，按发生时间排序
+    事件增删改时由接口在同一事务内显式调用 index_event / remove_event 保持同步。
+    """
+
+    COLUMNS = ('title', 'system_name', 'body', 'processes')
+    SQLITE_WEIGHTS = '10.0, 4.0, 2.0, 1.0'  # bm25 列权重：标题 > 系统 > 描述/方案/根因 > 处置流程
+
+    def __init__(self):
+        self.backend = None
+
+    def detect(self):
+        """根据数据库类型与检索表是否已建立确定检索方式（不执行 DDL）"""
+        dialect = db.engine.dialect.name
+        inspector = inspect(db.engine)
+        if dialect == 'sqlite' and inspector.has_table('event_fts'):
+            self.backend = 'fts5'
+        elif dialect == 'mysql' and inspector.has_table('event_search'):
+            self.backend = 'mysql'
+        else:
+            self.backend = 'like'
+        return self.backend
+
+    def ensure_schema(self):
+        """建立检索表，新建时从事件表全量构建索引"""
+        dialect = db.engine.dialect.name
+        table_names = set(inspect(db.engine).get_table_names())
+        created = False
+        if dialect == 'sqlite':
+            if 'event_fts' not in table_names:
+                try:
+                    with db.engine.begin() as conn:
+                        conn.exec_driver_sql(
+                            "CREATE VIRTUAL TABLE IF NOT EXISTS event_fts USING fts5(title, system_name, body, processes, tokenize='unicode61')"
+                        )
+                    created = True
+                except Exception as e:
+                    print(f"WARNING: 当前 SQLite 不支持 FTS5，事件检索退化为 LIKE 匹配: {str(e)}")
+                    self.backend = 'like'
+                    return
+            self.backend = 'fts5'
+        elif dialect == 'mysql':
+            if 'event_search' not in table_names:
                 with db.engine.begin() as conn:
-                    conn.exec_driver_sql(f"ALTER TABLE event_process ADD COLUMN {col} {ddl}")
+                    conn.exec_driver_sql(
+                        "CREATE TABLE IF NOT EXISTS event_search ("
+                        "event_id INT NOT NULL PRIMARY KEY, "
+                        "title VARCHAR(200), system_name VARCHAR(100), body LONGTEXT, processes LONGTEXT, "
+                        "FULLTEXT KEY ft_event_search (title, system_name, body, processes) WITH PARSER ngram"
+                        ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+                    )
+                created = True
+            self.backend = 'mysql'
+        else:
+            self.backend = 'like'
+        if created:
+            total = self.rebuild()
+            print(f"DEBUG: 已建立事件全文检索索引 ({self.backend})，共 {total} 条事件")
+
+    def _document(self, event, processes):
+        body = '\n'.join(filter(None, [event.description, event.resolution, event.root_cause]))
+        process_text = '\n'.join(filter(None, [text for p in processes for text in (p.action, p.result)]))
+        fields = [event.title, event.system_name, body, process_text]
+        if self.backend == 'fts5':
+            fields = [segment_search_text(field) for field in fields]
+        return dict(zip(self.COLUMNS, fields), event_id=event.id)
+
+    def _write(self, documents):
+        if self.backend == 'fts5':
+            db.session.execute(text("DELETE FROM event_fts WHERE rowid = :event_id"), [{'event_id': d['event_id']} for d in documents])
+            db.session.execute(text(
+                "INSERT INTO event_fts (rowid, title, system_name, body, processes) "
+                "VALUES (:event_id, :title, :system_name, :body, :processes)"
+            ), documents)
+        elif self.backend == 'mysql':
+            db.session.execute(text(
+                "REPLACE INTO event_search (event_id, title, system_name, body, processes) "
+                "VALUES (:event_id, :title, :system_name, :body, :processes)"
+            ), documents)
+
+    def index_event(self, event):
+        """写入或更新单个事件的索引，需在事件与处置流程 flush 之后、提交之前调用"""
+        if self.backend in (None, 'like'):
+            return
+        processes = EventProcess.query.filter_by(event_id=event.id).all()
+        self._write([self._document(event, processes)])
+
+    def remove_event(self, event_id):
+        if self.backend == 'fts5':
+            db.session.execute(text("DELETE FROM event_fts WHERE rowid = :event_id"), {'event_id': event_id})
+        elif self.backend == 'mysql':
+            db.session.execute(text("DELETE FROM event_search WHERE event_id = :event_id"), {'event_id': event_id})
+
+    def rebuild(self, batch_size=500):
+        """清空并按批重建全部事件的索引，返回索引的事件数"""
+        if self.backend in (None, 'like'):
+            return 0
+        db.session.execute(text("DELETE FROM event_fts" if self.backend == 'fts5' else "DELETE FROM event_search"))
+        total = 0
+        last_id = 0
+        while True:
+            events = Event.query.filter(Event.id > last_id).order_by(Event.id).limit(batch_size).all()
+            if not events:
+                break
+            self.index_events(events)
+            total += len(events)
+            last_id = events[-1].id
+        db.session.commit()
+        return total
 
-        # 补齐 business_system 缺失字段
-        system_cols = {col['name'] for col in inspector.get_columns('business_system')}
-        if 'construction_unit' not in system_cols:
+    def index_events(self, events):
+        """批量写入一批事件的索引，处置流程一次查询取回，不提交事务"""
+        if self.backend in (None, 'like') or not events:
+            return
+        processes = {}
+        for process in EventProcess.query.filter(EventProcess.event_id.in_([e.id for e in events])).order_by(EventProcess.step_no):
+            processes.setdefault(process.event_id, []).append(process)
+        self._write([self._document(event, processes.get(event.id, [])) for event in events])
+
+    def _match_expression(self, keyword):
+        """把用户输入转换为检索表达式，多个词之间为“且”关系，无有效检索词时返回 None"""
+        terms = []
+        for run in SEARCH_TOKEN_RE.findall(keyword or ''):
+            is_cjk = bool(re.match(f'[{CJK_CHARS}]', run))
+            if self.backend == 'fts5':
+                if is_cjk and len(run) > 1:
+                    terms.append('"' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+                else:
+                    terms.append(f'"{run.lower()}"*')
+            elif self.backend == 'mysql':
+                # ngram 分词器默认二元切分，单个汉字无法检索
+                if is_cjk and len(run) < 2:
+                    continue
+                terms.append(f'+"{run}"' if is_cjk else f'+{run}*')
+        return ' '.join(terms) or None
+
+    def search(self, keyword, query):
+        """在 query（已附加筛选条件的 Event 查询）基础上执行全文检索
+
+        返回 (带相关度列的查询, 相关度列)，相关度越高越靠前；无有效检索词时返回 (None, None)。
+        """
+        if self.backend in ('fts5', 'mysql'):
+            expression = self._match_expression(keyword)
+            if not expression:
+                return None, None
+            if self.backend == 'fts5':
+                sql = f"SELECT rowid AS event_id, -bm25(event_fts, {self.SQLITE_WEIGHTS}) AS score FROM event_fts WHERE event_fts MATCH :q"
+            else:
+                sql = "SELECT event_id, MATCH(title, system_name, body, processes) AGAINST(:q IN BOOLEAN MODE) AS score " \
+                      "FROM event_search WHERE MATCH(title, system_name, body, processes) AGAINST(:q IN BOOLEAN MODE)"
+            ranked = text(sql).bindparams(q=expression).columns(event_id=db.Integer, score=db.Float).subquery('ranked')
+            return query.join(ranked, ranked.c.event_id == Event.id), ranked.c.score
+
+        # 退化为 LIKE 匹配
+        conditions = []
+        for word in (keyword or '').split():
+            pattern = f"%{word}%"
+            conditions.append(db.or_(
+                Event.title.like(pattern), Event.system_name.like(pattern), Event.description.like(pattern),
+                Event.resolution.like(pattern), Event.root_cause.like(pattern),
+                Event.processes.any(db.or_(EventProcess.action.like(pattern), EventProcess.result.like(pattern)))
+            ))
+        if not conditions:
+            return None, None
+        return query.filter(*conditions), db.literal(0.0)
+
+
+event_search_index = EventSearchIndex()
+
+
+EVENT_NO_PREFIX = 'INC'
+EVENT_NO_RE = re.compile(rf'^{EVENT_NO_PREFIX}-(\d{{8}})-(\d+)$')
+
+
+def format_event_no(day, value):
+    return f'{EVENT_NO_PREFIX}-{day}-{value:04d}'
+
+
+def max_event_no_value(day, conn=None):
+    """已有事件中某天的最大编号序号（兼容旧版按 COUNT 生成的编号），仅在序列行初始化时调用"""
+    prefix = f'{EVENT_NO_PREFIX}-{day}-'
+    sql = text("SELECT event_no FROM event WHERE event_no LIKE :prefix")
+    rows = (conn or db.session).execute(sql, {'prefix': prefix + '%'})
+    values = [int(no[len(prefix):]) for (no,) in rows if no[len(prefix):].isdigit()]
+    return max(values, default=0)
+
+
+def reserve_event_numbers(day, count=1):
+    """原子地为某天预留 count 个连续序号，返回 (起始序号, 结束序号)（含两端）
+
+    在独立事务中执行 UPDATE last_value = last_value + count 后读回，行锁保证并发请求拿到互不重叠的区间；
+    当天首次分配时插入序列行，并以已有事件的最大序号为起点。预留后即提交，事件写入失败只会留下空号。
+    """
+    table = EventNoSequence.__table__
+    for _ in range(5):
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                table.update().where(table.c.day == day).values(last_value=table.c.last_value + count)
+            ).rowcount
+            if updated:
+                end = conn.execute(db.select(table.c.last_value).where(table.c.day == day)).scalar()
+                return end - count + 1, end
+        try:
             with db.engine.begin() as conn:
-                conn.exec_driver_sql("ALTER TABLE business_system ADD COLUMN construction_unit VARCHAR(200)")
-        
-        if 'location' not in system_cols:
+                start = max_event_no_value(day, conn) + 1
+                conn.execute(table.insert().values(day=day, last_value=start + count - 1))
+                return start, start + count - 1
+        except IntegrityError:
+            # 其他请求同时初始化了当天的序列行，重新走 UPDATE
+            continue
+    raise RuntimeError(f'事件编号分配失败: {day}')
+
+
+def raise_event_number_floor(day, value):
+    """把某天的序列推进到不小于 value，用于写入自带编号的事件（如批量导入）之前，避免之后分配到相同编号"""
+    table = EventNoSequence.__table__
+    for _ in range(5):
+        with db.engine.begin() as conn:
+            current = conn.execute(db.select(table.c.last_value).where(table.c.day == day)).scalar()
+            if current is not None:
+                if current < value:
+                    conn.execute(table.update().where(table.c.day == day, table.c.last_value < value).values(last_value=value))
+                return
+        try:
             with db.engine.begin() as conn:
-                conn.exec_driver_sql("ALTER TABLE business_system ADD COLUMN location VARCHAR(200)")
-        
-        if 'access_url' not in system_cols:
+                conn.execute(table.insert().values(day=day, last_value=max(value, max_event_no_value(day, conn))))
+                return
+        except IntegrityError:
+            continue
+    raise RuntimeError(f'事件编号分配失败: {day}')
+
+
+class EventNoAllocator:
+    """事件编号分配器
+
+    block_size 为 1 时每次分配都直接递增数据库序列；大于 1 时每次向数据库预留一段序号，
+    在进程内顺序发放，减少高并发录入时对序列行的争用。进程重启会丢弃未用完的序号，编号可能不连续。
+    """
+
+    def __init__(self, block_size=1):
+        self.block_size = max(1, block_size)
+        self._lock = threading.Lock()
+        self._blocks = {}  # day -> [下一个序号, 区间末尾]
+
+    def allocate(self, count=1, day=None):
+        """分配 count 个编号，返回编号列表"""
+        day = day or datetime.now().strftime('%Y%m%d')
+        if self.block_size == 1 or count >= self.block_size:
+            start, end = reserve_event_numbers(day, count)
+            return [format_event_no(day, value) for value in range(start, end + 1)]
+
+        numbers = []
+        with self._lock:
+            for stale in [d for d in self._blocks if d != day]:
+                del self._blocks[stale]
+            while len(numbers) < count:
+                block = self._blocks.get(day)
+                if not block or block[0] > block[1]:
+                    block = list(reserve_event_numbers(day, self.block_size))
+                    self._blocks[day] = block
+                take = min(count - len(numbers), block[1] - block[0] + 1)
+                numbers.extend(format_event_no(day, value) for value in range(block[0], block[0] + take))
+                block[0] += take
+        return numbers
+
+    def next(self):
+        return self.allocate(1)[0]
+
+    def discard(self, day):
+        """丢弃进程内某天未用完的序号段，序列被推进后调用"""
+        with self._lock:
+            self._blocks.pop(day, None)
+
+
+event_no_allocator = EventNoAllocator(block_size=int(os.getenv('EVENT_NO_BLOCK_SIZE', '1')))
+
+
+class SchemaVersion(db.Model):
+    """数据库结构版本表：每条记录对应一个已执行的迁移"""
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200))
+    applied_at = db.Column(db.DateTime, default=datetime.now)
+
+
+def migration_001_legacy_columns():
+    """补齐旧版数据库缺失的表和字段（兼容旧版SQLite数据库）"""
+    inspector = inspect(db.engine)
+    table_names = set(inspector.get_table_names())
+
+    # 如果旧库没有表，显式创建
+    if 'plan_task' not in table_names:
+        PlanTask.__table__.create(db.engine, checkfirst=True)
+    if 'plan_task_preparation' not in table_names:
+        PlanTaskPreparation.__table__.create(db.engine, checkfirst=True)
+    if 'scheduler_lease' not in table_names:
+        SchedulerLease.__table__.create(db.engine, checkfirst=True)
+    if 'notification_outbox' not in table_names:
+        NotificationOutbox.__table__.create(db.engine, checkfirst=True)
+    if 'notification_audit' not in table_names:
+        NotificationAudit.__table__.create(db.engine, checkfirst=True)
+    if 'system_integration' not in table_names:
+        SystemIntegration.__table__.create(db.engine, checkfirst=True)
+
+
+
+    # 补齐 plan_task 缺失字段
+    inspector = inspect(db.engine)
+    plan_cols = {col['name'] for col in inspector.get_columns('plan_task')}
+    column_defs = {
+        'schedule_type': 'VARCHAR(20)',
+        'schedule_value': 'VARCHAR(100)',
+        'plan_time': 'DATETIME',
+        'reminder_minutes': 'INTEGER',
+        'reminder_enabled': 'BOOLEAN',
+        'alert_robot': 'VARCHAR(100)',
+        'webhook_url': 'VARCHAR(500)',
+        'reminder_message': 'TEXT',
+        'result_status': 'VARCHAR(20)',
+        'result_notes': 'TEXT',
+        'actual_start': 'DATETIME',
+        'actual_finish': 'DATETIME',
+        'created_by': 'VARCHAR(50)',
+        'reminder_sent': 'BOOLEAN DEFAULT 0'
+    }
+
+
+    for col, ddl in column_defs.items():
+        if col not in plan_cols:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE plan_task ADD COLUMN {col} {ddl}")
+
+    # 补齐 notification_audit 缺失字段
+    audit_cols = {col['name'] for col in inspector.get_columns('notification_audit')}
+    audit_column_defs = {
+        'outbox_id': 'INTEGER',
+        'attempt_no': 'INTEGER',
+        'task_ids': 'TEXT',
+        'latency_ms': 'INTEGER'
+    }
+    for col, ddl in audit_column_defs.items():
+        if col not in audit_cols:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE notification_audit ADD COLUMN {col} {ddl}")
+
+    # 补齐 notification_outbox 缺失字段
+    outbox_cols = {col['name'] for col in inspector.get_columns('notification_outbox')}
+    outbox_column_defs = {
+        'task_ids': 'TEXT',
+        'due_at': 'DATETIME'
+    }
+    for col, ddl in outbox_column_defs.items():
+        if col not in outbox_cols:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE notification_outbox ADD COLUMN {col} {ddl}")
+
+    # 补齐 system_host 缺失字段
+    host_cols = {col['name'] for col in inspector.get_columns('system_host')}
+    host_column_defs = {
+        'os_version': 'VARCHAR(100)',
+        'cpu_cores': 'VARCHAR(50)',
+        'memory_gb': 'VARCHAR(50)',
+        'disk_gb': 'VARCHAR(50)',
+        'cpu_arch': 'VARCHAR(50)'
+    }
+    for col, ddl in host_column_defs.items():
+        if col not in host_cols:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE system_host ADD COLUMN {col} {ddl}")
+
+    # 补齐 event 缺失字段
+
+    event_cols = {col['name'] for col in inspector.get_columns('event')}
+    event_column_defs = {
+        'progress_status': "VARCHAR(20) DEFAULT '未解决'",
+        'event_category': "VARCHAR(50)",
+        'system_name': "VARCHAR(100)"
+    }
+    for col, ddl in event_column_defs.items():
+        if col not in event_cols:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE event ADD COLUMN {col} {ddl}")
+
+    # 补齐 event_process 缺失字段
+    process_cols = {col['name'] for col in inspector.get_columns('event_process')}
+    process_column_defs = {
+        'operated_at': "DATETIME DEFAULT CURRENT_TIMESTAMP"
+    }
+    for col, ddl in process_column_defs.items():
+        if col not in process_cols:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE event_process ADD COLUMN {col} {ddl}")
+
+    # 补齐 business_system 缺失字段
+    system_cols = {col['name'] for col in inspector.get_columns('business_system')}
+    if 'construction_unit' not in system_cols:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE business_system ADD COLUMN construction_unit VARCHAR(200)")
+    
+    if 'location' not in system_cols:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE business_system ADD COLUMN location VARCHAR(200)")
+    
+    if 'access_url' not in system_cols:
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE business_system ADD COLUMN access_url VARCHAR(500)")
+
+
+def migration_002_query_indexes():
+    """按模型声明补齐缺失的索引：事件列表/概览、提醒调度、任务列表、审计日志与发件箱的常用筛选排序列"""
+    inspector = inspect(db.engine)
+    for table in db.Model.metadata.sorted_tables:
+        if not table.indexes:
+            continue
+        existing = {idx['name'] for idx in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"DEBUG: 创建索引 {table.name}.{index.name}")
+                index.create(db.engine)
+
+
+def migration_003_event_search():
+    """建立事件全文检索索引（依赖迁移 001 补齐的字段）"""
+    event_search_index.ensure_schema()
+
+
+def migration_004_event_no_sequence():
+    """建立事件编号日序列，按已有事件编号初始化各天的最大序号"""
+    EventNoSequence.__table__.create(db.engine, checkfirst=True)
+    existing = {day for (day,) in db.session.query(EventNoSequence.day)}
+    pattern = re.compile(rf'^{EVENT_NO_PREFIX}-(\d{{8}})-(\d+)$')
+    last_values = {}
+    for (event_no,) in db.session.query(Event.event_no).yield_per(5000):
+        match = pattern.match(event_no or '')
+        if match and match.group(1) not in existing:
+            day, value = match.group(1), int(match.group(2))
+            last_values[day] = max(last_values.get(day, 0), value)
+    if last_values:
+        db.session.bulk_insert_mappings(EventNoSequence, [{'day': day, 'last_value': value} for day, value in last_values.items()])
+    db.session.commit()
+
+
+def migration_005_change_log():
+    """建立数据变更日志表"""
+    ChangeLog.__table__.create(db.engine, checkfirst=True)
+
+
+# 事件归并字段，迁移 006 引入
+EVENT_GROUP_COLUMNS = {
+    'fingerprint': 'VARCHAR(40)',
+    'parent_id': 'INTEGER',
+    'duplicate_count': 'INTEGER DEFAULT 0',
+    'last_occurred_at': 'DATETIME'
+}
+
+
+def ensure_event_group_columns():
+    """补齐事件归并字段；早期迁移中按 ORM 模型查询事件时依赖这些字段，因此在执行迁移前调用"""
+    inspector = inspect(db.engine)
+    if not inspector.has_table('event'):
+        return
+    event_cols = {col['name'] for col in inspector.get_columns('event')}
+    for col, ddl in EVENT_GROUP_COLUMNS.items():
+        if col not in event_cols:
             with db.engine.begin() as conn:
-                conn.exec_driver_sql("ALTER TABLE business_system ADD COLUMN access_url VARCHAR(500)")
+                conn.exec_driver_sql(f"ALTER TABLE event ADD COLUMN {col} {ddl}")
+
+
+def migration_006_event_fingerprint():
+    """事件指纹：补齐字段，为已有事件计算指纹（不回溯归并历史事件），建立指纹与父事件索引"""
+    ensure_event_group_columns()
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE event SET duplicate_count = 0 WHERE duplicate_count IS NULL")
+        conn.exec_driver_sql("UPDATE event SET last_occurred_at = occurred_at WHERE last_occurred_at IS NULL")
+    rows = db.session.query(Event.id, Event.system_id, Event.event_type, Event.title) \
+        .filter(Event.fingerprint.is_(None)).all()
+    for start in range(0, len(rows), 1000):
+        db.session.bulk_update_mappings(Event, [
+            {'id': event_id, 'fingerprint': event_fingerprint(system_id, event_type, title)}
+            for event_id, system_id, event_type, title in rows[start:start + 1000]
+        ])
+        db.session.commit()
+    migration_002_query_indexes()
+
+
+# 数据库迁移列表：只允许在末尾追加，已发布的迁移不再修改
+SCHEMA_MIGRATIONS = [
+    (1, '补齐旧版数据库缺失的表与字段', migration_001_legacy_columns),
+    (2, '为常用筛选与排序列建立组合索引', migration_002_query_indexes),
+    (3, '建立事件全文检索索引', migration_003_event_search),
+    (4, '建立事件编号日序列', migration_004_event_no_sequence),
+    (5, '建立数据变更日志表', migration_005_change_log),
+    (6, '事件指纹与重复事件归并', migration_006_event_fingerprint),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+# 启动时发现数据库版本落后是否自动执行迁移；关闭后需在部署时执行 flask --app app migrate
+AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', 'True').lower() in ('1', 'true', 'yes')
+
+
+def current_schema_version():
+    """读取数据库当前结构版本，尚未建立版本表时返回 0"""
+    if not inspect(db.engine).has_table('schema_version'):
+        return 0
+    return db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+
 
+def run_migrations():
+    """按版本顺序执行全部未应用的迁移，返回本次执行的版本号列表
 
+    新库由 create_all 按模型直接建表（含索引），迁移函数均可重复执行，
+    多个进程同时迁移时以 schema_version 主键去重。
+    """
+    with app.app_context():
+        # 确保所有模型对应的表存在
+        db.create_all()
+        ensure_event_group_columns()
+        applied = {version for (version,) in db.session.query(SchemaVersion.version)}
+        executed = []
+        for version, name, migrate in SCHEMA_MIGRATIONS:
+            if version in applied:
+                continue
+            print(f">>> 执行数据库迁移 {version:03d}: {name}")
+            migrate()
+            try:
+                db.session.add(SchemaVersion(version=version, name=name))
+                db.session.commit()
+            except IntegrityError:
+                # 其他进程已同时完成该迁移
+                db.session.rollback()
+            executed.append(version)
+        db.session.remove()
+        change_feed.recording = True
+        return executed
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """执行数据库迁移：flask --app app migrate"""
+    executed = run_migrations()
+    if executed:
+        print(f"数据库迁移完成，已执行版本: {', '.join(str(v) for v in executed)}，当前版本 {SCHEMA_VERSION}")
+    else:
+        print(f"数据库已是最新版本 {SCHEMA_VERSION}，无需迁移")
 
 
+# ==================== 数据变更推送 ====================
+
+# 推送线程轮询变更日志的间隔、SSE 心跳间隔（秒）与变更日志保留时长（小时）
+CHANGE_FEED_POLL_SECONDS = float(os.getenv('CHANGE_FEED_POLL_SECONDS', '1'))
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv('CHANGE_FEED_HEARTBEAT_SECONDS', '25'))
+CHANGE_LOG_RETENTION_HOURS = int(os.getenv('CHANGE_LOG_RETENTION_HOURS', '24'))
+CHANGE_FEED_TOPICS = ('event', 'plan_task', 'audit')
+CHANGE_LOG_SCHEMA_VERSION = 5
+
+# 需要记录变更的模型 -> (推送主题, 所属记录 ID 字段)；子表的变更记为所属记录的更新
+CHANGE_FEED_MODELS = {
+    Event: ('event', 'id'),
+    EventProcess: ('event', 'event_id'),
+    EventAttachment: ('event', 'event_id'),
+    PlanTask: ('plan_task', 'id'),
+    PlanTaskPreparation: ('plan_task', 'task_id'),
+    NotificationAudit: ('audit', 'id'),
+}
+
+
+def record_changes(entity, entity_ids, action, session=None):
+    """在当前事务中记录一批变更，用于绕过 ORM 工作单元的批量写入（bulk_update_mappings、Core insert、query.update）"""
+    if not change_feed.recording or not entity_ids:
+        return
+    now = datetime.now()
+    (session or db.session).execute(ChangeLog.__table__.insert(), [
+        {'entity': entity, 'entity_id': entity_id, 'action': action, 'created_at': now} for entity_id in entity_ids
+    ])
+
+
+@sqlalchemy_event.listens_for(Session, 'after_flush')
+def record_flush_changes(session, flush_context):
+    """每次 flush 后把新增、修改、删除的事件/计划任务/通知审计写入变更日志，与业务数据同一事务提交"""
+    if not change_feed.recording:
+        return
+    changes = {}
+
+    def mark(obj, action):
+        spec = CHANGE_FEED_MODELS.get(type(obj))
+        if not spec:
+            return
+        entity, id_field = spec
+        entity_id = getattr(obj, id_field)
+        if entity_id is None:
+            return
+        if id_field != 'id':
+            action = 'updated'
+        # 同一记录既有新增/删除又有子表修改时，以新增/删除为准
+        if action != 'updated' or (entity, entity_id) not in changes:
+            changes[(entity, entity_id)] = action
+
+    for obj in session.new:
+        mark(obj, 'created')
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            mark(obj, 'updated')
+    for obj in session.deleted:
+        mark(obj, 'deleted')
+    if changes:
+        now = datetime.now()
+        session.connection().execute(ChangeLog.__table__.insert(), [
+            {'entity': entity, 'entity_id': entity_id, 'action': action, 'created_at': now}
+            for (entity, entity_id), action in changes.items()
+        ])
+
+
+class ChangeSubscriber:
+    """单个 SSE 连接的待推送队列；积压超过上限时丢弃并通知客户端整体刷新"""
+
+    def __init__(self, topics, max_pending=1000):
+        self.topics = set(topics)
+        self.max_pending = max_pending
+        self.overflow = False
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+
+    def put(self, changes):
+        changes = [change for change in changes if change['entity'] in self.topics]
+        if not changes:
+            return
+        with self._condition:
+            if len(self._pending) + len(changes) > self.max_pending:
+                self._pending.clear()
+                self.overflow = True
+            else:
+                self._pending.extend(changes)
+            self._condition.notify()
+
+    def get(self, timeout):
+        """等待新的变更，返回 (变更列表, 是否溢出)；超时返回空列表"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self.overflow, timeout)
+            changes, overflow = list(self._pending), self.overflow
+            self._pending.clear()
+            self.overflow = False
+            return changes, overflow
+
+
+class ChangeFeed:
+    """变更日志的进程内分发
+
+    每个进程一个后台线程轮询 change_log（仅在有订阅者时查询），把新增的变更分发给各 SSE 连接的队列，
+    连接数多少都只有这一条查询。变更日志随业务数据一起提交，因此多进程部署时各进程都能收到全部变更。
+    """
+
+    def __init__(self, poll_seconds=1.0, retention_hours=24, replay_limit=1000):
+        self.poll_seconds = poll_seconds
+        self.retention = timedelta(hours=retention_hours)
+        self.replay_limit = replay_limit
+        self.recording = False  # 变更日志表就绪后由 bootstrap_schema 打开
+        self.last_id = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._recent = collections.deque(maxlen=5000)  # 已分发的变更 ID，回看窗口内去重
+        self._recent_ids = set()
+        self._next_prune = 0
+
+    def subscribe(self, topics):
+        subscriber = ChangeSubscriber(topics)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def replay(self, after_id, topics):
+        """断线重连时补发 after_id 之后的变更；积压超过 replay_limit 时返回 None，由客户端整体刷新"""
+        with app.app_context():
+            try:
+                rows = ChangeLog.query.filter(ChangeLog.id > after_id, ChangeLog.entity.in_(list(topics))) \
+                    .order_by(ChangeLog.id).limit(self.replay_limit + 1).all()
+                if len(rows) > self.replay_limit:
+                    return None
+                return [self._as_change(row) for row in rows]
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def _as_change(row):
+        return {'id': row.id, 'entity': row.entity, 'entity_id': row.entity_id, 'action': row.action}
+
+    def _lookback(self):
+        # MySQL 等数据库的自增 ID 可能晚于更大的 ID 提交，回看一段已分发过的区间以免漏推；SQLite 写入串行无需回看
+        return 0 if db.engine.dialect.name == 'sqlite' else 200
+
+    def _poll(self):
+        if self.last_id is None:
+            self.last_id = db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+            return []
+        rows = ChangeLog.query.filter(ChangeLog.id > self.last_id - self._lookback()) \
+            .order_by(ChangeLog.id).limit(1000).all()
+        changes = []
+        for row in rows:
+            if row.id in self._recent_ids:
+                continue
+            if len(self._recent) == self._recent.maxlen:
+                self._recent_ids.discard(self._recent[0])
+            self._recent.append(row.id)
+            self._recent_ids.add(row.id)
+            self.last_id = max(self.last_id, row.id)
+            changes.append(self._as_change(row))
+        return changes
+
+    def _prune(self):
+        if time.monotonic() < self._next_prune:
+            return
+        self._next_prune = time.monotonic() + 600
+        deleted = ChangeLog.query.filter(ChangeLog.created_at < datetime.now() - self.retention).delete(synchronize_session=False)
+        db.session.commit()
+        if deleted:
+            print(f"DEBUG: 清理过期变更日志 {deleted} 条")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+            if not self._subscribers:
+                # 无订阅者时不查询，下次有连接时从最新版本开始
+                self.last_id = None
+                continue
+            try:
+                with app.app_context():
+                    try:
+                        changes = self._poll()
+                        self._prune()
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"ERROR: 变更日志轮询异常: {e}")
+                continue
+            if changes:
+                with self._lock:
+                    subscribers = list(self._subscribers)
+                for subscriber in subscribers:
+                    subscriber.put(changes)
+
+
+change_feed = ChangeFeed(poll_seconds=CHANGE_FEED_POLL_SECONDS, retention_hours=CHANGE_LOG_RETENTION_HOURS)
+
 
 schema_bootstrapped = False
 schema_bootstrap_lock = threading.Lock()
 
 def bootstrap_schema():
+    """进程启动时只检查结构版本，版本落后时按配置自动迁移或提示执行迁移命令"""
     global schema_bootstrapped
     if schema_bootstrapped:
         return
     with schema_bootstrap_lock:
         if schema_bootstrapped:
             return
-        ensure_plan_task_schema()
+        with app.app_context():
+            version = current_schema_version()
+            if version < SCHEMA_VERSION:
+                if AUTO_MIGRATE:
+                    run_migrations()
+                else:
+                    print(f"WARNING: 数据库结构版本 {version} 落后于程序版本 {SCHEMA_VERSION}，请执行 flask --app app migrate")
+            event_search_index.detect()
+            change_feed.recording = current_schema_version() >= CHANGE_LOG_SCHEMA_VERSION
+            db.session.remove()
         schema_bootstrapped = True
 
 app.before_request(bootstrap_schema)
@@ -383,14 +1247,117 @@ except Exception as e:
 # 在应用启动时立即开启后台线程
 
 def start_background_worker():
+    # flask migrate、import-events 等命令行进程只做一次性操作，不能接管调度租约或发送提醒；flask run 除外
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        ctx = click.get_current_context(silent=True)
+        if ctx is None or ctx.info_name != 'run':
+            return
     # 避免在 Flask debug 模式下启动两次
     if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not app.debug:
         with app.app_context():
             reminder_thread = threading.Thread(target=background_reminder_worker, daemon=True)
             reminder_thread.start()
+            delivery_thread = threading.Thread(target=background_delivery_worker, daemon=True)
+            delivery_thread.start()
+            lease_thread = threading.Thread(target=background_lease_worker, daemon=True)
+            lease_thread.start()
+            atexit.register(release_reminder_lease)
             print(">>> 计划任务提醒后台服务已成功启动")
 
 
+class WebhookHttpClient:
+    """复用连接的 Webhook HTTP 客户端（仅依赖标准库 http.client）
+
+    按 (协议, 主机, 端口) 维护空闲连接池，同一机器人的多条消息复用同一条 TCP/TLS 连接，
+    避免每条消息都重新握手。连接空闲超过 idle_timeout 或被服务端关闭时自动重建。
+    """
+
+    def __init__(self, pool_size=4, timeout=10, idle_timeout=50):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._idle = {}  # (scheme, host, port) -> [(连接, 归还时间)]
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections_created': 0, 'connections_reused': 0}
+
+    def _checkout(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self.stats['requests'] += 1
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, returned_at = idle.pop()
+                if now - returned_at <= self.idle_timeout:
+                    self.stats['connections_reused'] += 1
+                    return conn, True
+                conn.close()
+            self.stats['connections_created'] += 1
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return conn, False
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def post(self, url, body, headers):
+        """发送 POST 请求，返回 (状态码, 响应文本)"""
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise ValueError(f"不支持的协议: {parts.scheme}")
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        while True:
+            conn, reused = self._checkout(key)
+            try:
+                conn.request('POST', path, body=body, headers=headers)
+                response = conn.getresponse()
+                result = response.read().decode('utf-8')
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    http.client.BadStatusLine, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # 复用的空闲连接可能已被服务端关闭，换一条新连接重试一次
+                if reused:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return response.status, result
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+
+# WEBHOOK_POOL_SIZE=0 时关闭连接复用，回退为每次新建 urllib 连接
+WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', '10'))
+webhook_pool_size = int(os.getenv('WEBHOOK_POOL_SIZE', '4'))
+webhook_http_client = WebhookHttpClient(
+    pool_size=webhook_pool_size,
+    timeout=WEBHOOK_TIMEOUT,
+    idle_timeout=float(os.getenv('WEBHOOK_IDLE_SECONDS', '50'))
+) if webhook_pool_size > 0 else None
+
+
 def send_dingtalk_notification(webhook_url, message, title=None):
 
 
@@ -419,17 +1386,24 @@ def send_dingtalk_notification(webhook_url, message, title=None):
             }
         
         encoded_data = json.dumps(data).encode('utf-8')
-        proxy_handler = urllib.request.ProxyHandler({})
-        opener = urllib.request.build_opener(proxy_handler)
-        
-        req = urllib.request.Request(webhook_url, data=encoded_data, headers={'Content-Type': 'application/json'})
-        with opener.open(req, timeout=10) as response:
-            result = response.read().decode('utf-8')
-            res_json = json.loads(result)
-            if res_json.get('errcode') == 0:
-                return True, "发送成功"
-            else:
-                return False, f"钉钉返回错误: {res_json.get('errmsg')}"
+        headers = {'Content-Type': 'application/json'}
+        if webhook_http_client:
+            status, result = webhook_http_client.post(webhook_url, encoded_data, headers)
+            if status >= 400:
+                return False, f"发送失败: HTTP {status}"
+        else:
+            proxy_handler = urllib.request.ProxyHandler({})
+            opener = urllib.request.build_opener(proxy_handler)
+
+            req = urllib.request.Request(webhook_url, data=encoded_data, headers=headers)
+            with opener.open(req, timeout=WEBHOOK_TIMEOUT) as response:
+                result = response.read().decode('utf-8')
+
+        res_json = json.loads(result)
+        if res_json.get('errcode') == 0:
+            return True, "发送成功"
+        else:
+            return False, f"钉钉返回错误: {res_json.get('errmsg')}"
     except Exception as e:
         print(f"DEBUG: 钉钉发送异常: {str(e)}")
         return False, f"发送失败: {str(e)}"
@@ -437,8 +1411,38 @@ def send_dingtalk_notification(webhook_url, message, title=None):
 
 
 
+class CompiledCron:
+    """预编译的 Cron 表达式：表达式只解析一次，计算时仅重置起点"""
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._iter = croniter(expression, datetime.now())
+        self._lock = threading.Lock()
+
+    def next_after(self, base_time, count=1):
+        with self._lock:
+            self._iter.set_current(base_time)
+            return [self._iter.get_next(datetime) for _ in range(count)]
+
+
+@functools.lru_cache(maxsize=512)
+def compile_cron(expression):
+    """编译并缓存 Cron 表达式"""
+    return CompiledCron(expression)
+
+
+def month_occurrence(template_time, year, month, target_day):
+    """返回指定年月中的目标日期（超过当月天数时取月末），保留 template_time 的时分秒"""
+    last_day = calendar.monthrange(year, month)[1]
+    return template_time.replace(year=year, month=month, day=min(target_day, last_day))
+
+
 def calculate_next_run_time(current_plan_time, schedule_type, schedule_value=None, base_time=None):
-    """根据周期类型计算下一次执行时间"""
+    """根据周期类型计算下一次执行时间
+
+    daily/weekly/monthly 直接按间隔算出跨过 base_time 所需的周期数，
+    即使计划时间落后多年也只需常数次运算。
+    """
     if schedule_type == 'once':
         return None
     
@@ -447,26 +1451,25 @@ def calculate_next_run_time(current_plan_time, schedule_type, schedule_value=Non
     
     next_time = current_plan_time
 
-    if schedule_type == 'daily':
-        # 如果当前计划时间已经过了（或等于基准时间），加一天
-        while next_time <= base_time:
-            next_time += timedelta(days=1)
-            
-    elif schedule_type == 'weekly':
-        try:
-            target_weekday = int(schedule_value) # 0-6 (Mon-Sun)
-        except (ValueError, TypeError):
-            target_weekday = 0
-            
-        # 调整到目标星期
-        days_ahead = target_weekday - next_time.weekday()
-        if days_ahead < 0:
-            days_ahead += 7
-        next_time += timedelta(days=days_ahead)
-        
-        # 如果调整后还是过去的时间（或等于基准时间），则加一周
-        while next_time <= base_time:
-            next_time += timedelta(weeks=1)
+    if schedule_type in ('daily', 'weekly'):
+        if schedule_type == 'weekly':
+            try:
+                target_weekday = int(schedule_value) # 0-6 (Mon-Sun)
+            except (ValueError, TypeError):
+                target_weekday = 0
+
+            # 调整到目标星期
+            days_ahead = target_weekday - next_time.weekday()
+            if days_ahead < 0:
+                days_ahead += 7
+            next_time += timedelta(days=days_ahead)
+            interval = timedelta(weeks=1)
+        else:
+            interval = timedelta(days=1)
+
+        # 如果当前计划时间已经过了（或等于基准时间），直接跳过所需的整周期数
+        if next_time <= base_time:
+            next_time += interval * ((base_time - next_time) // interval + 1)
             
     elif schedule_type == 'monthly':
         try:
@@ -474,30 +1477,21 @@ def calculate_next_run_time(current_plan_time, schedule_type, schedule_value=Non
         except (ValueError, TypeError):
             target_day = 1
             
-        import calendar
         # 调整到目标日期
-        month = next_time.month
-        year = next_time.year
-        last_day = calendar.monthrange(year, month)[1]
-        actual_day = min(target_day, last_day)
-        next_time = next_time.replace(day=actual_day)
+        next_time = month_occurrence(next_time, next_time.year, next_time.month, target_day)
         
-        # 如果调整后还是过去的时间（或等于基准时间），则增加月份
-        while next_time <= base_time:
-            month = next_time.month + 1
-            year = next_time.year
-            if month > 12:
-                month = 1
-                year += 1
-            last_day = calendar.monthrange(year, month)[1]
-            actual_day = min(target_day, last_day)
-            next_time = next_time.replace(year=year, month=month, day=actual_day)
+        # 如果调整后还是过去的时间（或等于基准时间），直接跳到基准时间所在月份，仍未超过则再加一个月
+        if next_time <= base_time:
+            month_index = base_time.year * 12 + base_time.month - 1
+            next_time = month_occurrence(next_time, month_index // 12, month_index % 12 + 1, target_day)
+            if next_time <= base_time:
+                month_index += 1
+                next_time = month_occurrence(next_time, month_index // 12, month_index % 12 + 1, target_day)
             
     elif schedule_type == 'cron':
         if croniter and schedule_value:
             try:
-                iter = croniter(schedule_value, base_time)
-                return iter.get_next(datetime)
+                return compile_cron(schedule_value).next_after(base_time)[0]
             except Exception as e:
                 print(f"DEBUG: Cron解析异常: {str(e)}")
                 return next_time
@@ -507,10 +1501,1306 @@ def calculate_next_run_time(current_plan_time, schedule_type, schedule_value=Non
     return next_time
 
 
+def calculate_next_run_times(current_plan_time, schedule_type, schedule_value=None, count=1, base_time=None):
+    """计算 base_time 之后连续 count 次执行时间（一次性任务返回尚未到达的计划时间）"""
+    if base_time is None:
+        base_time = datetime.now()
+    if schedule_type == 'once' or not schedule_type:
+        return [current_plan_time] if current_plan_time and current_plan_time > base_time else []
+
+    if schedule_type == 'cron' and croniter and schedule_value:
+        try:
+            return compile_cron(schedule_value).next_after(base_time, count)
+        except Exception as e:
+            print(f"DEBUG: Cron解析异常: {str(e)}")
+            return []
+
+    results = []
+    plan_time = current_plan_time
+    for _ in range(count):
+        next_time = calculate_next_run_time(plan_time, schedule_type, schedule_value, base_time=base_time)
+        if next_time is None or next_time <= base_time:
+            break
+        results.append(next_time)
+        plan_time = base_time = next_time
+    return results
+
+
+def batch_next_run_times(tasks, count=1, base_time=None):
+    """批量计算多个计划任务之后的 count 次执行时间，返回 {任务ID: [执行时间, ...]}"""
+    if base_time is None:
+        base_time = datetime.now()
+    return {
+        task.id: calculate_next_run_times(task.plan_time, task.schedule_type, task.schedule_value, count=count, base_time=base_time)
+        for task in tasks
+    }
+
+
+class OccurrenceIndex:
+    """计划任务执行日历索引
+
+    将待执行/进行中的计划任务在 [今天, 今天 + horizon_days] 内的全部执行时间
+    预先展开，按日期分桶保存。任务变更时只重新展开对应任务；
+    其他进程的变更通过租约行上的版本号感知后增量同步；跨天后整体重建。
+    超出索引窗口的查询直接按周期规则现场展开。
+    """
+
+    def __init__(self, horizon_days=180, max_per_task=2000):
+        self.horizon_days = horizon_days
+        self.max_per_task = max_per_task
+        self._days = {}       # date -> [(执行时间, 任务ID, 格式化时间)]，按时间有序
+        self._by_task = {}    # 任务ID -> 该任务出现过的日期集合
+        self._tasks = {}      # 任务ID -> 任务摘要
+        self._cron_cache = {}  # Cron 表达式 -> 窗口内的执行时间
+        self._built_on = None
+        self._window = None
+        self._revision = None
+        self._synced_at = None
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _task_query():
+        return db.session.query(
+            PlanTask.id, PlanTask.title, PlanTask.task_type, PlanTask.schedule_type,
+            PlanTask.schedule_value, PlanTask.plan_time, PlanTask.owner, PlanTask.status
+        ).filter(PlanTask.status.in_(REMINDER_ACTIVE_STATUSES))
+
+    def expand(self, row, start, end, cron_cache=None):
+        """展开任务在 [start, end] 内的执行时间
+
+        同一 Cron 表达式在窗口内的执行时间只计算一次，通过 cron_cache 在任务间共享。
+        """
+        occurrences = []
+        if row.plan_time is None:
+            return occurrences
+        if start <= row.plan_time <= end:
+            occurrences.append(row.plan_time)
+        if row.schedule_type not in ('daily', 'weekly', 'monthly', 'cron'):
+            return occurrences
+
+        base_time = max(row.plan_time, start - timedelta(microseconds=1))
+        if row.schedule_type == 'cron':
+            if cron_cache is None:
+                cron_cache = {}
+            if row.schedule_value not in cron_cache:
+                series = []
+                cursor = start - timedelta(microseconds=1)
+                while len(series) < self.max_per_task:
+                    batch = calculate_next_run_times(None, 'cron', row.schedule_value, count=64, base_time=cursor)
+                    series.extend(t for t in batch if t <= end)
+                    if not batch or batch[-1] > end:
+                        break
+                    cursor = batch[-1]
+                cron_cache[row.schedule_value] = series
+            series = cron_cache[row.schedule_value]
+            position = bisect.bisect_right(series, base_time)
+            occurrences.extend(series[position:position + self.max_per_task - len(occurrences)])
+            return occurrences
+
+        next_time = calculate_next_run_time(row.plan_time, row.schedule_type, row.schedule_value, base_time=base_time)
+        while next_time and next_time <= end and len(occurrences) < self.max_per_task:
+            occurrences.append(next_time)
+            next_time = calculate_next_run_time(next_time, row.schedule_type, row.schedule_value, base_time=next_time)
+        return occurrences
+
+    @staticmethod
+    def _summary(row):
+        return {
+            'task_id': row.id,
+            'title': row.title,
+            'task_type': row.task_type,
+            'schedule_type': row.schedule_type,
+            'owner': row.owner,
+            'status': row.status
+        }
+
+    def _remove_task(self, task_id):
+        for day in self._by_task.pop(task_id, ()):
+            bucket = self._days.get(day)
+            if bucket:
+                bucket[:] = [entry for entry in bucket if entry[1] != task_id]
+        self._tasks.pop(task_id, None)
+
+    def _add_task(self, row):
+        start, end = self._window
+        days = set()
+        for occurred in self.expand(row, start, end, self._cron_cache):
+            bisect.insort(self._days.setdefault(occurred.date(), []), (occurred, row.id, occurred.strftime('%Y-%m-%d %H:%M')))
+            days.add(occurred.date())
+        self._by_task[row.id] = days
+        self._tasks[row.id] = self._summary(row)
+
+    def _rebuild(self, today):
+        start = datetime.combine(today, datetime.min.time())
+        self._window = (start, start + timedelta(days=self.horizon_days + 1) - timedelta(microseconds=1))
+        self._days = {}
+        self._by_task = {}
+        self._tasks = {}
+        self._cron_cache = {}
+        for row in self._task_query().all():
+            self._add_task(row)
+        self._built_on = today
+        self._dirty = set()
+
+    def _refresh_tasks(self, task_ids):
+        rows = {row.id: row for row in self._task_query().filter(PlanTask.id.in_(list(task_ids))).all()}
+        for task_id in task_ids:
+            self._remove_task(task_id)
+            if task_id in rows:
+                self._add_task(rows[task_id])
+
+    def invalidate(self, task_ids):
+        """本进程修改任务后调用，下次查询时重新展开这些任务"""
+        with self._lock:
+            self._dirty.update(task_ids)
+
+    def _sync(self):
+        now = datetime.now()
+        try:
+            revision = reminder_lease.read_revision()
+        except Exception:
+            revision = None
+
+        if self._built_on != now.date():
+            self._rebuild(now.date())
+        elif revision != self._revision and self._synced_at is not None:
+            # 其他进程修改过任务：同步最近更新的任务，并剔除已删除的任务
+            changed = {row.id for row in db.session.query(PlanTask.id).filter(
+                PlanTask.updated_at >= self._synced_at - timedelta(minutes=5))}
+            existing = {row.id for row in db.session.query(PlanTask.id)}
+            self._dirty |= changed | (set(self._tasks) - existing)
+        if self._dirty:
+            dirty, self._dirty = self._dirty, set()
+            self._refresh_tasks(dirty)
+        self._revision = revision
+        self._synced_at = now
+
+    def query(self, start, end):
+        """返回 [start, end] 内按时间排序的 (格式化时间, 任务ID) 列表及涉及任务的摘要"""
+        with self._lock:
+            self._sync()
+            window_start, window_end = self._window
+            if start >= window_start and end <= window_end:
+                items = []
+                day = start.date()
+                while day <= end.date():
+                    for occurred, task_id, formatted in self._days.get(day, ()):
+                        if start <= occurred <= end:
+                            items.append((formatted, task_id))
+                    day += timedelta(days=1)
+                return items, {task_id: self._tasks[task_id] for _, task_id in items}
+
+        # 超出索引窗口，直接展开
+        entries = []
+        tasks = {}
+        cron_cache = {}
+        for row in self._task_query().all():
+            occurrences = self.expand(row, start, end, cron_cache)
+            if occurrences:
+                tasks[row.id] = self._summary(row)
+                entries.extend((occurred, row.id) for occurred in occurrences)
+        entries.sort()
+        return [(occurred.strftime('%Y-%m-%d %H:%M'), task_id) for occurred, task_id in entries], tasks
+
+
+occurrence_index = OccurrenceIndex(horizon_days=int(os.getenv('OCCURRENCE_INDEX_DAYS', '180')))
+
+
+# 提醒时间窗口：计划时间过后超过该时长的提醒不再发送
+REMINDER_GRACE_PERIOD = timedelta(hours=1)
+# 提醒时需要关注的任务状态
+REMINDER_ACTIVE_STATUSES = ['待执行', '进行中']
+
+
+class AlertRobotRegistry:
+    """告警机器人注册表
+
+    缓存 alert_robots 配置并按机器人名称、Webhook 建立索引，
+    配置被增删改时由配置接口调用 invalidate() 失效；
+    其他进程修改配置时依赖 ttl 到期后重新加载。
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._by_name = None
+        self._by_webhook = {}
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse(config_value):
+        """解析机器人配置，兼容 JSON 列表与 “名称|Webhook,名称|Webhook” 两种格式"""
+        if not config_value:
+            return []
+        try:
+            parsed = json.loads(config_value)
+            if isinstance(parsed, list):
+                return [{
+                    'name': (item.get('name') or '').strip(),
+                    'webhook': (item.get('webhook') or '').strip()
+                } for item in parsed if isinstance(item, dict) and (item.get('name') or '').strip()]
+        except ValueError:
+            pass
+        robots = []
+        for item in config_value.split(','):
+            name, _, webhook = item.partition('|')
+            if name.strip():
+                robots.append({'name': name.strip(), 'webhook': webhook.strip()})
+        return robots
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._by_name is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._by_name
+        config = SystemConfig.query.filter_by(config_key='alert_robots').first()
+        robots = self.parse(config.config_value if config else None)
+        by_name = {}
+        by_webhook = {}
+        for robot in robots:
+            by_name.setdefault(robot['name'], robot)
+            if robot['webhook']:
+                by_webhook.setdefault(robot['webhook'], robot)
+        with self._lock:
+            self._by_name = by_name
+            self._by_webhook = by_webhook
+            self._loaded_at = time.monotonic()
+        return by_name
+
+    def invalidate(self):
+        with self._lock:
+            self._by_name = None
+
+    def get(self, name):
+        if not name:
+            return None
+        return self._ensure_loaded().get(name)
+
+    def get_webhook(self, name):
+        robot = self.get(name)
+        return robot['webhook'] if robot else None
+
+    def name_for_webhook(self, webhook_url):
+        self._ensure_loaded()
+        robot = self._by_webhook.get((webhook_url or '').strip())
+        return robot['name'] if robot else None
+
+
+alert_robot_registry = AlertRobotRegistry(ttl=int(os.getenv('ROBOT_REGISTRY_TTL', '300')))
+
+
+def resolve_task_webhook(task):
+    """获取任务的 Webhook 地址，数据库未保存时按机器人名称从注册表中兜底读取"""
+    return task.webhook_url or alert_robot_registry.get_webhook(task.alert_robot)
+
+
+class ReminderTemplate:
+    """编译后的提醒模板
+
+    模板只解析一次，拆分为字面量与占位符片段，渲染时按顺序拼接，
+    耗时只与模板长度有关，不随占位符数量增加；未知占位符原样保留。
+    """
+
+    PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+    def __init__(self, source):
+        # 处理换行符：将字面量 \n 替换为实际换行符，并统一换行格式
+        source = source.replace('\\n', '\n').replace('\r\n', '\n')
+        self.parts = []   # 字面量为 str，占位符为 (名称,)
+        position = 0
+        for match in self.PLACEHOLDER.finditer(source):
+            if match.start() > position:
+                self.parts.append(source[position:match.start()])
+            self.parts.append((match.group(1),))
+            position = match.end()
+        if position < len(source):
+            self.parts.append(source[position:])
+
+    def render(self, context):
+        output = []
+        for part in self.parts:
+            if isinstance(part, str):
+                output.append(part)
+            elif part[0] in context:
+                output.append(str(context[part[0]]))
+            else:
+                output.append('{' + part[0] + '}')
+        return ''.join(output)
+
+
+# 钉钉 Markdown 提醒卡片，可引用的变量见 reminder_context()
+REMINDER_CARD_TITLE = ReminderTemplate("⏰ 计划任务提醒: {title}")
+REMINDER_CARD_HEADER = "### ⏰ 计划任务提醒\n\n"
+# 单个任务的提醒段落，单条提醒卡片与汇总通知共用
+REMINDER_SECTION_SOURCE = (
+    "**任务名称**: <font color='#1d4ed8'>{title}</font>\n\n"
+    "--- \n\n"
+    "📅 **计划时间**: {plan_time}\n\n"
+    "👤 **主负责人**: {owner}\n\n"
+    "👥 **责任人**: {responsible}\n\n"
+    "📊 **当前进度**: `{prep_progress}`\n\n"
+    "📝 **准备事项**:\n\n{preparations}\n\n"
+)
+REMINDER_CARD_TEMPLATE = ReminderTemplate(REMINDER_CARD_HEADER + REMINDER_SECTION_SOURCE)
+REMINDER_SECTION_TEMPLATE = ReminderTemplate(REMINDER_SECTION_SOURCE)
+
+
+def reminder_context(title, plan_time, owner=None, responsible=None, preparations=(), **extra):
+    """构建提醒模板变量，preparations 为 (状态, 描述) 列表"""
+    preparations = list(preparations)
+    completed_count = len([p for p in preparations if p[0] == '已完成'])
+    # 使用符号更直观地展示状态
+    prep_text_list = [f"{'✅' if status == '已完成' else '⬜'} {description}" for status, description in preparations]
+    context = {
+        'title': title,
+        'plan_time': plan_time.strftime('%Y-%m-%d %H:%M') if isinstance(plan_time, datetime) else plan_time,
+        'owner': owner or '未指定',
+        'responsible': responsible or '未指定',
+        'preparations': '\n\n'.join(prep_text_list) if prep_text_list else '无',
+        'prep_progress': f"{completed_count}/{len(preparations)}"
+    }
+    context.update(extra)
+    return context
+
+
+def render_reminder(context, template=None):
+    """渲染提醒卡片，返回 (Markdown 标题, Markdown 正文)，template 默认为完整提醒卡片"""
+    template = template or REMINDER_CARD_TEMPLATE
+    return REMINDER_CARD_TITLE.render(context), template.render(context)
+
+
+def render_task_reminders(tasks, template=None):
+    """批量渲染计划任务提醒，准备事项一次查询取回，返回 {任务ID: (标题, 正文)}
+
+    template 传入 REMINDER_SECTION_TEMPLATE 时只渲染单个任务段落，供汇总通知拼接。
+    """
+    task_ids = [task.id for task in tasks]
+    preparations = {}
+    if task_ids:
+        rows = db.session.query(
+            PlanTaskPreparation.task_id, PlanTaskPreparation.status, PlanTaskPreparation.description
+        ).filter(PlanTaskPreparation.task_id.in_(task_ids)).order_by(
+            PlanTaskPreparation.task_id, PlanTaskPreparation.order_no, PlanTaskPreparation.id
+        ).all()
+        for task_id, status, description in rows:
+            preparations.setdefault(task_id, []).append((status, description))
+
+    rendered = {}
+    for task in tasks:
+        context = reminder_context(
+            task.title, task.plan_time, task.owner, task.responsible, preparations.get(task.id, ()),
+            task_type=task.task_type,
+            description=task.description or '',
+            reminder_minutes=task.reminder_minutes
+        )
+        rendered[task.id] = render_reminder(context, template)
+    return rendered
+
+
+def prepare_task_reminder(task, now, horizon=None):
+    """检查到期任务并确定发送目标，返回待发送的通知，无需发送时返回 None
+
+    horizon 为汇总模式下的提前量截止时间，提醒点不晚于 horizon 的任务也视为到期。
+    """
+    reminder_time = task.plan_time - timedelta(minutes=task.reminder_minutes or 0)
+    if not (reminder_time <= (horizon or now) and now <= task.plan_time + REMINDER_GRACE_PERIOD):
+        return None
+
+    print(f"DEBUG: 任务[{task.title}] 满足时间条件 (提醒点:{reminder_time.strftime('%H:%M:%S')}, 计划:{task.plan_time.strftime('%H:%M:%S')})")
+
+    webhook_url = resolve_task_webhook(task)
+    if not webhook_url:
+        print(f"DEBUG: 任务[{task.title}] 满足条件但无法获取 Webhook，标记为已处理以避免死循环")
+        task.reminder_sent = True
+        return None
+
+    print(f"DEBUG: 任务[{task.title}] 准备发送通知...")
+    return {
+        'task': task,
+        'webhook_url': webhook_url.strip(),
+        'reminder_time': reminder_time
+    }
+
+
+def advance_task_reminder(task):
+    """提醒已写入发件箱后推进任务：一次性任务标记已提醒，周期任务顺延到下一次执行时间"""
+    if task.schedule_type == 'once':
+        task.reminder_sent = True
+    else:
+        # 使用 task.plan_time 作为基准，强制计算“下一个”周期
+        next_run = calculate_next_run_time(task.plan_time, task.schedule_type, task.schedule_value, base_time=task.plan_time)
+        if next_run:
+            print(f"DEBUG: 周期任务[{task.title}]，更新计划时间从 {task.plan_time} 到 {next_run}")
+            task.plan_time = next_run
+            task.reminder_sent = False
+        else:
+            task.reminder_sent = True
+
+
+def enqueue_task_reminder(job):
+    """将渲染好的提醒写入发件箱，并推进任务的提醒状态与计划时间
+
+    发件箱与任务状态在同一事务中提交，网络发送交由投递线程完成，
+    发送失败时由投递线程重试，提醒不会因一次失败而丢失。
+    """
+    task = job['task']
+    db.session.add(NotificationOutbox(
+        task_id=task.id,
+        task_title=task.title,
+        robot_name=task.alert_robot,
+        webhook_url=job['webhook_url'],
+        msg_type='markdown',
+        title=job['title'],
+        content=job['content'],
+        status='待发送',
+        attempts=0,
+        next_attempt_at=datetime.now(),
+        due_at=job['reminder_time']
+    ))
+    advance_task_reminder(task)
+
+
+# 汇总窗口（秒）：大于 0 时，同一 Webhook 在窗口内陆续到期的提醒合并为一条汇总通知，0 表示逐条发送
+REMINDER_DIGEST_WINDOW = max(0, int(os.getenv('REMINDER_DIGEST_WINDOW', '0')))
+
+
+def enqueue_reminder_digest(jobs):
+    """将同一 Webhook 的多条提醒合并为一条汇总通知写入发件箱，并逐个推进任务
+
+    汇总正文由各任务的提醒段落拼接而成，发件箱与审计记录通过 task_ids 关联全部任务。
+    """
+    tasks = [job['task'] for job in jobs]
+    sections = render_task_reminders(tasks, REMINDER_SECTION_TEMPLATE)
+    titles = '、'.join(task.title for task in tasks)
+    markdown_title = f"⏰ 计划任务提醒汇总 ({len(tasks)} 条)"
+    markdown_text = f"### ⏰ 计划任务提醒汇总\n\n共 {len(tasks)} 条计划任务即将执行：\n\n" + \
+                    '\n\n'.join(f"#### {index}. {task.title}\n\n{sections[task.id][1]}" for index, task in enumerate(tasks, 1))
+    robot_names = {task.alert_robot for task in tasks if task.alert_robot}
+    robot_name = robot_names.pop() if len(robot_names) == 1 else alert_robot_registry.name_for_webhook(jobs[0]['webhook_url'])
+    db.session.add(NotificationOutbox(
+        task_id=None,
+        task_ids=','.join(str(task.id) for task in tasks),
+        task_title=f"计划任务提醒汇总: {titles}"[:200],
+        robot_name=robot_name,
+        webhook_url=jobs[0]['webhook_url'],
+        msg_type='markdown',
+        title=markdown_title,
+        content=markdown_text,
+        status='待发送',
+        attempts=0,
+        next_attempt_at=datetime.now(),
+        due_at=min(job['reminder_time'] for job in jobs)
+    ))
+    for task in tasks:
+        advance_task_reminder(task)
+
+
+# 追赶停机期间错过的提醒时，是否按机器人汇总发送一条“停机期间错过提醒”通知
+REMINDER_CATCHUP_DIGEST = os.getenv('REMINDER_CATCHUP_DIGEST', 'False').lower() in ('1', 'true', 'yes')
+
+
+def catch_up_missed_reminders(now):
+    """处理已错过提醒窗口的任务（服务停机或调度中断导致）
+
+    周期任务一次性顺延到下一个仍可提醒的执行时间，一次性任务标记为已处理，
+    全部通过一条批量 UPDATE 提交；开启 REMINDER_CATCHUP_DIGEST 时按机器人汇总发送一条补发通知。
+    返回处理的任务数。
+    """
+    overdue = PlanTask.query.filter(
+        PlanTask.status.in_(REMINDER_ACTIVE_STATUSES),
+        PlanTask.reminder_enabled == True,
+        PlanTask.reminder_sent == False,
+        PlanTask.plan_time < now - REMINDER_GRACE_PERIOD
+    ).all()
+    if not overdue:
+        return 0
+
+    mappings = []
+    missed_by_webhook = {}
+    for task in overdue:
+        next_run = None
+        if task.schedule_type != 'once':
+            # 跳到提醒窗口尚未结束的下一次执行时间
+            next_run = calculate_next_run_time(task.plan_time, task.schedule_type, task.schedule_value, base_time=now - REMINDER_GRACE_PERIOD)
+            if next_run is not None and next_run <= task.plan_time:
+                next_run = None
+        if next_run:
+            mappings.append({'id': task.id, 'plan_time': next_run, 'reminder_sent': False, 'updated_at': now})
+        else:
+            mappings.append({'id': task.id, 'reminder_sent': True, 'updated_at': now})
+
+        if REMINDER_CATCHUP_DIGEST:
+            webhook_url = resolve_task_webhook(task)
+            if webhook_url:
+                missed_by_webhook.setdefault(webhook_url.strip(), []).append((task, next_run))
+
+    db.session.bulk_update_mappings(PlanTask, mappings)
+    record_changes('plan_task', [mapping['id'] for mapping in mappings], 'updated')
+
+    for webhook_url, missed in missed_by_webhook.items():
+        lines = []
+        for task, next_run in missed:
+            line = f"- **{task.title}**：原计划 {task.plan_time.strftime('%Y-%m-%d %H:%M')}"
+            if next_run:
+                line += f"，已顺延至 {next_run.strftime('%Y-%m-%d %H:%M')}"
+            lines.append(line)
+        markdown_title = f"⏰ 停机期间错过的计划任务提醒 ({len(missed)} 条)"
+        markdown_text = f"### ⏰ 停机期间错过的计划任务提醒\n\n" \
+                        f"以下 {len(missed)} 条任务的提醒时间在服务停机期间已过，未能按时提醒：\n\n" + \
+                        '\n'.join(lines) + '\n\n'
+        db.session.add(NotificationOutbox(
+            task_id=missed[0][0].id if len(missed) == 1 else None,
+            task_title=f"停机期间错过提醒 {len(missed)} 条",
+            robot_name=missed[0][0].alert_robot,
+            webhook_url=webhook_url,
+            msg_type='markdown',
+            title=markdown_title,
+            content=markdown_text,
+            status='待发送',
+            attempts=0,
+            next_attempt_at=now
+        ))
+
+    db.session.commit()
+    print(f"DEBUG: 追赶处理 {len(overdue)} 条错过提醒窗口的任务，其中 {len([m for m in mappings if 'plan_time' in m])} 条周期任务已顺延")
+    if missed_by_webhook:
+        delivery_worker.notify()
+    occurrence_index.invalidate([task.id for task in overdue])
+    return len(overdue)
+
+
+# 通知发送线程池：互不相关的 Webhook 并行发送，一轮耗时取决于最慢的单个请求
+notification_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('REMINDER_DISPATCH_WORKERS', '8')),
+    thread_name_prefix='dingtalk-dispatch'
+)
+
+
+def dispatch_notifications(jobs):
+    """并行发送一批通知，按 jobs 顺序返回 (success, msg) 列表，每个 job 的请求耗时（秒）写入 job['latency']"""
+    def send(job):
+        print(f"DEBUG: 正在向 {job['webhook_url']} 发送通知")
+        started = time.monotonic()
+        try:
+            return send_dingtalk_notification(job['webhook_url'], job['content'], title=job['title'])
+        finally:
+            job['latency'] = time.monotonic() - started
+
+    futures = [notification_executor.submit(send, job) for job in jobs]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append((False, f"发送失败: {str(e)}"))
+    return results
+
+
+class WebhookRateLimiter:
+    """按 Webhook 地址划分的令牌桶限流器
+
+    钉钉机器人每分钟约只接受 20 条消息，超出部分会被拒绝。
+    每个 Webhook 一个令牌桶，超过速率的发送被延后而不是丢弃：
+    acquire() 按先来后到排队等待令牌，try_acquire() 不等待，预留名额后返回还需等待的秒数。
+    """
+
+    def __init__(self, capacity=20, period=60):
+        self.capacity = capacity
+        self.rate = capacity / float(period)  # 每秒补充的令牌数
+        self._buckets = {}  # webhook -> [剩余令牌数, 上次补充时间]
+        self._stats = {}
+        self._reserved = {}  # (webhook, ticket) -> 预留名额可用的时间
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.capacity), now]
+            self._stats[key] = {'waiting': 0, 'sent': 0, 'throttled': 0, 'delay_total': 0.0, 'delay_max': 0.0}
+        else:
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def _record_delay(self, key, delay):
+        stats = self._stats[key]
+        stats['throttled'] += 1
+        stats['delay_total'] += delay
+        stats['delay_max'] = max(stats['delay_max'], delay)
+
+    def try_acquire(self, key, ticket):
+        """取得一个令牌，可立即发送时返回 0；否则返回需要等待的秒数
+
+        令牌不足时与 acquire() 一样透支预留一个名额，后到的消息排在更晚的名额上，
+        各轮投递之间不会重复分配同一时段。ticket 标识一次预留（如待发送消息的 ID），
+        同一 ticket 再次调用时沿用已预留的名额，不重复扣减令牌，也不重复计入限流统计。
+        """
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(key, now)
+            ready_at = self._reserved.pop((key, ticket), None)
+            if ready_at is not None:
+                if ready_at > now:
+                    self._reserved[(key, ticket)] = ready_at
+                    return ready_at - now
+                self._stats[key]['sent'] += 1
+                return 0
+            bucket[0] -= 1
+            if bucket[0] >= 0:
+                self._stats[key]['sent'] += 1
+                return 0
+            delay = -bucket[0] / self.rate
+            self._record_delay(key, delay)
+            if len(self._reserved) >= 10000:
+                # 消息被删除等原因未再取用的预留名额，过期一个周期后清理
+                stale = now - self.capacity / self.rate
+                self._reserved = {k: v for k, v in self._reserved.items() if v > stale}
+            self._reserved[(key, ticket)] = now + delay
+            return delay
+
+    def acquire_within(self, key, max_wait):
+        """max_wait 秒内能取得令牌时等待并取得，返回 0；否则不占用令牌，返回还需等待的秒数
+
+        供需要同步返回的请求使用，令牌已被投递线程的预留透支时不会长时间占用请求线程。
+        """
+        needed = self._acquire(key, max_wait)
+        return needed if needed > max_wait else 0
+
+    def acquire(self, key):
+        """阻塞直到取得令牌，返回实际等待的秒数"""
+        return self._acquire(key)
+
+    def _acquire(self, key, max_wait=None):
+        with self._lock:
+            bucket = self._bucket(key, time.monotonic())
+            if max_wait is not None and (1 - bucket[0]) / self.rate > max_wait:
+                return (1 - bucket[0]) / self.rate
+            # 允许令牌透支，后到的调用者等待更久，从而形成先进先出的队列
+            bucket[0] -= 1
+            delay = 0 if bucket[0] >= 0 else -bucket[0] / self.rate
+            stats = self._stats[key]
+            stats['sent'] += 1
+            if delay > 0:
+                self._record_delay(key, delay)
+                stats['waiting'] += 1
+        if delay > 0:
+            time.sleep(delay)
+            with self._lock:
+                self._stats[key]['waiting'] -= 1
+        return delay
+
+    def snapshot(self):
+        """返回各 Webhook 的令牌余量、排队数与限流延迟统计"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for key in self._buckets:
+                bucket = self._bucket(key, now)
+                stats = self._stats[key]
+                result[key] = {
+                    'tokens': round(bucket[0], 2),
+                    'capacity': self.capacity,
+                    'waiting': stats['waiting'],
+                    'sent': stats['sent'],
+                    'throttled': stats['throttled'],
+                    'throttle_delay_total': round(stats['delay_total'], 2),
+                    'throttle_delay_max': round(stats['delay_max'], 2),
+                    'throttle_delay_avg': round(stats['delay_total'] / stats['throttled'], 2) if stats['throttled'] else 0
+                }
+            return result
+
+
+webhook_limiter = WebhookRateLimiter(
+    capacity=int(os.getenv('DINGTALK_RATE_LIMIT', '20')),
+    period=float(os.getenv('DINGTALK_RATE_PERIOD', '60'))
+)
+
+
+class LatencyHistogram:
+    """累积分桶直方图（单位：秒），另保留最近的样本用于估算分位数"""
+
+    def __init__(self, buckets, sample_size=1024):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples = collections.deque(maxlen=sample_size)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self._samples.append(value)
+
+    def snapshot(self):
+        samples = sorted(self._samples)
+
+        def quantile(q):
+            return round(samples[min(int(q * len(samples)), len(samples) - 1)], 4) if samples else 0
+
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets.append({'le': bound, 'count': cumulative})
+        return {
+            'count': self.count,
+            'sum': round(self.total, 4),
+            'avg': round(self.total / self.count, 4) if self.count else 0,
+            'max': round(self.max, 4),
+            'p50': quantile(0.5),
+            'p95': quantile(0.95),
+            'p99': quantile(0.99),
+            'buckets': buckets
+        }
+
+
+class SchedulerMetrics:
+    """提醒调度与通知投递的运行指标（进程内统计，重启后清零）
+
+    - reminder_lag：通知实际发送成功时间减去提醒时间点，持续升高说明调度或投递已饱和
+    - scan_duration：调度器每轮处理耗时
+    - webhook_latency：Webhook 请求往返耗时
+    - 按机器人统计的发送成功/失败次数
+    """
+
+    LAG_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 900)
+    SCAN_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    WEBHOOK_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = datetime.now()
+        self.reminder_lag = LatencyHistogram(self.LAG_BUCKETS)
+        self.scan_duration = LatencyHistogram(self.SCAN_BUCKETS)
+        self.webhook_latency = LatencyHistogram(self.WEBHOOK_BUCKETS)
+        self.robots = {}
+        self.scans = 0
+        self.reminders_enqueued = 0
+        self.last_scan_at = None
+
+    def observe_scan(self, seconds, enqueued):
+        with self._lock:
+            self.scan_duration.observe(seconds)
+            self.scans += 1
+            self.reminders_enqueued += enqueued
+            self.last_scan_at = datetime.now()
+
+    def observe_delivery(self, robot_name, success, latency, lag=None):
+        """记录一次投递尝试，lag 为首次成功发送时的提醒延迟（秒）"""
+        with self._lock:
+            if latency is not None:
+                self.webhook_latency.observe(latency)
+            if lag is not None:
+                self.reminder_lag.observe(max(lag, 0))
+            stats = self.robots.setdefault(robot_name or '未指定', {'success': 0, 'failure': 0})
+            stats['success' if success else 'failure'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'started_at': self.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+                'scans': self.scans,
+                'reminders_enqueued': self.reminders_enqueued,
+                'last_scan_at': self.last_scan_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_scan_at else None,
+                'reminder_lag_seconds': self.reminder_lag.snapshot(),
+                'scan_duration_seconds': self.scan_duration.snapshot(),
+                'webhook_latency_seconds': self.webhook_latency.snapshot(),
+                'robots': {name: dict(stats) for name, stats in self.robots.items()}
+            }
+
+
+scheduler_metrics = SchedulerMetrics()
+
+
+# 发件箱重试策略
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '6'))
+NOTIFY_RETRY_BASE_SECONDS = float(os.getenv('NOTIFY_RETRY_BASE_SECONDS', '30'))
+NOTIFY_RETRY_MAX_SECONDS = float(os.getenv('NOTIFY_RETRY_MAX_SECONDS', '3600'))
+
+
+def notification_retry_delay(attempts):
+    """第 attempts 次失败后的重试间隔：指数退避并叠加随机抖动，避免同一时刻集中重试"""
+    delay = min(NOTIFY_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), NOTIFY_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+class NotificationDeliveryWorker:
+    """发件箱投递线程
+
+    取出到期的待发送消息并行投递，每次尝试都写入一条 NotificationAudit，
+    失败的消息按指数退避重新排期，超过最大次数后转入死信状态。
+    没有到期消息时睡眠到最近的重试时间或新消息入队。
+    """
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self._pending = True
+        self._cond = threading.Condition()
+
+    def notify(self):
+        """有新消息入队时调用，唤醒投递线程"""
+        with self._cond:
+            self._pending = True
+            self._cond.notify()
+
+    def deliver_due(self):
+        """投递一批到期消息，返回本批处理的条数"""
+        now = datetime.now()
+        messages = NotificationOutbox.query.filter(
+            NotificationOutbox.status == '待发送',
+            NotificationOutbox.next_attempt_at <= now
+        ).order_by(NotificationOutbox.next_attempt_at.asc()).limit(self.batch_size).all()
+        if not messages:
+            return 0
+
+        # 超出机器人速率限制的消息顺延到令牌可用时再投递，不计入重试次数
+        sendable = []
+        deferred = 0
+        for message in messages:
+            delay = webhook_limiter.try_acquire(message.webhook_url, message.id)
+            if delay:
+                deferred += 1
+                message.next_attempt_at = now + timedelta(seconds=delay)
+            else:
+                sendable.append(message)
+        if deferred:
+            print(f"DEBUG: 触发机器人限流，{deferred} 条消息顺延投递")
+
+        jobs = [{'webhook_url': m.webhook_url, 'title': m.title, 'content': m.content} for m in sendable]
+        results = dispatch_notifications(jobs)
+        finished_at = datetime.now()
+        for message, job, (success, msg) in zip(sendable, jobs, results):
+            message.attempts = (message.attempts or 0) + 1
+            latency = job.get('latency')
+            lag = (finished_at - message.due_at).total_seconds() if success and message.due_at else None
+            scheduler_metrics.observe_delivery(message.robot_name, success, latency, lag)
+            if success:
+                message.status = '已发送'
+                message.sent_at = finished_at
+                message.last_error = None
+                print(f"DEBUG: 消息[{message.id}] 任务[{message.task_title}] 通知发送成功")
+            else:
+                message.last_error = msg
+                if message.attempts >= NOTIFY_MAX_ATTEMPTS:
+                    message.status = '死信'
+                    msg = f"{msg}（已重试 {message.attempts} 次，转入死信）"
+                    print(f"DEBUG: 消息[{message.id}] 任务[{message.task_title}] 达到最大重试次数，转入死信")
+                else:
+                    message.next_attempt_at = finished_at + notification_retry_delay(message.attempts)
+                    print(f"DEBUG: 消息[{message.id}] 任务[{message.task_title}] 发送失败: {msg}，将于 {message.next_attempt_at.strftime('%H:%M:%S')} 重试")
+
+            # 审计日志记录每一次投递尝试
+            db.session.add(NotificationAudit(
+                task_id=message.task_id,
+                task_title=message.task_title,
+                robot_name=message.robot_name,
+                webhook_url=message.webhook_url,
+                msg_type=message.msg_type,
+                title=message.title,
+                content=message.content,
+                status='成功' if success else '失败',
+                error_msg=None if success else msg,
+                sent_at=finished_at,
+                outbox_id=message.id,
+                attempt_no=message.attempts,
+                task_ids=message.task_ids,
+                latency_ms=int(latency * 1000) if latency is not None else None
+            ))
+        db.session.commit()
+        return len(messages)
+
+    def seconds_until_next(self):
+        """距离最近一条待发送消息的秒数，没有待发送消息时返回 None"""
+        next_at = db.session.query(db.func.min(NotificationOutbox.next_attempt_at)).filter(
+            NotificationOutbox.status == '待发送'
+        ).scalar()
+        if next_at is None:
+            return None
+        return max((next_at - datetime.now()).total_seconds(), 0)
+
+    def run(self):
+        while True:
+            if not reminder_lease.is_leader:
+                reminder_lease.wait_for_leadership()
+            timeout = None
+            try:
+                with self._cond:
+                    self._pending = False
+                db.session.remove()
+                if self.deliver_due() >= self.batch_size:
+                    continue
+                timeout = self.seconds_until_next()
+                db.session.remove()
+            except Exception as e:
+                print(f"ERROR: 通知投递线程异常: {str(e)}")
+                traceback.print_exc()
+                db.session.rollback()
+                timeout = 5
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait(timeout)
+
+
+delivery_worker = NotificationDeliveryWorker()
+
+
+def background_delivery_worker():
+    """后台通知投递线程"""
+    with app.app_context():
+        delivery_worker.run()
+
+
+class LeaderLease:
+    """基于数据库行的主进程租约
+
+    多个进程竞争同一行租约，通过带条件的 UPDATE 原子地抢占或续约，
+    只有持有租约的进程运行提醒调度与通知投递，其余进程待命；
+    持有者停止续约超过 ttl 后由其他进程接管。
+    """
+
+    def __init__(self, name, ttl=30):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self._valid_until = 0  # 本进程持有租约的有效期（monotonic 时间）
+        self._leader_event = threading.Event()
+        self._revision = None
+
+    @property
+    def is_leader(self):
+        return self._leader_event.is_set() and time.monotonic() < self._valid_until
+
+    def wait_for_leadership(self):
+        while not self.is_leader:
+            if self._leader_event.is_set():
+                # 续约失败导致租约已过期，等待心跳线程重新抢占
+                time.sleep(1)
+            else:
+                self._leader_event.wait(self.ttl)
+
+    def try_acquire(self):
+        """抢占或续约租约，返回当前是否持有租约"""
+        table = SchedulerLease.__table__
+        started = time.monotonic()
+        now = datetime.now()
+        values = {'holder': self.holder, 'expires_at': now + timedelta(seconds=self.ttl), 'heartbeat_at': now}
+        with db.engine.begin() as conn:
+            result = conn.execute(table.update().where(
+                table.c.name == self.name,
+                db.or_(table.c.holder == self.holder, table.c.holder.is_(None), table.c.expires_at < now)
+            ).values(**values))
+            acquired = result.rowcount == 1
+            exists = acquired or conn.execute(
+                db.select(table.c.name).where(table.c.name == self.name)
+            ).first() is not None
+        if not exists:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(table.insert().values(name=self.name, revision=0, **values))
+                acquired = True
+            except IntegrityError:
+                acquired = False
+
+        if acquired:
+            self._valid_until = started + self.ttl
+            self._leader_event.set()
+        else:
+            self._leader_event.clear()
+        return acquired
+
+    def release(self):
+        """主动释放租约，便于其他进程立即接管"""
+        if not self._leader_event.is_set():
+            return
+        self._leader_event.clear()
+        table = SchedulerLease.__table__
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(
+                table.c.name == self.name, table.c.holder == self.holder
+            ).values(holder=None, expires_at=datetime.now()))
+
+    def bump_revision(self):
+        table = SchedulerLease.__table__
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.name == self.name).values(revision=table.c.revision + 1))
+
+    def read_revision(self):
+        table = SchedulerLease.__table__
+        with db.engine.connect() as conn:
+            return conn.execute(db.select(table.c.revision).where(table.c.name == self.name)).scalar()
+
+    def run(self):
+        """租约心跳：每 ttl/3 秒抢占或续约一次，并检查其他进程的计划任务变更"""
+        while True:
+            was_leader = self.is_leader
+            checked_at = datetime.now()
+            try:
+                leader = self.try_acquire()
+            except Exception as e:
+                print(f"ERROR: 调度租约续约异常: {str(e)}")
+                leader = self.is_leader
+
+            if leader and not was_leader:
+                print(f">>> 当前进程获得调度租约 ({self.holder})，开始运行提醒调度")
+                self._revision = None
+                reminder_scheduler.request_reload()
+                delivery_worker.notify()
+            elif was_leader and not leader:
+                print(f">>> 当前进程失去调度租约 ({self.holder})，提醒调度转入待命")
+
+            if leader:
+                try:
+                    revision = self.read_revision()
+                    if self._revision is not None and revision != self._revision:
+                        # 心跳间隔内其他进程修改过任务，往前多留一个心跳周期的余量
+                        reminder_scheduler.request_sync(checked_at - timedelta(seconds=self.ttl))
+                    self._revision = revision
+                except Exception as e:
+                    print(f"ERROR: 读取计划任务变更版本号异常: {str(e)}")
+            time.sleep(self.ttl / 3.0)
+
+
+reminder_lease = LeaderLease('reminder', ttl=int(os.getenv('SCHEDULER_LEASE_SECONDS', '30')))
+
+
+def release_reminder_lease():
+    try:
+        with app.app_context():
+            reminder_lease.release()
+    except Exception:
+        pass
+
+
+def background_lease_worker():
+    """后台租约心跳线程"""
+    with app.app_context():
+        reminder_lease.run()
+
+
+class ReminderScheduler:
+    """计划任务提醒调度器
+
+    以最小堆维护所有待提醒任务的提醒时间点 (plan_time - reminder_minutes)，
+    后台线程睡眠到最近的提醒时间点再查询到期任务，两次提醒之间不访问数据库。
+    任务被新增/修改/删除时通过 notify() 只刷新对应任务，
+    另外按 resync_interval 做一次全量校准，兜底处理绕过接口直接写库的情况。
+    """
+
+    def __init__(self, resync_interval=600):
+        self.resync_interval = resync_interval
+        self._heap = []          # (提醒时间点, 任务ID)
+        self._deadlines = {}     # 任务ID -> 当前有效的提醒时间点，堆中不一致的条目视为已失效
+        self._dirty = set()      # 等待刷新的任务ID
+        self._reload = True      # 是否需要全量加载
+        self._changed_since = None  # 其他进程修改过任务时，需要增量同步的起始时间
+        self._last_resync = time.monotonic()
+        self._cond = threading.Condition()  # 保护以上状态，数据库查询在锁外进行
+
+    def notify(self, task_id):
+        """任务发生变化时调用，唤醒调度线程刷新该任务"""
+        with self._cond:
+            self._dirty.add(task_id)
+            self._cond.notify()
+
+    def request_reload(self):
+        """请求全量重新加载"""
+        with self._cond:
+            self._reload = True
+            self._cond.notify()
+
+    def request_sync(self, since):
+        """其他进程修改了计划任务时调用，增量同步 since 之后更新过的任务"""
+        with self._cond:
+            if self._changed_since is None or since < self._changed_since:
+                self._changed_since = since
+            self._cond.notify()
+
+    def pending_count(self):
+        """当前等待提醒的任务数"""
+        with self._cond:
+            return len(self._deadlines)
+
+    def _schedule(self, task_id, plan_time, reminder_minutes, now):
+        """将任务放入堆中，已错过提醒窗口的任务不再入堆（调用方需持有 self._cond）"""
+        if plan_time is None or now > plan_time + REMINDER_GRACE_PERIOD:
+            self._deadlines.pop(task_id, None)
+            return
+        deadline = plan_time - timedelta(minutes=reminder_minutes or 0)
+        if self._deadlines.get(task_id) == deadline:
+            return
+        self._deadlines[task_id] = deadline
+        heapq.heappush(self._heap, (deadline, task_id))
+
+    def _pending_query(self):
+        return db.session.query(PlanTask.id, PlanTask.plan_time, PlanTask.reminder_minutes).filter(
+            PlanTask.status.in_(REMINDER_ACTIVE_STATUSES),
+            PlanTask.reminder_enabled == True,
+            PlanTask.reminder_sent == False
+        )
+
+    def load_all(self, now):
+        """全量加载所有待提醒任务并重建堆"""
+        rows = self._pending_query().all()
+        with self._cond:
+            self._heap = []
+            self._deadlines = {}
+            for task_id, plan_time, reminder_minutes in rows:
+                self._schedule(task_id, plan_time, reminder_minutes, now)
+            count = len(self._deadlines)
+        print(f"DEBUG: 提醒调度器已加载 {count} 条待提醒任务")
+
+    def refresh(self, task_ids, now):
+        """重新读取指定任务，更新其在堆中的提醒时间点"""
+        task_ids = list(task_ids)
+        rows = self._pending_query().filter(PlanTask.id.in_(task_ids)).all() if task_ids else []
+        with self._cond:
+            for task_id in task_ids:
+                self._deadlines.pop(task_id, None)
+            for task_id, plan_time, reminder_minutes in rows:
+                self._schedule(task_id, plan_time, reminder_minutes, now)
+
+    def pop_due(self, now):
+        """弹出提醒时间点不晚于 now 的任务ID"""
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, task_id = heapq.heappop(self._heap)
+                if self._deadlines.get(task_id) == deadline:
+                    del self._deadlines[task_id]
+                    due.append(task_id)
+        return due
+
+    def seconds_until_next(self, now):
+        """距离最近一个提醒时间点的秒数，堆为空时返回 None（调用方需持有 self._cond）"""
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max((self._heap[0][0] - now).total_seconds(), 0)
+
+    def run_once(self):
+        """处理一次积压的变更与到期提醒，返回本轮到期任务数"""
+        started = time.monotonic()
+        with self._cond:
+            reload, self._reload = self._reload, False
+            dirty, self._dirty = self._dirty, set()
+            changed_since, self._changed_since = self._changed_since, None
+
+        # 显式清理 Session，确保读取最新数据库数据
+        db.session.remove()
+        now = datetime.now()
+        if reload:
+            # 启动、接管租约或全量校准时先批量处理已错过提醒窗口的任务
+            catch_up_missed_reminders(now)
+            self.load_all(now)
+            self._last_resync = time.monotonic()
+        else:
+            if changed_since is not None:
+                dirty |= {row.id for row in db.session.query(PlanTask.id).filter(PlanTask.updated_at >= changed_since)}
+            if dirty:
+                self.refresh(dirty, now)
+
+        # 汇总模式下一并取出窗口内即将到期的任务，与已到期任务按 Webhook 合并
+        horizon = now + timedelta(seconds=REMINDER_DIGEST_WINDOW) if REMINDER_DIGEST_WINDOW else None
+        due_ids = self.pop_due(horizon or now)
+        enqueued = 0
+        if due_ids:
+            print(f"DEBUG: 调度器唤醒，{len(due_ids)} 条任务到达提醒时间 (当前时间: {now.strftime('%H:%M:%S')})")
+            tasks = PlanTask.query.filter(
+                PlanTask.id.in_(due_ids),
+                PlanTask.status.in_(REMINDER_ACTIVE_STATUSES),
+                PlanTask.reminder_enabled == True,
+                PlanTask.reminder_sent == False
+            ).all()
+            jobs = [job for job in (prepare_task_reminder(task, now, horizon) for task in tasks) if job]
+            singles = jobs
+            digests = []
+            if horizon:
+                groups = {}
+                for job in jobs:
+                    groups.setdefault(job['webhook_url'], []).append(job)
+                singles = []
+                for group in groups.values():
+                    # 组内没有已到期的任务则暂不发送，留待到期时再与后续任务合并
+                    if not any(job['reminder_time'] <= now for job in group):
+                        continue
+                    if len(group) == 1:
+                        singles.extend(group)
+                    else:
+                        digests.append(sorted(group, key=lambda job: (job['task'].plan_time, job['task'].id)))
+            rendered = render_task_reminders([job['task'] for job in singles])
+            for job in singles:
+                job['title'], job['content'] = rendered[job['task'].id]
+                enqueue_task_reminder(job)
+            for group in digests:
+                print(f"DEBUG: 汇总 {len(group)} 条提醒为一条通知")
+                enqueue_reminder_digest(group)
+            enqueued = len(singles) + len(digests)
+            # 本轮所有提醒与任务状态一次提交，随后唤醒投递线程
+            db.session.commit()
+            if enqueued:
+                delivery_worker.notify()
+            occurrence_index.invalidate(due_ids)
+            # 周期任务推进了计划时间，需要重新入堆
+            self.refresh(due_ids, datetime.now())
+        db.session.remove()
+        scheduler_metrics.observe_scan(time.monotonic() - started, enqueued)
+        return len(due_ids)
+
+    def wait(self):
+        """睡眠到下一个提醒时间点、全量校准时间点或收到变更通知"""
+        with self._cond:
+            if self._reload or self._dirty or self._changed_since is not None:
+                return
+            timeout = self.resync_interval - (time.monotonic() - self._last_resync)
+            if timeout <= 0:
+                self._reload = True
+                return
+            next_due = self.seconds_until_next(datetime.now())
+            if next_due is not None:
+                timeout = min(timeout, next_due)
+            self._cond.wait(timeout)
+
+    def run(self):
+        while True:
+            if not reminder_lease.is_leader:
+                print("DEBUG: 当前进程未持有调度租约，提醒调度器待命")
+                reminder_lease.wait_for_leadership()
+                self.request_reload()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"ERROR: 后台提醒线程异常: {str(e)}")
+                traceback.print_exc()
+                db.session.rollback()
+                # 本轮弹出的任务可能未能处理，稍后全量重新加载
+                time.sleep(5)
+                self.request_reload()
+            self.wait()
+
+
+reminder_scheduler = ReminderScheduler(resync_interval=int(os.getenv('REMINDER_RESYNC_SECONDS', '600')))
+
+
+def notify_plan_task_changed(task_id):
+    """计划任务提交变更后调用，通知调度器刷新该任务的提醒时间
+
+    本进程持有租约时直接刷新调度堆；同时递增租约行上的版本号，
+    由持有租约的进程在下次心跳时增量同步。
+    """
+    reminder_scheduler.notify(task_id)
+    occurrence_index.invalidate([task_id])
+    try:
+        reminder_lease.bump_revision()
+    except Exception as e:
+        print(f"DEBUG: 计划任务变更版本号更新失败: {str(e)}")
+
 
 def background_reminder_worker():
     """后台提醒检查线程"""
-    import time
     with app.app_context():
         # 获取并打印服务器时间与时区偏移，辅助排查 Linux 触发问题
         import datetime as dt
@@ -518,152 +2808,8 @@ def background_reminder_worker():
         utc_now = dt.datetime.utcnow()
         tz_offset = (local_now - utc_now).total_seconds() / 3600
         print(f"计划任务提醒后台线程已启动 (服务器时间: {local_now.strftime('%Y-%m-%d %H:%M:%S')}, 时区偏移: UTC{tz_offset:+.1f})")
-        
-        while True:
-            try:
-                # 显式清理 Session，确保读取最新数据库数据
-                db.session.remove()
-                now = datetime.now()
-                # 检查所有 待执行/进行中 且开启提醒且未发送提醒的任务
-                tasks = PlanTask.query.filter(
-                    PlanTask.status.in_(['待执行', '进行中']),
-                    PlanTask.reminder_enabled == True,
-                    PlanTask.reminder_sent == False
-                ).all()
-                
-                if tasks:
-                    print(f"DEBUG: 后台扫描到 {len(tasks)} 条待提醒任务 (当前时间: {now.strftime('%H:%M:%S')})")
-                
-                for task in tasks:
-                    current_webhook = task.webhook_url
-                    
-                    # 兜底：如果数据库里没存 Webhook，但存了机器人名称，尝试实时从配置中读取
-                    if not current_webhook and task.alert_robot:
-                        robot_config = SystemConfig.query.filter_by(config_key='alert_robots').first()
-                        if robot_config:
-                            try:
-                                robots = json.loads(robot_config.config_value)
-                                for r in robots:
-                                    if r.get('name') == task.alert_robot:
-                                        current_webhook = r.get('webhook')
-                                        break
-                            except:
-                                pass
-
-                    # 计算提醒时间点
-                    reminder_time = task.plan_time - timedelta(minutes=task.reminder_minutes)
-                    
-                    # 打印调试日志，检查时间逻辑
-                    # print(f"DEBUG: 任务[{task.title}] 计划:{task.plan_time}, 提醒:{reminder_time}, 当前:{now}")
-                    
-                    # 如果当前时间到达或超过提醒时间
-                    if reminder_time <= now <= task.plan_time + timedelta(hours=1):
-                        print(f"DEBUG: 任务[{task.title}] 满足时间条件 (提醒点:{reminder_time.strftime('%H:%M:%S')}, 计划:{task.plan_time.strftime('%H:%M:%S')})")
-                        
-                        if not current_webhook:
-                            print(f"DEBUG: 任务[{task.title}] 满足条件但无法获取 Webhook，标记为已处理以避免死循环")
-                            task.reminder_sent = True
-                            db.session.commit()
-                            continue
-
-                        print(f"DEBUG: 任务[{task.title}] 准备发送通知...")
-                        # 准备模板变量
-
-                        preps = task.preparations
-                        completed_count = len([p for p in preps if p.status == '已完成'])
-                        prep_text_list = []
-                        for p in preps:
-                            status_icon = "✅" if p.status == '已完成' else "⬜"
-                            prep_text_list.append(f"{status_icon} {p.description}")
-                        
-                        prep_text = '\n\n'.join(prep_text_list) if prep_text_list else '无'
-                        prep_progress = f"{completed_count}/{len(preps)}"
-                        
-                        message = task.reminder_message or '任务：{title}，计划时间：{plan_time}，负责人：{owner}。'
-                        # 处理换行符
-                        message = message.replace('\\n', '\n').replace('\r\n', '\n')
-                        
-                        replacements = {
-                            '{title}': task.title,
-                            '{plan_time}': task.plan_time.strftime('%Y-%m-%d %H:%M'),
-                            '{owner}': task.owner or '未指定',
-                            '{responsible}': task.responsible or '未指定',
-                            '{preparations}': prep_text,
-                            '{prep_progress}': prep_progress
-                        }
-                        
-                        for key, val in replacements.items():
-                            message = message.replace(key, str(val))
-                        
-                        # 构建美化的 Markdown 消息
-                        markdown_title = f"⏰ 计划任务提醒: {task.title}"
-                        safe_message = message.replace('\n', '\n\n> ')
-                        markdown_text = f"### ⏰ 计划任务提醒\n\n" \
-                                        f"**任务名称**: <font color='#1d4ed8'>{task.title}</font>\n\n" \
-                                        f"--- \n\n" \
-                                        f"📅 **计划时间**: {task.plan_time.strftime('%Y-%m-%d %H:%M')}\n\n" \
-                                        f"👤 **主负责人**: {task.owner or '未指定'}\n\n" \
-                                        f"👥 **责任人**: {task.responsible or '未指定'}\n\n" \
-                                        f"📊 **当前进度**: `{prep_progress}`\n\n" \
-                                        f"📝 **准备事项**:\n\n{prep_text}\n\n"
-
-
-                        
-                        webhook_url = current_webhook
-                        if webhook_url:
-                            print(f"DEBUG: 正在向 {webhook_url} 发送通知")
-                            success, msg = send_dingtalk_notification(webhook_url, markdown_text, title=markdown_title)
-
-                            
-                            # 记录审计日志
-                            audit = NotificationAudit(
-                                task_id=task.id,
-                                task_title=task.title,
-                                robot_name=task.alert_robot,
-                                webhook_url=webhook_url,
-                                msg_type='markdown',
-                                title=markdown_title,
-                                content=markdown_text,
-                                status='成功' if success else '失败',
-                                error_msg=None if success else msg
-                            )
-                            db.session.add(audit)
-                            
-                            if success:
-                                print(f"DEBUG: 通知发送成功")
-                                # 处理周期性逻辑
-                                if task.schedule_type == 'once':
-                                    task.reminder_sent = True
-                                else:
-                                    # 使用 task.plan_time 作为基准，强制计算“下一个”周期
-                                    next_run = calculate_next_run_time(task.plan_time, task.schedule_type, task.schedule_value, base_time=task.plan_time)
-                                    if next_run:
-
-                                        print(f"DEBUG: 周期任务[{task.title}]，更新计划时间从 {task.plan_time} 到 {next_run}")
-                                        task.plan_time = next_run
-                                        task.reminder_sent = False 
-                                    else:
-                                        task.reminder_sent = True
-                                db.session.commit()
-                            else:
-                                print(f"DEBUG: 通知发送失败: {msg}")
-                                # 即使失败也标记为已发送，防止阻塞
-                                task.reminder_sent = True
-                                db.session.commit()
-                        else:
-                            print(f"DEBUG: 任务[{task.title}] 未配置 Webhook，标记为已处理")
-                            task.reminder_sent = True
-                            db.session.commit()
 
-                
-            except Exception as e:
-                print(f"ERROR: 后台提醒线程异常: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                db.session.rollback()
-
-            
-            time.sleep(60)
+        reminder_scheduler.run()
 
 # 启动后台工作线程
 start_background_worker()
@@ -1155,6 +3301,71 @@ def create_business_system():
 
 
 
+def sync_child_rows(existing, items, model, parent, build):
+    """按 id 比对子表记录，只执行必要的新增、修改与删除，由调用方统一 flush/提交
+
+    existing 为当前子记录列表，items 为提交的数据；build(item, index) 返回该行的字段值。
+    带有 id 且属于当前父记录的行只更新发生变化的字段，没有 id（或 id 不属于当前父记录）的行新增，
+    未出现在提交数据中的旧记录删除。返回 (新增数, 修改数, 删除数)。
+    """
+    current = {row.id: row for row in existing}
+    kept = set()
+    inserted = updated = 0
+    for index, item in enumerate(items or []):
+        values = build(item, index)
+        try:
+            row = current.get(int(item.get('id')))
+        except (TypeError, ValueError):
+            row = None
+        if row is None or row.id in kept:
+            db.session.add(model(**parent, **values))
+            inserted += 1
+            continue
+        kept.add(row.id)
+        changed = False
+        for field, value in values.items():
+            if getattr(row, field) != value:
+                setattr(row, field, value)
+                changed = True
+        updated += changed
+
+    deleted = 0
+    for row_id, row in current.items():
+        if row_id not in kept:
+            db.session.delete(row)
+            deleted += 1
+    return inserted, updated, deleted
+
+
+def build_host_values(host_data, index):
+    return {
+        'host_type': host_data.get('host_type'),
+        'ip_address': host_data.get('ip_address'),
+        'host_purpose': host_data.get('host_purpose'),
+        'os_version': host_data.get('os_version'),
+        'cpu_cores': host_data.get('cpu_cores'),
+        'memory_gb': host_data.get('memory_gb'),
+        'disk_gb': host_data.get('disk_gb'),
+        'cpu_arch': host_data.get('cpu_arch')
+    }
+
+
+def build_middleware_values(mw_data, index):
+    return {
+        'middleware_type': mw_data.get('middleware_type'),
+        'middleware_version': mw_data.get('middleware_version'),
+        'quantity': mw_data.get('quantity', 1)
+    }
+
+
+def build_integration_values(int_data, index):
+    return {
+        'integration_type': int_data.get('integration_type'),
+        'remote_system_name': int_data.get('remote_system_name'),
+        'network_type': int_data.get('network_type')
+    }
+
+
 @app.route('/api/business-systems/<int:id>', methods=['PUT'])
 @login_required
 def update_business_system(id):
@@ -1184,53 +3395,14 @@ def update_business_system(id):
 
 
     
-    # 删除旧的主机信息
-    SystemHost.query.filter_by(system_id=system.id).delete()
-    
-    # 添加新的主机信息
+    # 主机、中间件、集成信息按 id 增量同步，未提交的子表保持不变
+    parent = {'system_id': system.id}
     if 'hosts' in data:
-        for host_data in data['hosts']:
-            host = SystemHost(
-                system_id=system.id,
-                host_type=host_data.get('host_type'),
-                ip_address=host_data.get('ip_address'),
-                host_purpose=host_data.get('host_purpose'),
-                os_version=host_data.get('os_version'),
-                cpu_cores=host_data.get('cpu_cores'),
-                memory_gb=host_data.get('memory_gb'),
-                disk_gb=host_data.get('disk_gb'),
-                cpu_arch=host_data.get('cpu_arch')
-            )
-            db.session.add(host)
-
-    
-    # 删除旧的中间件信息
-    SystemMiddleware.query.filter_by(system_id=system.id).delete()
-    
-    # 添加新的中间件信息
+        sync_child_rows(system.hosts, data['hosts'], SystemHost, parent, build_host_values)
     if 'middlewares' in data:
-        for mw_data in data['middlewares']:
-            middleware = SystemMiddleware(
-                system_id=system.id,
-                middleware_type=mw_data.get('middleware_type'),
-                middleware_version=mw_data.get('middleware_version'),
-                quantity=mw_data.get('quantity', 1)
-            )
-            db.session.add(middleware)
-    
-    # 删除旧的集成信息
-    SystemIntegration.query.filter_by(system_id=system.id).delete()
-    
-    # 添加新的集成信息
+        sync_child_rows(system.middlewares, data['middlewares'], SystemMiddleware, parent, build_middleware_values)
     if 'integrations' in data:
-        for int_data in data['integrations']:
-            integration = SystemIntegration(
-                system_id=system.id,
-                integration_type=int_data.get('integration_type'),
-                remote_system_name=int_data.get('remote_system_name'),
-                network_type=int_data.get('network_type')
-            )
-            db.session.add(integration)
+        sync_child_rows(system.integrations, data['integrations'], SystemIntegration, parent, build_integration_values)
     
     db.session.commit()
     
@@ -1252,136 +3424,381 @@ def delete_business_system(id):
     
     return jsonify({'code': 0, 'message': '删除成功'})
 
-# 事件相关接口
-@app.route('/api/events', methods=['GET'])
-@login_required
-def get_events():
-    """获取事件列表"""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
-    system_name = request.args.get('system_name', '')
-    title = request.args.get('title', '')
-    status = request.args.get('status', '')
-    progress_status = request.args.get('progress_status', '')
-    event_type = request.args.get('event_type', '')
-    severity = request.args.get('severity', '')
-    start_date = request.args.get('start_date', '')
-    end_date = request.args.get('end_date', '')
-    
-    query = Event.query
-    
+# 事件相关接口
+# 事件列表总数缓存时间（秒），筛选条件相同的翻页请求复用同一个 COUNT 结果
+EVENT_COUNT_CACHE_SECONDS = int(os.getenv('EVENT_COUNT_CACHE_SECONDS', '60'))
+
+
+class EventCountCache:
+    """事件列表总数缓存
+
+    按筛选条件缓存 COUNT(*) 结果，避免每次翻页都重新统计；
+    本进程内事件新增、修改、删除时整体失效，其他进程的修改在 ttl 后生效。
+    """
+
+    def __init__(self, ttl=60, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}  # 筛选条件 -> (总数, 过期时间)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+            return None
+
+    def set(self, key, total):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (total, time.monotonic() + self.ttl)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+
+event_count_cache = EventCountCache(ttl=EVENT_COUNT_CACHE_SECONDS)
+
+EVENT_FILTER_ARGS = ('system_name', 'title', 'status', 'progress_status', 'event_type', 'severity', 'start_date', 'end_date', 'collapse')
+
+
+def apply_event_filters(query, args):
+    """按请求参数附加事件筛选条件，args 为 request.args 或普通字典"""
+    system_name = args.get('system_name', '')
+    title = args.get('title', '')
+    status = args.get('status', '')
+    progress_status = args.get('progress_status', '')
+    event_type = args.get('event_type', '')
+    severity = args.get('severity', '')
+    start_date = args.get('start_date', '')
+    end_date = args.get('end_date', '')
+
     if system_name:
         query = query.filter(Event.system_name.contains(system_name))
     if title:
         query = query.filter(Event.title.contains(title))
     if status:
-        query = query.filter_by(status=status)
+        query = query.filter(Event.status == status)
     if progress_status:
-        query = query.filter_by(progress_status=progress_status)
+        query = query.filter(Event.progress_status == progress_status)
     if event_type:
-        query = query.filter_by(event_type=event_type)
-
+        query = query.filter(Event.event_type == event_type)
     if severity:
-        query = query.filter_by(severity=severity)
+        query = query.filter(Event.severity == severity)
     if start_date:
         query = query.filter(Event.occurred_at >= datetime.fromisoformat(start_date))
     if end_date:
         query = query.filter(Event.occurred_at <= datetime.fromisoformat(end_date))
-    
-    query = query.order_by(Event.occurred_at.desc())
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    if str(args.get('collapse', '')).lower() in ('1', 'true', 'yes'):
+        # 折叠重复事件：只列出父事件与独立事件，重复次数见 duplicate_count
+        query = query.filter(Event.parent_id.is_(None))
+    return query
+
+
+def event_filter_key(args):
+    """筛选条件的缓存键"""
+    return tuple(args.get(name, '') for name in EVENT_FILTER_ARGS)
+
+
+def count_events(query, args, force=False):
+    """返回筛选后的事件总数：优先取缓存，缓存未命中且 force 为 False 时返回 None"""
+    key = event_filter_key(args)
+    total = event_count_cache.get(key)
+    if total is None and force:
+        total = query.order_by(None).count()
+        event_count_cache.set(key, total)
+    return total
+
+
+def encode_event_cursor(event):
+    """将 (发生时间, ID) 编码为不透明的游标字符串"""
+    raw = f"{event.occurred_at.strftime('%Y-%m-%dT%H:%M:%S.%f')}|{event.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_event_cursor(cursor):
+    """解析游标，返回 (发生时间, ID)，格式非法时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        occurred_at, event_id = raw.split('|')
+        return datetime.strptime(occurred_at, '%Y-%m-%dT%H:%M:%S.%f'), int(event_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+
+def event_list_item(event):
+    return {
+        'id': event.id,
+        'event_no': event.event_no,
+        'system_name': event.system_name,
+        'event_type': event.event_type,
+        'event_category': event.event_category,
+        'severity': event.severity,
+        'status': event.status,
+        'title': event.title,
+        'description': event.description,
+        'occurred_at': event.occurred_at.strftime('%Y-%m-%d %H:%M:%S') if event.occurred_at else None,
+        'reported_by': event.reported_by,
+        'assigned_to': event.assigned_to,
+        'progress_status': event.progress_status,
+        'parent_id': event.parent_id,
+        'duplicate_count': event.duplicate_count or 0,
+        'last_occurred_at': event.last_occurred_at.strftime('%Y-%m-%d %H:%M:%S') if event.last_occurred_at else None,
+        'created_at': event.created_at.strftime('%Y-%m-%d %H:%M:%S') if event.created_at else None
+    }
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """重建事件全文检索索引：flask --app app rebuild-search-index"""
+    run_migrations()
+    with app.app_context():
+        event_search_index.detect()
+        total = event_search_index.rebuild()
+    print(f"事件全文检索索引重建完成 ({event_search_index.backend})，共 {total} 条事件")
+
+
+@app.route('/api/events/search', methods=['GET'])
+@login_required
+def search_events():
+    """全文检索事件（含描述、解决方案、根本原因与处置流程），按相关度排序
+
+    参数 q 为检索词，多个词以空格分隔；可同时使用事件列表的筛选参数。
+    """
+    keyword = (request.args.get('q') or '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(1, min(request.args.get('per_page', 10, type=int), 100))
+    if not keyword:
+        return jsonify({'code': -1, 'message': '请输入检索关键词'}), 400
+
+    try:
+        query = apply_event_filters(Event.query, request.args)
+    except ValueError:
+        return jsonify({'code': -1, 'message': '日期格式不正确'}), 400
+
+    query, score = event_search_index.search(keyword, query)
+    if query is None:
+        return jsonify({'code': 0, 'data': {'items': [], 'total': 0, 'page': page, 'per_page': per_page}})
+
+    total = query.order_by(None).count()
+    rows = query.add_columns(score).order_by(score.desc(), Event.occurred_at.desc(), Event.id.desc()) \
+        .offset((page - 1) * per_page).limit(per_page).all()
+
+    items = []
+    for event, relevance in rows:
+        item = event_list_item(event)
+        item.update({
+            'resolution': event.resolution,
+            'root_cause': event.root_cause,
+            'score': round(relevance or 0, 4)
+        })
+        items.append(item)
 
-    
     return jsonify({
         'code': 0,
         'data': {
-            'items': [{
-                'id': event.id,
-                'event_no': event.event_no,
-                'system_name': event.system_name,
-                'event_type': event.event_type,
-                'event_category': event.event_category,
-                'severity': event.severity,
-                'status': event.status,
-                'title': event.title,
-                'description': event.description,
-                'occurred_at': event.occurred_at.strftime('%Y-%m-%d %H:%M:%S') if event.occurred_at else None,
-                'reported_by': event.reported_by,
-                'assigned_to': event.assigned_to,
-                'progress_status': event.progress_status,
-                'created_at': event.created_at.strftime('%Y-%m-%d %H:%M:%S') if event.created_at else None
-            } for event in pagination.items],
-
-            'total': pagination.total,
+            'items': items,
+            'total': total,
             'page': page,
-            'per_page': per_page
+            'per_page': per_page,
+            'backend': event_search_index.backend
         }
     })
 
-@app.route('/api/events/<int:id>', methods=['GET'])
+
+@app.route('/api/events', methods=['GET'])
 @login_required
-def get_event_detail(id):
-    """获取事件详情"""
-    event = Event.query.get_or_404(id)
-    
+def get_events():
+    """获取事件列表
+
+    两种分页方式：
+    - 页码模式（默认）：page/per_page，返回 total（按筛选条件缓存）
+    - 游标模式：传入 cursor 参数（首页传空字符串），按 (发生时间, ID) 倒序定位，
+      返回 next_cursor 与 has_more，不做 OFFSET 扫描；总数仅在 with_total=1 或缓存命中时返回
+    """
+    per_page = max(1, min(request.args.get('per_page', 10, type=int), 500))
+    with_total = request.args.get('with_total', '').lower() in ('1', 'true', 'yes')
+
+    try:
+        query = apply_event_filters(Event.query, request.args)
+    except ValueError:
+        return jsonify({'code': -1, 'message': '日期格式不正确'}), 400
+
+    if 'cursor' in request.args:
+        cursor = request.args.get('cursor', '')
+        page_query = query
+        if cursor:
+            try:
+                occurred_at, event_id = decode_event_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'code': -1, 'message': str(e)}), 400
+            page_query = page_query.filter(db.or_(
+                Event.occurred_at < occurred_at,
+                db.and_(Event.occurred_at == occurred_at, Event.id < event_id)
+            ))
+        events = page_query.order_by(Event.occurred_at.desc(), Event.id.desc()).limit(per_page + 1).all()
+        has_more = len(events) > per_page
+        events = events[:per_page]
+
+        return jsonify({
+            'code': 0,
+            'data': {
+                'items': [event_list_item(event) for event in events],
+                'next_cursor': encode_event_cursor(events[-1]) if has_more else None,
+                'has_more': has_more,
+                'total': count_events(query, request.args, force=with_total),
+                'per_page': per_page
+            }
+        })
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    events = query.order_by(Event.occurred_at.desc(), Event.id.desc()).offset((page - 1) * per_page).limit(per_page).all()
+
     return jsonify({
         'code': 0,
         'data': {
-            'id': event.id,
-            'event_no': event.event_no,
-            'system_id': event.system_id,
-            'system_name': event.system_name,
-            'event_type': event.event_type,
-            'event_category': event.event_category,
-            'severity': event.severity,
-            'status': event.status,
-            'title': event.title,
-            'description': event.description,
-            'occurred_at': event.occurred_at.strftime('%Y-%m-%d %H:%M:%S') if event.occurred_at else None,
-            'reported_by': event.reported_by,
-            'assigned_to': event.assigned_to,
-            'progress_status': event.progress_status,
-            'resolution': event.resolution,
-            'root_cause': event.root_cause,
-
-            'resolved_at': event.resolved_at.strftime('%Y-%m-%d %H:%M:%S') if event.resolved_at else None,
-            'closed_at': event.closed_at.strftime('%Y-%m-%d %H:%M:%S') if event.closed_at else None,
-            'processes': [{
-                'id': p.id,
-                'step_no': p.step_no,
-                'action': p.action,
-                'result': p.result,
-                'operator': p.operator,
-                'operated_at': p.operated_at.strftime('%Y-%m-%d %H:%M:%S') if p.operated_at else None,
-                'remarks': p.remarks
-            } for p in event.processes],
-            'attachments': [{
-                'id': a.id,
-                'file_name': a.file_name,
-                'file_type': a.file_type,
-                'file_size': a.file_size,
-                'uploaded_by': a.uploaded_by,
-                'uploaded_at': a.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')
-            } for a in event.attachments]
+            'items': [event_list_item(event) for event in events],
+            'total': count_events(query, request.args, force=True),
+            'page': page,
+            'per_page': per_page
         }
     })
 
+# 事件详情可选返回的关联数据，默认返回处置流程与附件
+EVENT_DETAIL_INCLUDES = ('processes', 'attachments', 'system', 'system_options', 'duplicates')
+EVENT_DETAIL_DEFAULT_INCLUDES = ('processes', 'attachments')
+
+
+@app.route('/api/events/<int:id>', methods=['GET'])
+@login_required
+def get_event_detail(id):
+    """获取事件详情
+
+    include 参数（逗号分隔）指定一并返回的关联数据，查看/编辑对话框一次请求即可取齐：
+    - processes: 处置流程
+    - attachments: 附件
+    - system: 所属业务系统（负责人、联系方式等）
+    - system_options: 全部业务系统的 id/名称，供编辑表单下拉框使用
+    - duplicates: 归并到该事件的重复事件（最近 100 条）
+    事件、所属系统与处置流程通过一条 JOIN 语句取回，附件使用一条 IN 查询。
+    """
+    include = request.args.get('include')
+    include = set(EVENT_DETAIL_DEFAULT_INCLUDES if include is None else
+                  (name.strip() for name in include.split(',') if name.strip()))
+    unknown = include - set(EVENT_DETAIL_INCLUDES)
+    if unknown:
+        return jsonify({'code': -1, 'message': f"不支持的 include 参数: {', '.join(sorted(unknown))}"}), 400
+
+    loaders = []
+    if 'processes' in include:
+        loaders.append(joinedload(Event.processes))
+    if 'attachments' in include:
+        loaders.append(selectinload(Event.attachments))
+    if 'system' in include:
+        loaders.append(joinedload(Event.business_system))
+    event = Event.query.options(*loaders).get_or_404(id)
+
+    data = {
+        'id': event.id,
+        'event_no': event.event_no,
+        'system_id': event.system_id,
+        'system_name': event.system_name,
+        'event_type': event.event_type,
+        'event_category': event.event_category,
+        'severity': event.severity,
+        'status': event.status,
+        'title': event.title,
+        'description': event.description,
+        'occurred_at': event.occurred_at.strftime('%Y-%m-%d %H:%M:%S') if event.occurred_at else None,
+        'reported_by': event.reported_by,
+        'assigned_to': event.assigned_to,
+        'progress_status': event.progress_status,
+        'resolution': event.resolution,
+        'root_cause': event.root_cause,
+
+        'resolved_at': event.resolved_at.strftime('%Y-%m-%d %H:%M:%S') if event.resolved_at else None,
+        'closed_at': event.closed_at.strftime('%Y-%m-%d %H:%M:%S') if event.closed_at else None,
+        'parent_id': event.parent_id,
+        'duplicate_count': event.duplicate_count or 0,
+        'last_occurred_at': event.last_occurred_at.strftime('%Y-%m-%d %H:%M:%S') if event.last_occurred_at else None
+    }
+    if 'processes' in include:
+        data['processes'] = [{
+            'id': p.id,
+            'step_no': p.step_no,
+            'action': p.action,
+            'result': p.result,
+            'operator': p.operator,
+            'operated_at': p.operated_at.strftime('%Y-%m-%d %H:%M:%S') if p.operated_at else None,
+            'remarks': p.remarks
+        } for p in sorted(event.processes, key=lambda p: (p.step_no or 0, p.id))]
+    if 'attachments' in include:
+        data['attachments'] = [{
+            'id': a.id,
+            'file_name': a.file_name,
+            'file_type': a.file_type,
+            'file_size': a.file_size,
+            'uploaded_by': a.uploaded_by,
+            'uploaded_at': a.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')
+        } for a in event.attachments]
+    if 'system' in include:
+        system = event.business_system
+        data['system'] = {
+            'id': system.id,
+            'system_name': system.system_name,
+            'system_code': system.system_code,
+            'status': system.status,
+            'department': system.department,
+            'contact_person': system.contact_person,
+            'contact_phone': system.contact_phone,
+            'contact_email': system.contact_email,
+            'access_url': system.access_url
+        } if system else None
+    if 'duplicates' in include:
+        data['duplicates'] = [{
+            'id': duplicate.id,
+            'event_no': duplicate.event_no,
+            'title': duplicate.title,
+            'status': duplicate.status,
+            'occurred_at': duplicate.occurred_at.strftime('%Y-%m-%d %H:%M:%S') if duplicate.occurred_at else None
+        } for duplicate in Event.query.filter(Event.parent_id == event.id)
+            .order_by(Event.occurred_at.desc(), Event.id.desc()).limit(100)]
+    if 'system_options' in include:
+        data['system_options'] = [
+            {'id': system_id, 'system_name': system_name}
+            for system_id, system_name in db.session.query(BusinessSystem.id, BusinessSystem.system_name)
+            .order_by(BusinessSystem.id)
+        ]
+
+    return jsonify({'code': 0, 'data': data})
+
 @app.route('/api/events', methods=['POST'])
 @login_required
 def create_event():
-    """创建事件"""
+    """创建事件
+
+    与处理中的事件指纹相同且在归并窗口内发生的新事件，记录为该事件的重复事件（parent_id 指向父事件），
+    父事件的重复次数与最近发生时间随之更新；请求中 force_new 为 true 时始终作为独立事件创建。
+    """
     data = request.json
     
-    # 生成事件编号
-    today = datetime.now().strftime('%Y%m%d')
-    count = Event.query.filter(Event.event_no.like(f'INC-{today}%')).count()
-    event_no = f'INC-{today}-{count + 1:04d}'
-    
     # 获取系统信息
     system = BusinessSystem.query.get(data['system_id'])
     if not system:
         return jsonify({'code': -1, 'message': '业务系统不存在'}), 400
     
+    # 生成事件编号（独立事务原子递增当天序列，并发创建不会重号）
+    event_no = event_no_allocator.next()
+    
+    occurred_at = datetime.fromisoformat(data['occurred_at'])
+    fingerprint = event_fingerprint(data['system_id'], data['event_type'], data['title'])
+    parent = None if data.get('force_new') else find_duplicate_parent(fingerprint, occurred_at)
+    
     event = Event(
         event_no=event_no,
         system_id=data['system_id'],
@@ -1392,15 +3809,24 @@ def create_event():
         status=data.get('status', '处理中'),
         title=data['title'],
         description=data.get('description'),
-        occurred_at=datetime.fromisoformat(data['occurred_at']),
+        occurred_at=occurred_at,
         reported_by=data.get('reported_by'),
         assigned_to=data.get('assigned_to'),
         progress_status=data.get('progress_status', '未解决'),
         resolution=data.get('resolution'),
 
-        root_cause=data.get('root_cause')
+        root_cause=data.get('root_cause'),
+        fingerprint=fingerprint,
+        parent_id=parent.id if parent else None,
+        duplicate_count=0,
+        last_occurred_at=occurred_at
     )
     
+    if parent:
+        parent.duplicate_count = Event.duplicate_count + 1
+        if parent.last_occurred_at is None or occurred_at > parent.last_occurred_at:
+            parent.last_occurred_at = occurred_at
+    
     db.session.add(event)
     db.session.flush()  # 获取event.id
     
@@ -1419,16 +3845,41 @@ def create_event():
             )
             db.session.add(process)
     
+    db.session.flush()
+    event_search_index.index_event(event)
     db.session.commit()
+    event_count_cache.invalidate()
     
+    if parent:
+        return jsonify({
+            'code': 0,
+            'message': f'创建成功，已归并到事件 {parent.event_no}',
+            'data': {'id': event.id, 'event_no': event_no, 'parent_id': parent.id, 'parent_event_no': parent.event_no}
+        })
     return jsonify({'code': 0, 'message': '创建成功', 'data': {'id': event.id, 'event_no': event_no}})
 
+def build_process_values(process_data, index):
+    """处置流程步骤的字段值，未提交操作时间时新增步骤取当前时间、已有步骤保持不变"""
+    values = {
+        'step_no': index + 1,
+        'action': process_data['action'],
+        'result': process_data.get('result'),
+        'operator': process_data.get('operator'),
+        'remarks': process_data.get('remarks')
+    }
+    if process_data.get('operated_at'):
+        values['operated_at'] = datetime.fromisoformat(process_data['operated_at'])
+    return values
+
+
 @app.route('/api/events/<int:id>', methods=['PUT'])
 @login_required
 def update_event(id):
-    """更新事件"""
+    """更新事件，父事件的状态或处置进度变化时同步到已归并的重复事件"""
     event = Event.query.get_or_404(id)
     data = request.json
+    status_changes = {field: data[field] for field in ('status', 'progress_status')
+                      if field in data and data[field] != getattr(event, field)}
     
     # 获取系统信息
     if 'system_id' in data:
@@ -1466,30 +3917,140 @@ def update_event(id):
 
     if 'root_cause' in data:
         event.root_cause = data['root_cause']
-    
-    # 更新处置流程
+    if 'occurred_at' in data and not event.duplicate_count:
+        event.last_occurred_at = event.occurred_at
+    if {'system_id', 'event_type', 'title'} & set(data):
+        fingerprint = event_fingerprint(event.system_id, event.event_type, event.title)
+        # 重复事件被改成另一类事件时脱离原父事件，父事件的重复次数减一
+        if fingerprint != event.fingerprint and event.parent_id:
+            Event.query.filter(Event.id == event.parent_id, Event.duplicate_count > 0) \
+                .update({'duplicate_count': Event.duplicate_count - 1}, synchronize_session=False)
+            record_changes('event', [event.parent_id], 'updated')
+            event.parent_id = None
+        event.fingerprint = fingerprint
+    
+    # 更新处置流程：按 id 比对，只写入新增、修改与删除的步骤
     if 'processes' in data:
-        # 删除旧的流程
-        EventProcess.query.filter_by(event_id=event.id).delete()
-        
-        # 添加新的流程
-        for idx, process_data in enumerate(data['processes']):
-            process = EventProcess(
-                event_id=event.id,
-                step_no=idx + 1,
-                action=process_data['action'],
-                result=process_data.get('result'),
-                operator=process_data.get('operator'),
-                operated_at=datetime.fromisoformat(process_data.get('operated_at')) if process_data.get('operated_at') else datetime.now(),
-                remarks=process_data.get('remarks')
+        sync_child_rows(event.processes, data['processes'], EventProcess, {'event_id': event.id}, build_process_values)
 
-            )
-            db.session.add(process)
+    if status_changes and event.duplicate_count:
+        duplicate_ids = [event_id for (event_id,) in db.session.query(Event.id).filter(Event.parent_id == event.id)]
+        Event.query.filter(Event.parent_id == event.id) \
+            .update(event_update_values(status_changes, datetime.now()), synchronize_session=False)
+        record_changes('event', duplicate_ids, 'updated')
     
+    db.session.flush()
+    event_search_index.index_event(event)
     db.session.commit()
+    event_count_cache.invalidate()
     
     return jsonify({'code': 0, 'message': '更新成功'})
 
+# 批量更新可修改的字段与每个事务处理的事件数
+EVENT_BULK_FIELDS = ('status', 'progress_status', 'assigned_to', 'severity')
+EVENT_BULK_CHUNK_SIZE = 500
+
+
+def event_update_values(changes, now):
+    """集合 UPDATE 的字段值：状态改为已解决/已关闭时补齐解决/关闭时间，已有时间不覆盖"""
+    values = dict(changes, updated_at=now)
+    if changes.get('status') == '已解决':
+        values['resolved_at'] = db.func.coalesce(Event.resolved_at, now)
+    elif changes.get('status') == '已关闭':
+        values['closed_at'] = db.func.coalesce(Event.closed_at, now)
+    return values
+
+
+@app.route('/api/events/bulk', methods=['POST'])
+@login_required
+def bulk_update_events():
+    """批量更新事件的状态、处置进度、处理人或严重程度
+
+    请求体：ids 为事件 ID 列表，或 filter 为与事件列表相同的筛选条件（collapse 之外至少一个）；
+    status / progress_status / assigned_to / severity 为要修改的字段（至少一个）。
+    父事件代表整组重复事件，选中的父事件的重复事件一并更新（折叠视图中只能看到父事件）。
+    按 EVENT_BULK_CHUNK_SIZE 分块执行集合 UPDATE，每块一个事务；状态改为已解决/已关闭时
+    与单个更新一致地补齐解决时间/关闭时间（已有时间不覆盖）。返回每个事件 ID 的处理结果。
+    """
+    data = request.json or {}
+    changes = {field: data[field] for field in EVENT_BULK_FIELDS if field in data}
+    if not changes:
+        return jsonify({'code': -1, 'message': f"请指定要修改的字段: {', '.join(EVENT_BULK_FIELDS)}"}), 400
+
+    results = {}
+    if 'ids' in data:
+        try:
+            ids = list(dict.fromkeys(int(event_id) for event_id in data['ids']))
+        except (TypeError, ValueError):
+            return jsonify({'code': -1, 'message': 'ids 必须为事件 ID 列表'}), 400
+        existing = set()
+        for start in range(0, len(ids), EVENT_BULK_CHUNK_SIZE):
+            chunk = ids[start:start + EVENT_BULK_CHUNK_SIZE]
+            existing.update(event_id for (event_id,) in db.session.query(Event.id).filter(Event.id.in_(chunk)))
+        for event_id in ids:
+            if event_id not in existing:
+                results[event_id] = {'id': event_id, 'result': 'not_found'}
+        target_ids = [event_id for event_id in ids if event_id in existing]
+    else:
+        filters = data.get('filter') or {}
+        if not isinstance(filters, dict):
+            return jsonify({'code': -1, 'message': 'filter 必须为对象'}), 400
+        if not any(filters.get(name) for name in EVENT_FILTER_ARGS if name != 'collapse'):
+            return jsonify({'code': -1, 'message': '请提供 ids 或至少一个筛选条件'}), 400
+        try:
+            query = apply_event_filters(db.session.query(Event.id), filters)
+        except ValueError:
+            return jsonify({'code': -1, 'message': '日期格式不正确'}), 400
+        target_ids = [event_id for (event_id,) in query.order_by(Event.id)]
+
+    # 加入选中父事件下尚未包含的重复事件
+    selected = set(target_ids)
+    duplicate_ids = []
+    for start in range(0, len(target_ids), EVENT_BULK_CHUNK_SIZE):
+        chunk = target_ids[start:start + EVENT_BULK_CHUNK_SIZE]
+        duplicate_ids.extend(event_id for (event_id,) in db.session.query(Event.id)
+                             .filter(Event.parent_id.in_(chunk)).order_by(Event.id) if event_id not in selected)
+    target_ids += duplicate_ids
+    db.session.rollback()  # 结束读取事务，后续每块单独提交
+
+    values = event_update_values(changes, datetime.now())
+
+    updated = failed = 0
+    for start in range(0, len(target_ids), EVENT_BULK_CHUNK_SIZE):
+        chunk = target_ids[start:start + EVENT_BULK_CHUNK_SIZE]
+        try:
+            Event.query.filter(Event.id.in_(chunk)).update(values, synchronize_session=False)
+            record_changes('event', chunk, 'updated')
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[bulk update events] 第 {start // EVENT_BULK_CHUNK_SIZE + 1} 块更新失败: {e}")
+            failed += len(chunk)
+            for event_id in chunk:
+                results[event_id] = {'id': event_id, 'result': 'failed', 'message': str(e)[:200]}
+            continue
+        updated += len(chunk)
+        for event_id in chunk:
+            results[event_id] = {'id': event_id, 'result': 'updated'}
+
+    if updated:
+        event_count_cache.invalidate()
+
+    ordered = [results[event_id] for event_id in ((ids + duplicate_ids) if 'ids' in data else target_ids)]
+    not_found = sum(1 for item in ordered if item['result'] == 'not_found')
+    return jsonify({
+        'code': 0,
+        'message': f"成功更新 {updated} 个事件" + (f"（含重复事件 {len(duplicate_ids)} 个）" if duplicate_ids else '')
+                   + (f"，失败 {failed} 个" if failed else '') + (f"，{not_found} 个不存在" if not_found else ''),
+        'data': {
+            'updated': updated,
+            'failed': failed,
+            'not_found': not_found,
+            'duplicates': len(duplicate_ids),
+            'results': ordered
+        }
+    })
+
 @app.route('/api/events/<int:id>', methods=['DELETE'])
 @login_required
 def delete_event(id):
@@ -1505,11 +4066,595 @@ def delete_event(id):
         except:
             pass
     
+    # 删除父事件时最早的重复事件接替为父事件；删除重复事件时父事件的重复次数减一
+    duplicate_ids = [event_id for (event_id,) in db.session.query(Event.id).filter(Event.parent_id == event.id)
+                     .order_by(Event.occurred_at, Event.id)]
+    if duplicate_ids:
+        Event.query.filter(Event.id.in_(duplicate_ids[1:])).update({'parent_id': duplicate_ids[0]}, synchronize_session=False)
+        Event.query.filter(Event.id == duplicate_ids[0]).update({
+            'parent_id': None,
+            'duplicate_count': len(duplicate_ids) - 1,
+            'last_occurred_at': event.last_occurred_at
+        }, synchronize_session=False)
+        record_changes('event', duplicate_ids, 'updated')
+    elif event.parent_id:
+        Event.query.filter(Event.id == event.parent_id, Event.duplicate_count > 0) \
+            .update({'duplicate_count': Event.duplicate_count - 1}, synchronize_session=False)
+        record_changes('event', [event.parent_id], 'updated')
+    
+    event_search_index.remove_event(event.id)
     db.session.delete(event)
     db.session.commit()
+    event_count_cache.invalidate()
     
     return jsonify({'code': 0, 'message': '删除成功'})
 
+# ==================== 事件批量导入 ====================
+
+# 导入文件列名（中文表头或英文字段名均可）-> 事件字段
+EVENT_IMPORT_COLUMNS = {
+    '事件编号': 'event_no', '系统名称': 'system_name', '事件类型': 'event_type', '故障分类': 'event_category',
+    '严重程度': 'severity', '事件状态': 'status', '处置进度': 'progress_status', '事件标题': 'title',
+    '事件描述': 'description', '发生时间': 'occurred_at', '报告人': 'reported_by', '处理人': 'assigned_to',
+    '解决方案': 'resolution', '根本原因': 'root_cause', '解决时间': 'resolved_at', '关闭时间': 'closed_at',
+    '处置流程': 'processes'
+}
+EVENT_IMPORT_REQUIRED = ('system_name', 'event_type', 'title', 'occurred_at')
+EVENT_IMPORT_MAX_LENGTHS = {
+    'event_no': 50, 'system_name': 100, 'event_type': 50, 'event_category': 50, 'severity': 20, 'status': 20,
+    'progress_status': 20, 'title': 200, 'reported_by': 50, 'assigned_to': 50
+}
+# 按事件编号/ID 回查时每条 IN 查询的参数个数，低于 SQLite 3.32 之前的 999 个绑定参数上限（CentOS 7 自带版本）
+EVENT_IMPORT_LOOKUP_CHUNK = 500
+EVENT_IMPORT_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y-%m-%d', '%Y/%m/%d')
+
+
+def parse_import_datetime(value):
+    """解析导入文件中的时间，支持 Excel 日期单元格与常见文本格式，空值返回 None"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value
+    value = str(value).strip()
+    for fmt in EVENT_IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return datetime.fromisoformat(value)
+
+
+def parse_import_processes(value, default_time):
+    """解析“处置流程”列：每行一个步骤，格式为 动作 | 结果 | 操作人 | 操作时间，后三项可省略"""
+    processes = []
+    for line in str(value or '').splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if not parts[0]:
+            continue
+        processes.append({
+            'action': parts[0][:200],
+            'result': parts[1] if len(parts) > 1 and parts[1] else None,
+            'operator': parts[2][:50] if len(parts) > 2 and parts[2] else None,
+            'operated_at': parse_import_datetime(parts[3]) if len(parts) > 3 and parts[3] else default_time
+        })
+    return processes
+
+
+def iter_import_rows(path, filename, encoding='utf-8-sig'):
+    """逐行读取导入文件，返回 (行号, {字段: 值}) 生成器，不把整个文件读入内存
+
+    XLSX 使用 openpyxl 只读模式流式解析，CSV 使用标准库 csv。第一行为表头。
+    """
+    if filename.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            yield from _map_import_rows(header, rows)
+        finally:
+            workbook.close()
+    elif filename.lower().endswith('.csv'):
+        with open(path, newline='', encoding=encoding) as f:
+            rows = csv.reader(f)
+            header = next(rows, None)
+            yield from _map_import_rows(header, rows)
+    else:
+        raise ValueError('仅支持 .xlsx 或 .csv 文件')
+
+
+def _map_import_rows(header, rows):
+    if not header:
+        return
+    fields = []
+    for name in header:
+        name = str(name or '').strip()
+        fields.append(EVENT_IMPORT_COLUMNS.get(name) or (name if name in EVENT_IMPORT_COLUMNS.values() else None))
+    missing = [field for field in EVENT_IMPORT_REQUIRED if field not in fields]
+    if missing:
+        labels = {field: label for label, field in EVENT_IMPORT_COLUMNS.items()}
+        raise ValueError(f"缺少必填列: {'、'.join(labels[field] for field in missing)}")
+    for row_no, row in enumerate(rows, 2):
+        if not row or all(value is None or str(value).strip() == '' for value in row):
+            continue
+        record = {}
+        for field, value in zip(fields, row):
+            if field:
+                record[field] = value.strip() if isinstance(value, str) else value
+        yield row_no, record
+
+
+class EventImporter:
+    """事件批量导入
+
+    逐行校验，业务系统名称通过预加载的字典解析为 system_id，事件编号按发生日期成段预留，
+    文件自带的编号会推进对应日期的编号序列。每 batch_size 行在一个事务内批量写入事件、处置流程与
+    全文检索索引，整批写入失败时逐行重试。校验失败或写入失败的行记录错误后跳过。
+    """
+
+    def __init__(self, batch_size=1000, dry_run=False, max_errors=1000):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.max_errors = max_errors
+        self.total = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []  # [(行号, 错误信息)]
+        self._systems = {name: system_id for system_id, name in db.session.query(BusinessSystem.id, BusinessSystem.system_name)}
+        self._seen_event_nos = set()
+        self._batch = []
+
+    def _error(self, row_no, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((row_no, message))
+
+    def _validate(self, record):
+        """校验一行并转换为待写入的数据，校验失败抛出 ValueError"""
+        missing = [label for label, field in EVENT_IMPORT_COLUMNS.items() if field in EVENT_IMPORT_REQUIRED and not record.get(field)]
+        if missing:
+            raise ValueError(f"{'、'.join(missing)}不能为空")
+
+        values = {}
+        for field in ('event_no', 'system_name', 'event_type', 'event_category', 'severity', 'status', 'progress_status',
+                      'title', 'description', 'reported_by', 'assigned_to', 'resolution', 'root_cause'):
+            value = record.get(field)
+            if value is None or value == '':
+                continue
+            value = str(value)
+            limit = EVENT_IMPORT_MAX_LENGTHS.get(field)
+            if limit and len(value) > limit:
+                raise ValueError(f"{field} 超过 {limit} 个字符")
+            values[field] = value
+
+        system_id = self._systems.get(values['system_name'])
+        if system_id is None:
+            raise ValueError(f"业务系统不存在: {values['system_name']}")
+        values['system_id'] = system_id
+
+        try:
+            values['occurred_at'] = parse_import_datetime(record.get('occurred_at'))
+            values['resolved_at'] = parse_import_datetime(record.get('resolved_at'))
+            values['closed_at'] = parse_import_datetime(record.get('closed_at'))
+        except ValueError:
+            raise ValueError('时间格式不正确，应为 YYYY-MM-DD HH:MM[:SS]')
+
+        values.setdefault('status', '处理中')
+        values.setdefault('progress_status', '未解决')
+        # 历史数据只计算指纹，不做归并
+        values['fingerprint'] = event_fingerprint(system_id, values['event_type'], values['title'])
+        values['duplicate_count'] = 0
+        values['last_occurred_at'] = values['occurred_at']
+        if values['status'] == '已解决' and not values['resolved_at']:
+            values['resolved_at'] = values['occurred_at']
+        if values['status'] == '已关闭' and not values['closed_at']:
+            values['closed_at'] = values['occurred_at']
+
+        event_no = values.get('event_no')
+        if event_no:
+            if event_no in self._seen_event_nos:
+                raise ValueError(f"事件编号重复: {event_no}")
+            self._seen_event_nos.add(event_no)
+
+        processes = parse_import_processes(record.get('processes'), values['occurred_at'])
+        return values, processes
+
+    def add(self, row_no, record):
+        self.total += 1
+        try:
+            values, processes = self._validate(record)
+        except ValueError as e:
+            self._error(row_no, str(e))
+            return
+        self._batch.append((row_no, values, processes))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """写入当前批次"""
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        # 文件中自带的编号不能与库中已有编号冲突
+        given = [values['event_no'] for _, values, _ in batch if values.get('event_no')]
+        if given:
+            existing = set()
+            for start in range(0, len(given), EVENT_IMPORT_LOOKUP_CHUNK):
+                existing.update(no for (no,) in db.session.query(Event.event_no)
+                                .filter(Event.event_no.in_(given[start:start + EVENT_IMPORT_LOOKUP_CHUNK])))
+            if existing:
+                kept = []
+                for row_no, values, processes in batch:
+                    if values.get('event_no') in existing:
+                        self._error(row_no, f"事件编号已存在: {values['event_no']}")
+                    else:
+                        kept.append((row_no, values, processes))
+                batch = kept
+        if self.dry_run or not batch:
+            self.imported += len(batch)
+            return
+
+        # 自带编号先把对应日期的序列推进到其最大序号，之后为本批或新建事件预留的编号不会与之重复
+        floors = {}
+        for _, values, _ in batch:
+            match = EVENT_NO_RE.match(values.get('event_no') or '')
+            if match:
+                day, value = match.group(1), int(match.group(2))
+                floors[day] = max(floors.get(day, 0), value)
+        for day, value in floors.items():
+            raise_event_number_floor(day, value)
+            event_no_allocator.discard(day)
+
+        # 未提供编号的行按发生日期成段预留编号
+        by_day = {}
+        for _, values, _ in batch:
+            if not values.get('event_no'):
+                by_day.setdefault(values['occurred_at'].strftime('%Y%m%d'), []).append(values)
+        for day, day_values in by_day.items():
+            start, _ = reserve_event_numbers(day, len(day_values))
+            for offset, values in enumerate(day_values):
+                values['event_no'] = format_event_no(day, start + offset)
+
+        try:
+            self._write(batch)
+            self.imported += len(batch)
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                self._error(batch[0][0], f"写入失败: {str(e)[:200]}")
+                return
+            # 整批写入失败时逐行重试，只有出错的行记为失败
+            print(f"DEBUG: 导入批次写入失败，改为逐行写入: {str(e)[:200]}")
+            for row in batch:
+                try:
+                    self._write([row])
+                    self.imported += 1
+                except Exception as e:
+                    db.session.rollback()
+                    self._error(row[0], f"写入失败: {str(e)[:200]}")
+
+    def _write(self, batch):
+        """在一个事务内写入一批事件、处置流程与检索索引并提交"""
+        now = datetime.now()
+        db.session.execute(Event.__table__.insert(), [dict(values, created_at=now, updated_at=now) for _, values, _ in batch])
+        event_nos = [values['event_no'] for _, values, _ in batch]
+        event_ids = {}
+        for start in range(0, len(event_nos), EVENT_IMPORT_LOOKUP_CHUNK):
+            event_ids.update(db.session.query(Event.event_no, Event.id).filter(
+                Event.event_no.in_(event_nos[start:start + EVENT_IMPORT_LOOKUP_CHUNK])
+            ))
+        process_rows = [
+            dict(process, event_id=event_ids[values['event_no']], step_no=step_no)
+            for _, values, processes in batch
+            for step_no, process in enumerate(processes, 1)
+        ]
+        if process_rows:
+            db.session.execute(EventProcess.__table__.insert(), process_rows)
+        new_ids = list(event_ids.values())
+        for start in range(0, len(new_ids), EVENT_IMPORT_LOOKUP_CHUNK):
+            event_search_index.index_events(
+                Event.query.filter(Event.id.in_(new_ids[start:start + EVENT_IMPORT_LOOKUP_CHUNK])).all()
+            )
+        record_changes('event', new_ids, 'created')
+        db.session.commit()
+
+    def run(self, rows):
+        for row_no, record in rows:
+            self.add(row_no, record)
+        self.flush()
+        if self.imported and not self.dry_run:
+            event_count_cache.invalidate()
+        return self.summary()
+
+    def summary(self):
+        return {
+            'total': self.total,
+            'imported': self.imported,
+            'failed': self.failed,
+            'dry_run': self.dry_run,
+            'errors': [{'row': row_no, 'message': message} for row_no, message in sorted(self.errors)]
+        }
+
+
+@app.route('/api/events/import', methods=['POST'])
+@admin_required
+def import_events():
+    """批量导入事件（multipart 上传 .xlsx 或 .csv）
+
+    可选参数：dry_run=1 只校验不写入，batch_size 每批写入行数，encoding CSV 文件编码（默认 utf-8-sig）。
+    超出上传大小限制的大文件请使用命令行：flask --app app import-events 文件路径
+    """
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'code': -1, 'message': '请选择导入文件'}), 400
+    dry_run = request.form.get('dry_run', request.args.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+    try:
+        batch_size = max(1, min(int(request.form.get('batch_size', 1000)), 5000))
+    except ValueError:
+        return jsonify({'code': -1, 'message': 'batch_size 必须为整数'}), 400
+    encoding = request.form.get('encoding', 'utf-8-sig')
+
+    suffix = os.path.splitext(file.filename)[1].lower()
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        file.save(path)
+        importer = EventImporter(batch_size=batch_size, dry_run=dry_run)
+        summary = importer.run(iter_import_rows(path, file.filename, encoding))
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'code': -1, 'message': f'导入失败: {str(e)}'}), 400
+    finally:
+        os.remove(path)
+
+    message = f"共 {summary['total']} 行，{'校验通过' if dry_run else '成功导入'} {summary['imported']} 行，失败 {summary['failed']} 行"
+    return jsonify({'code': 0, 'message': message, 'data': summary})
+
+
+@app.cli.command('import-events')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=1000, show_default=True, help='每批写入行数')
+@click.option('--dry-run', is_flag=True, help='只校验不写入')
+@click.option('--encoding', default='utf-8-sig', show_default=True, help='CSV 文件编码')
+@click.option('--errors-file', type=click.Path(dir_okay=False), help='将失败行写入 CSV 文件')
+def import_events_command(path, batch_size, dry_run, encoding, errors_file):
+    """从 .xlsx 或 .csv 批量导入事件：flask --app app import-events 文件路径"""
+    started = time.monotonic()
+    importer = EventImporter(batch_size=batch_size, dry_run=dry_run, max_errors=10 ** 9)
+    last_report = [0]
+
+    def rows_with_progress():
+        for row_no, record in iter_import_rows(path, path, encoding):
+            yield row_no, record
+            if importer.total - last_report[0] >= 10000:
+                last_report[0] = importer.total
+                print(f"已处理 {importer.total} 行，导入 {importer.imported} 行，失败 {importer.failed} 行 ({time.monotonic() - started:.0f}s)")
+
+    with app.app_context():
+        summary = importer.run(rows_with_progress())
+    print(f"导入完成：共 {summary['total']} 行，{'校验通过' if dry_run else '成功导入'} {summary['imported']} 行，"
+          f"失败 {summary['failed']} 行，耗时 {time.monotonic() - started:.1f}s")
+    if errors_file and summary['errors']:
+        with open(errors_file, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(['行号', '错误信息'])
+            writer.writerows((error['row'], error['message']) for error in summary['errors'])
+        print(f"失败行已写入 {errors_file}")
+    else:
+        for error in summary['errors'][:20]:
+            print(f"  第 {error['row']} 行: {error['message']}")
+
+
+# ==================== 事件导出 ====================
+
+# 每块事件的处置流程与附件用 IN 查询取回，块大小不超过 SQLite 3.32 之前的 999 个绑定参数上限
+EVENT_EXPORT_CHUNK_SIZE = 500
+XLSX_MAX_ROWS = 1048576  # Excel 单个工作表的最大行数（含表头）
+# 导出列与导入模板一致，导出的文件可直接重新导入；附件与创建时间仅供查看
+EVENT_EXPORT_HEADERS = list(EVENT_IMPORT_COLUMNS) + ['附件', '创建时间']
+
+
+def format_export_time(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+
+def iter_event_export_rows(args, chunk_size=EVENT_EXPORT_CHUNK_SIZE):
+    """按筛选条件逐块读取事件，生成导出行（列顺序同 EVENT_EXPORT_HEADERS）
+
+    事件使用独立会话 + yield_per 流式读取（MySQL 下为服务端游标），每块事件的处置流程与附件
+    各用一次 IN 查询取回，内存占用只与块大小有关。SQLite 的未读完游标会一直持有读锁，
+    导致导出期间其他写入报 database is locked，因此改为按 (发生时间, ID) 键集分块读取。
+    """
+    if db.engine.dialect.name == 'sqlite':
+        query = apply_event_filters(Event.query, args)
+        chunk = query.order_by(Event.occurred_at.desc(), Event.id.desc()).limit(chunk_size).all()
+        while chunk:
+            yield from _event_export_chunk(chunk)
+            last = chunk[-1]
+            chunk = query.filter(db.or_(
+                Event.occurred_at < last.occurred_at,
+                db.and_(Event.occurred_at == last.occurred_at, Event.id < last.id)
+            )).order_by(Event.occurred_at.desc(), Event.id.desc()).limit(chunk_size).all()
+        return
+
+    with Session(db.engine) as stream_session:
+        query = apply_event_filters(stream_session.query(Event), args) \
+            .order_by(Event.occurred_at.desc(), Event.id.desc()).yield_per(chunk_size)
+        chunk = []
+        for event in query:
+            chunk.append(event)
+            if len(chunk) >= chunk_size:
+                yield from _event_export_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from _event_export_chunk(chunk)
+
+
+def _event_export_chunk(events):
+    ids = [event.id for event in events]
+    processes = {}
+    for process in db.session.query(EventProcess).filter(EventProcess.event_id.in_(ids)) \
+            .order_by(EventProcess.event_id, EventProcess.step_no):
+        processes.setdefault(process.event_id, []).append(
+            f"{process.action} | {process.result or ''} | {process.operator or ''} | {format_export_time(process.operated_at)}"
+        )
+    attachments = {}
+    for attachment in db.session.query(EventAttachment).filter(EventAttachment.event_id.in_(ids)) \
+            .order_by(EventAttachment.event_id, EventAttachment.id):
+        attachments.setdefault(attachment.event_id, []).append(
+            f"{attachment.file_name} ({attachment.file_type or '-'}, {(attachment.file_size or 0) / 1024:.1f}KB, "
+            f"{attachment.uploaded_by or '-'}, {format_export_time(attachment.uploaded_at)})"
+        )
+
+    for event in events:
+        yield [
+            event.event_no, event.system_name, event.event_type, event.event_category or '', event.severity or '',
+            event.status or '', event.progress_status or '', event.title, event.description or '',
+            format_export_time(event.occurred_at), event.reported_by or '', event.assigned_to or '',
+            event.resolution or '', event.root_cause or '', format_export_time(event.resolved_at),
+            format_export_time(event.closed_at), '\n'.join(processes.get(event.id, [])),
+            '\n'.join(attachments.get(event.id, [])), format_export_time(event.created_at)
+        ]
+
+
+def stream_events_csv(rows):
+    """CSV 导出：每写满一块即输出，带 BOM 便于 Excel 直接打开"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(EVENT_EXPORT_HEADERS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EVENT_EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def stream_events_xlsx(rows):
+    """XLSX 导出：openpyxl 只写模式逐行写入临时文件，生成后分块输出并删除临时文件
+
+    超过单表行数上限时自动续写到新的工作表。
+    """
+    from openpyxl import Workbook
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = Workbook(write_only=True)
+        sheet, sheet_rows, sheet_no = None, XLSX_MAX_ROWS, 0
+        for row in rows:
+            if sheet_rows >= XLSX_MAX_ROWS:
+                sheet_no += 1
+                sheet = workbook.create_sheet('事件清单' if sheet_no == 1 else f'事件清单{sheet_no}')
+                sheet.append(EVENT_EXPORT_HEADERS)
+                sheet_rows = 1
+            sheet.append(row)
+            sheet_rows += 1
+        if sheet is None:
+            workbook.create_sheet('事件清单').append(EVENT_EXPORT_HEADERS)
+        workbook.save(path)
+
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(64 * 1024)
+                if not data:
+                    break
+                yield data
+    finally:
+        os.remove(path)
+
+
+@app.route('/api/events/export', methods=['GET'])
+@login_required
+def export_events():
+    """按事件列表的筛选条件导出事件（含处置流程与附件信息），format=csv（默认）或 xlsx，分块流式输出"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'xlsx'):
+        return jsonify({'code': -1, 'message': '导出格式仅支持 csv 或 xlsx'}), 400
+    try:
+        apply_event_filters(Event.query, request.args)
+    except ValueError:
+        return jsonify({'code': -1, 'message': '日期格式不正确'}), 400
+
+    args = request.args.to_dict()
+    rows = iter_event_export_rows(args)
+    filename = f"events_{datetime.now().strftime('%Y%m%d%H%M%S')}.{export_format}"
+    if export_format == 'xlsx':
+        body = stream_events_xlsx(rows)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        body = stream_events_csv(rows)
+        mimetype = 'text/csv; charset=utf-8'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+# ==================== 实时变更推送 ====================
+
+def format_sse(event, data, event_id=None):
+    lines = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{lines}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/stream', methods=['GET'])
+@login_required
+def change_stream():
+    """SSE 变更推送：事件、计划任务、通知审计提交后推送 {id(版本号), entity, entity_id, action}
+
+    topics 参数（逗号分隔，默认全部）：event / plan_task / audit。断线重连时浏览器自动携带
+    Last-Event-ID，服务端补发之后的变更；积压过多或推送队列溢出时发送 reset 事件，客户端应整体刷新。
+    无变更时每 CHANGE_FEED_HEARTBEAT_SECONDS 秒发送一次心跳注释，用于保持连接与及时发现断开的客户端。
+    """
+    topics = [topic.strip() for topic in request.args.get('topics', ','.join(CHANGE_FEED_TOPICS)).split(',') if topic.strip()]
+    unknown = set(topics) - set(CHANGE_FEED_TOPICS)
+    if unknown or not topics:
+        return jsonify({'code': -1, 'message': f"topics 仅支持: {', '.join(CHANGE_FEED_TOPICS)}"}), 400
+    if not change_feed.recording:
+        return jsonify({'code': -1, 'message': '变更日志尚未就绪，请先执行数据库迁移'}), 503
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    # 先订阅再补发，补发与实时推送重叠的部分按版本号去重
+    subscriber = change_feed.subscribe(topics)
+    replay = change_feed.replay(last_event_id, topics) if last_event_id is not None else []
+    db.session.remove()
+
+    def generate():
+        replayed = set()
+        try:
+            yield 'retry: 3000\n\n'
+            yield format_sse('hello', {'topics': topics})
+            if replay is None:
+                yield format_sse('reset', {'reason': 'backlog'})
+            else:
+                for change in replay:
+                    replayed.add(change['id'])
+                    yield format_sse('change', change, change['id'])
+            while True:
+                changes, overflow = subscriber.get(CHANGE_FEED_HEARTBEAT_SECONDS)
+                if overflow:
+                    yield format_sse('reset', {'reason': 'overflow'})
+                    continue
+                if replayed:
+                    changes = [change for change in changes if change['id'] not in replayed]
+                if not changes:
+                    yield ': heartbeat\n\n'
+                    continue
+                yield ''.join(format_sse('change', change, change['id']) for change in changes)
+        finally:
+            change_feed.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # 关闭 Nginx 缓冲，变更立即送达
+    })
+
+
 # 附件上传接口
 @app.route('/api/events/<int:event_id>/attachments', methods=['POST'])
 @login_required
@@ -1574,16 +4719,20 @@ def download_attachment(id):
 @app.route('/api/dashboard/overview', methods=['GET'])
 @login_required
 def get_dashboard_overview():
-    """获取概览统计数据"""
+    """获取概览统计数据，collapse=1 时重复事件不单独计数（按父事件统计）"""
+    collapse = request.args.get('collapse', '').lower() in ('1', 'true', 'yes')
+    events = Event.query.filter(Event.parent_id.is_(None)) if collapse else Event.query
+
     # 业务系统数量
     total_systems = BusinessSystem.query.count()
     
     # 事件数量统计
-    total_events = Event.query.count()
-    pending_events = Event.query.filter_by(status='待处理').count()
-    processing_events = Event.query.filter_by(status='处理中').count()
-    resolved_events = Event.query.filter_by(status='已解决').count()
-    closed_events = Event.query.filter_by(status='已关闭').count()
+    total_events = events.count()
+    pending_events = events.filter_by(status='待处理').count()
+    processing_events = events.filter_by(status='处理中').count()
+    resolved_events = events.filter_by(status='已解决').count()
+    closed_events = events.filter_by(status='已关闭').count()
+    duplicate_events = Event.query.filter(Event.parent_id.isnot(None)).count()
     
     # 按状态分类统计
     status_stats = [
@@ -1594,22 +4743,22 @@ def get_dashboard_overview():
     ]
     
     # 按事件类型统计
-    type_stats = db.session.query(
+    type_stats = events.with_entities(
         Event.event_type, 
         db.func.count(Event.id)
     ).group_by(Event.event_type).all()
     
     # 按严重程度统计
-    severity_stats = db.session.query(
+    severity_stats = events.with_entities(
         Event.severity, 
         db.func.count(Event.id)
     ).group_by(Event.severity).all()
     
     # 最近事件列表
-    recent_events = Event.query.order_by(Event.created_at.desc()).limit(5).all()
+    recent_events = events.order_by(Event.created_at.desc()).limit(5).all()
     
     # 平均响应时间(小时)
-    resolved = Event.query.filter(Event.resolved_at.isnot(None)).all()
+    resolved = events.filter(Event.resolved_at.isnot(None)).all()
     avg_response_time = 0
     if resolved:
         total_time = sum([(e.resolved_at - e.occurred_at).total_seconds() for e in resolved])
@@ -1627,6 +4776,7 @@ def get_dashboard_overview():
             'total_events': total_events,
             'pending_events': pending_events,
             'processing_events': processing_events,
+            'duplicate_events': duplicate_events,
             'avg_response_time': avg_response_time,
             'status_stats': status_stats,
             'type_stats': [{'type': t[0], 'count': t[1]} for t in type_stats],
@@ -1638,6 +4788,7 @@ def get_dashboard_overview():
                 'event_type': e.event_type,
                 'severity': e.severity,
                 'status': e.status,
+                'duplicate_count': e.duplicate_count or 0,
                 'occurred_at': e.occurred_at.strftime('%Y-%m-%d %H:%M:%S')
             } for e in recent_events],
             'plan_task_stats': {
@@ -1651,10 +4802,12 @@ def get_dashboard_overview():
 @app.route('/api/dashboard/trend', methods=['GET'])
 @login_required
 def get_dashboard_trend():
-    """获取事件趋势数据"""
+    """获取事件趋势数据，collapse=1 时不计重复事件"""
     from datetime import timedelta
     
     period = request.args.get('period', 'week')  # today, week, month
+    collapse = request.args.get('collapse', '').lower() in ('1', 'true', 'yes')
+    events = Event.query.filter(Event.parent_id.is_(None)) if collapse else Event.query
     now = datetime.now()
     
     if period == 'today':
@@ -1665,7 +4818,7 @@ def get_dashboard_trend():
         for i in range(24):
             hour_start = start_time + timedelta(hours=i)
             hour_end = hour_start + timedelta(hours=1)
-            count = Event.query.filter(
+            count = events.filter(
                 Event.occurred_at >= hour_start,
                 Event.occurred_at < hour_end
             ).count()
@@ -1680,7 +4833,7 @@ def get_dashboard_trend():
         for i in range(7):
             day_start = start_time + timedelta(days=i)
             day_end = day_start + timedelta(days=1)
-            count = Event.query.filter(
+            count = events.filter(
                 Event.occurred_at >= day_start,
                 Event.occurred_at < day_end
             ).count()
@@ -1695,7 +4848,7 @@ def get_dashboard_trend():
         current_day = start_time
         while current_day.month == now.month:
             day_end = current_day + timedelta(days=1)
-            count = Event.query.filter(
+            count = events.filter(
                 Event.occurred_at >= current_day,
                 Event.occurred_at < day_end
             ).count()
@@ -1788,6 +4941,61 @@ def get_plan_task(task_id):
     task = PlanTask.query.get_or_404(task_id)
     return jsonify({'code': 0, 'data': serialize_plan_task(task)})
 
+@app.route('/api/plan-tasks/calendar', methods=['GET'])
+@login_required
+def get_plan_task_calendar():
+    """获取时间范围内计划任务的执行日历（周期任务展开为具体执行时间）"""
+    try:
+        start_arg = request.args.get('start')
+        start = datetime.fromisoformat(start_arg) if start_arg else datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        end_arg = request.args.get('end')
+        if end_arg:
+            end = datetime.fromisoformat(end_arg)
+            # 只传日期时包含结束当天
+            if len(end_arg) <= 10:
+                end += timedelta(days=1) - timedelta(microseconds=1)
+        else:
+            end = start + timedelta(days=30)
+    except ValueError:
+        return jsonify({'code': -1, 'message': '时间格式不正确'}), 400
+
+    if end < start:
+        return jsonify({'code': -1, 'message': '结束时间不能早于开始时间'}), 400
+    if end - start > timedelta(days=366):
+        return jsonify({'code': -1, 'message': '查询范围不能超过一年'}), 400
+
+    items, tasks = occurrence_index.query(start, end)
+    return jsonify({
+        'code': 0,
+        'data': {
+            'items': [{'time': formatted, 'task_id': task_id} for formatted, task_id in items],
+            'tasks': {str(task_id): summary for task_id, summary in tasks.items()},
+            'total': len(items)
+        }
+    })
+
+@app.route('/api/plan-tasks/next-runs', methods=['GET'])
+@login_required
+def get_plan_task_next_runs():
+    """批量获取计划任务之后的若干次执行时间"""
+    ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip().isdigit()]
+    count = min(max(request.args.get('count', 5, type=int), 1), 100)
+
+    query = PlanTask.query
+    if ids:
+        query = query.filter(PlanTask.id.in_(ids))
+    else:
+        query = query.filter(PlanTask.status.in_(REMINDER_ACTIVE_STATUSES))
+
+    next_runs = batch_next_run_times(query.all(), count=count)
+    return jsonify({
+        'code': 0,
+        'data': {
+            str(task_id): [t.strftime('%Y-%m-%d %H:%M') for t in times]
+            for task_id, times in next_runs.items()
+        }
+    })
+
 @app.route('/api/notification-audits', methods=['GET'])
 @login_required
 def get_notification_audits():
@@ -1822,7 +5030,11 @@ def get_notification_audits():
             'content': audit.content,
             'status': audit.status,
             'error_msg': audit.error_msg,
-            'sent_at': audit.sent_at.strftime('%Y-%m-%d %H:%M:%S')
+            'sent_at': audit.sent_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'outbox_id': audit.outbox_id,
+            'attempt_no': audit.attempt_no,
+            'task_ids': [int(i) for i in audit.task_ids.split(',')] if audit.task_ids else ([audit.task_id] if audit.task_id else []),
+            'latency_ms': audit.latency_ms
         })
         
     return jsonify({
@@ -1844,72 +5056,165 @@ def bulk_delete_notification_audits():
     
     try:
         NotificationAudit.query.filter(NotificationAudit.id.in_(ids)).delete(synchronize_session=False)
+        record_changes('audit', ids, 'deleted')
         db.session.commit()
         return jsonify({'code': 0, 'message': f'成功删除 {len(ids)} 条记录'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'code': -1, 'message': f'删除失败: {str(e)}'})
 
+@app.route('/api/notification-outbox', methods=['GET'])
+@login_required
+def get_notification_outbox():
+    """获取通知发件箱（待发送/已发送/死信）"""
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 15, type=int)
+    status = request.args.get('status')
+
+    query = NotificationOutbox.query
+    if status:
+        query = query.filter(NotificationOutbox.status == status)
+
+    pagination = query.order_by(NotificationOutbox.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+
+    return jsonify({
+        'code': 0,
+        'data': [{
+            'id': m.id,
+            'task_id': m.task_id,
+            'task_ids': [int(i) for i in m.task_ids.split(',')] if m.task_ids else ([m.task_id] if m.task_id else []),
+            'task_title': m.task_title,
+            'robot_name': m.robot_name,
+            'title': m.title,
+            'status': m.status,
+            'attempts': m.attempts,
+            'next_attempt_at': m.next_attempt_at.strftime('%Y-%m-%d %H:%M:%S') if m.next_attempt_at else None,
+            'last_error': m.last_error,
+            'created_at': m.created_at.strftime('%Y-%m-%d %H:%M:%S') if m.created_at else None,
+            'sent_at': m.sent_at.strftime('%Y-%m-%d %H:%M:%S') if m.sent_at else None
+        } for m in pagination.items],
+        'total': pagination.total,
+        'pages': pagination.pages,
+        'current_page': pagination.page
+    })
+
+@app.route('/api/notification-outbox/retry', methods=['POST'])
+@admin_required
+def retry_notification_outbox():
+    """将死信消息重新放回发件箱投递"""
+    data = request.json or {}
+    ids = data.get('ids', [])
+    if not ids:
+        return jsonify({'code': -1, 'message': '请选择要重试的消息'})
+
+    count = NotificationOutbox.query.filter(
+        NotificationOutbox.id.in_(ids),
+        NotificationOutbox.status == '死信'
+    ).update({
+        'status': '待发送',
+        'attempts': 0,
+        'next_attempt_at': datetime.now()
+    }, synchronize_session=False)
+    db.session.commit()
+    delivery_worker.notify()
+    return jsonify({'code': 0, 'message': f'已重新排队 {count} 条消息'})
+
+@app.route('/api/notification-rate-limits', methods=['GET'])
+@login_required
+def get_notification_rate_limits():
+    """获取各机器人 Webhook 的限流状态：令牌余量、排队深度与限流延迟"""
+    backlog = dict(db.session.query(
+        NotificationOutbox.webhook_url,
+        db.func.count(NotificationOutbox.id)
+    ).filter(NotificationOutbox.status == '待发送').group_by(NotificationOutbox.webhook_url).all())
+
+    snapshot = webhook_limiter.snapshot()
+    items = []
+    for webhook_url in set(snapshot) | set(backlog):
+        stats = snapshot.get(webhook_url) or {
+            'tokens': webhook_limiter.capacity,
+            'capacity': webhook_limiter.capacity,
+            'waiting': 0,
+            'sent': 0,
+            'throttled': 0,
+            'throttle_delay_total': 0,
+            'throttle_delay_max': 0,
+            'throttle_delay_avg': 0
+        }
+        stats = dict(stats, queued=backlog.get(webhook_url, 0))
+        stats['robot_name'] = alert_robot_registry.name_for_webhook(webhook_url)
+        stats['queue_depth'] = stats['waiting'] + stats['queued']
+        # Webhook 中包含 access_token，仅返回脱敏后的地址
+        stats['webhook_url'] = (webhook_url or '')[:40] + '***' if webhook_url else ''
+        items.append(stats)
+
+    return jsonify({
+        'code': 0,
+        'data': {
+            'rate_limit': webhook_limiter.capacity,
+            'period_seconds': round(webhook_limiter.capacity / webhook_limiter.rate),
+            'items': sorted(items, key=lambda x: x['queue_depth'], reverse=True)
+        }
+    })
+
+@app.route('/api/scheduler-metrics', methods=['GET'])
+@login_required
+def get_scheduler_metrics():
+    """获取提醒调度指标：提醒延迟、调度耗时、Webhook 耗时分布与各机器人成功/失败次数
+
+    指标为当前进程内统计，只有持有调度租约的进程会产生调度与投递数据。
+    """
+    backlog, oldest = db.session.query(
+        db.func.count(NotificationOutbox.id),
+        db.func.min(NotificationOutbox.created_at)
+    ).filter(NotificationOutbox.status == '待发送').one()
+
+    data = scheduler_metrics.snapshot()
+    data.update({
+        'is_leader': reminder_lease.is_leader,
+        'pending_reminders': reminder_scheduler.pending_count(),
+        'outbox_pending': backlog,
+        'outbox_oldest_pending_seconds': round((datetime.now() - oldest).total_seconds(), 1) if oldest else 0
+    })
+    return jsonify({'code': 0, 'data': data})
+
+# 测试通知最多等待令牌的秒数，超过时直接返回限流提示
+TEST_NOTIFICATION_MAX_WAIT = 5
+
+
 @app.route('/api/plan-tasks/test-notification', methods=['POST'])
 
 @login_required
 def test_plan_task_notification():
     data = request.json
-    webhook_url = data.get('webhook_url')
-    template = data.get('reminder_message') or '【计划任务提醒】任务：{title}，计划时间：{plan_time}，负责人：{owner}。'
+    webhook_url = data.get('webhook_url') or alert_robot_registry.get_webhook(data.get('alert_robot'))
     
     # 模拟或获取变量
     title = data.get('title', '测试任务')
-    plan_time = data.get('plan_time', datetime.now().strftime('%Y-%m-%d %H:%M'))
-    owner = data.get('owner', '测试负责人')
     responsible = data.get('responsible', [])
     if isinstance(responsible, list):
         responsible = '、'.join(responsible)
     
-    preps = data.get('preparations', [])
-    completed_count = len([p for p in preps if p.get('status') == '已完成'])
-    # 使用符号更直观地展示状态
-    prep_text_list = []
-    for p in preps:
-        status_icon = "✅" if p.get('status') == '已完成' else "⬜"
-        prep_text_list.append(f"{status_icon} {p.get('description')}")
-    
-    prep_text = '\n\n'.join(prep_text_list) if prep_text_list else '无'
-    prep_progress = f"{completed_count}/{len(preps)}"
-    
-    # 处理换行符：将字面量 \n 替换为实际换行符，并统一换行格式
-    template = template.replace('\\n', '\n').replace('\r\n', '\n')
-    
-    # 替换变量
-    message = template
-    replacements = {
-        '{title}': title,
-        '{plan_time}': plan_time,
-        '{owner}': owner,
-        '{responsible}': responsible,
-        '{preparations}': prep_text,
-        '{prep_progress}': prep_progress
-    }
-    
-    for key, val in replacements.items():
-        message = message.replace(key, str(val))
-    
-    # 构建美化的 Markdown 消息
-    markdown_title = f"⏰ 计划任务提醒: {title}"
-    # 确保引用块中的每一行都带上 > 符号，且 Markdown 换行建议使用双换行或末尾双空格
-    safe_message = message.replace('\n', '\n\n> ')
-    markdown_text = f"### ⏰ 计划任务提醒\n\n" \
-                    f"**任务名称**: <font color='#1d4ed8'>{title}</font>\n\n" \
-                    f"--- \n\n" \
-                    f"📅 **计划时间**: {plan_time}\n\n" \
-                    f"👤 **主负责人**: {owner}\n\n" \
-                    f"👥 **责任人**: {responsible}\n\n" \
-                    f"📊 **当前进度**: `{prep_progress}`\n\n" \
-                    f"📝 **准备事项**:\n\n{prep_text}\n\n"
-
-
-
+    context = reminder_context(
+        title,
+        data.get('plan_time', datetime.now().strftime('%Y-%m-%d %H:%M')),
+        data.get('owner', '测试负责人'),
+        responsible,
+        [(p.get('status'), p.get('description')) for p in data.get('preparations', [])]
+    )
+    markdown_title, markdown_text = render_reminder(context)
+
+    if webhook_url:
+        retry_after = webhook_limiter.acquire_within(webhook_url.strip(), TEST_NOTIFICATION_MAX_WAIT)
+        if retry_after:
+            retry_after = int(math.ceil(retry_after))
+            return jsonify({
+                'code': -1,
+                'message': f'该机器人发送已达频率上限（排队中的提醒优先），请 {retry_after} 秒后重试'
+            }), 429, {'Retry-After': str(retry_after)}
+    started = time.monotonic()
     success, msg = send_dingtalk_notification(webhook_url, markdown_text, title=markdown_title)
+    latency = time.monotonic() - started
     
     # 记录测试通知审计日志
     audit = NotificationAudit(
@@ -1921,7 +5226,8 @@ def test_plan_task_notification():
         title=markdown_title,
         content=markdown_text,
         status='成功' if success else '失败',
-        error_msg=None if success else msg
+        error_msg=None if success else msg,
+        latency_ms=int(latency * 1000)
     )
     db.session.add(audit)
     db.session.commit()
@@ -1990,6 +5296,7 @@ def create_plan_task():
         db.session.add(prep)
     
     db.session.commit()
+    notify_plan_task_changed(task.id)
     return jsonify({'code': 0, 'message': '创建成功', 'data': {'id': task.id}})
 
 @app.route('/api/plan-tasks/<int:task_id>', methods=['PUT'])
@@ -2068,6 +5375,7 @@ def update_plan_task(task_id):
             db.session.add(prep)
     
     db.session.commit()
+    notify_plan_task_changed(task.id)
     return jsonify({'code': 0, 'message': '更新成功'})
 
 @app.route('/api/plan-tasks/<int:task_id>/status', methods=['POST'])
@@ -2093,6 +5401,7 @@ def update_plan_task_status(task_id):
         return jsonify({'code': -1, 'message': '未知的操作'}), 400
     
     db.session.commit()
+    notify_plan_task_changed(task.id)
     return jsonify({'code': 0, 'message': '状态更新成功'})
 
 
@@ -2103,6 +5412,7 @@ def delete_plan_task(task_id):
     task = PlanTask.query.get_or_404(task_id)
     db.session.delete(task)
     db.session.commit()
+    notify_plan_task_changed(task_id)
     return jsonify({'code': 0, 'message': '删除成功'})
 
 
@@ -2191,6 +5501,8 @@ def create_config():
     
     db.session.add(config)
     db.session.commit()
+    if config.config_key == 'alert_robots':
+        alert_robot_registry.invalidate()
     
     return jsonify({'code': 0, 'message': '创建成功', 'data': {'id': config.id}})
 
@@ -2206,6 +5518,8 @@ def update_config(id):
         config.description = data['description']
     
     db.session.commit()
+    if config.config_key == 'alert_robots':
+        alert_robot_registry.invalidate()
     
     return jsonify({'code': 0, 'message': '更新成功'})
 
@@ -2218,6 +5532,8 @@ def delete_config(id):
     
     db.session.delete(config)
     db.session.commit()
+    if config.config_key == 'alert_robots':
+        alert_robot_registry.invalidate()
     
     return jsonify({'code': 0, 'message': '删除成功'})
 
@@ -2331,18 +5647,19 @@ def init_database():
             }
         ]
         
-        for event_data in events_data:
+        # 编号在写入事件前一次分配（SQLite 写事务期间无法在另一连接递增序列）
+        event_nos = event_no_allocator.allocate(len(events_data))
+        for event_data, event_no in zip(events_data, event_nos):
             system = event_data.pop('system')
             resolved_at = event_data.pop('resolved_at', None)
             
-            today = datetime.now().strftime('%Y%m%d')
-            count = Event.query.count()
-            event_no = f'INC-{today}-{count + 1:04d}'
-            
             event = Event(
                 event_no=event_no,
                 system_id=system.id,
                 system_name=system.system_name,
+                fingerprint=event_fingerprint(system.id, event_data['event_type'], event_data['title']),
+                duplicate_count=0,
+                last_occurred_at=event_data['occurred_at'],
                 **event_data
             )
             
@@ -2374,6 +5691,9 @@ def init_database():
                         remarks='完成处理'
                     )
                     db.session.add(process2)
+
+            db.session.flush()
+            event_search_index.index_event(event)
         
         # 插入系统配置
         configs = [
@@ -0,0 +1,165 @@
+"""计划任务通知吞吐量压测
+
+启动本地钉钉模拟服务 (mock_dingtalk.py)，向一个独立的数据库写入 N 条同一时刻到期的计划任务，
+由 app.py 的后台提醒线程 (background_reminder_worker) 与投递线程完成整条链路，统计：
+- 端到端吞吐量（条/秒）：从提醒时间点到最后一条发送成功
+- 提醒延迟：发送成功时间 - 提醒时间点 (p50/p95/max)
+- 入队延迟：写入发件箱时间 - 提醒时间点
+- 调度器每轮耗时与 Webhook 往返耗时
+
+默认使用临时 SQLite 数据库，不会影响正式数据。用法示例：
+    python benchmark_notifications.py --tasks 1000 --robots 10 --latency 150 --jitter 50
+    python benchmark_notifications.py --tasks 500 --robots 5 --error-rate 0.1 --mock-rate-limit 20
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='计划任务通知吞吐量压测')
+    parser.add_argument('--tasks', type=int, default=500, help='同时到期的计划任务数')
+    parser.add_argument('--robots', type=int, default=5, help='任务平均分配到的机器人（Webhook）数量')
+    parser.add_argument('--lead', type=float, default=3, help='任务在多少秒后到期，留出调度器加载时间')
+    parser.add_argument('--timeout', type=float, default=300, help='等待全部发送完成的最长秒数')
+    parser.add_argument('--port', type=int, default=18080, help='钉钉模拟服务端口')
+    parser.add_argument('--latency', type=float, default=100, help='模拟钉钉响应耗时（毫秒）')
+    parser.add_argument('--jitter', type=float, default=30, help='响应耗时抖动（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟钉钉返回业务错误的比例')
+    parser.add_argument('--errcode', type=int, default=310000, help='业务错误的 errcode')
+    parser.add_argument('--mock-rate-limit', type=int, default=0, help='模拟钉钉每个机器人每分钟限速，超出返回 130101')
+    parser.add_argument('--app-rate-limit', type=int, default=0,
+                        help='系统侧每个机器人每分钟限速 (DINGTALK_RATE_LIMIT)，默认不限制以测量最大吞吐')
+    parser.add_argument('--database', help='数据库连接串，默认使用临时 SQLite 文件')
+    parser.add_argument('--verbose', action='store_true', help='显示系统 DEBUG 日志')
+    return parser.parse_args()
+
+
+def percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def main():
+    args = parse_args()
+
+    # 环境变量需在导入 app 之前设置
+    db_file = None
+    if not args.database:
+        fd, db_file = tempfile.mkstemp(prefix='it_ops_bench_', suffix='.db')
+        os.close(fd)
+        os.remove(db_file)
+        args.database = f'sqlite:///{db_file}'
+    os.environ['DATABASE_URI'] = args.database
+    os.environ['DINGTALK_RATE_LIMIT'] = str(args.app_rate_limit or max(args.tasks, 20) * 10)
+    os.environ.setdefault('NOTIFY_RETRY_BASE_SECONDS', '1')
+    os.environ.setdefault('SCHEDULER_LEASE_SECONDS', '6')
+
+    from mock_dingtalk import start_mock_server
+    server, mock_state = start_mock_server(
+        '127.0.0.1', args.port,
+        latency_ms=args.latency, jitter_ms=args.jitter,
+        error_rate=args.error_rate, errcode=args.errcode,
+        rate_limit=args.mock_rate_limit, rate_period=60
+    )
+
+    log_sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with log_sink:
+        import app as it_ops
+        it_ops.run_migrations()
+        it_ops.init_database()
+
+    db = it_ops.db
+    PlanTask = it_ops.PlanTask
+    NotificationOutbox = it_ops.NotificationOutbox
+
+    print(f"数据库: {args.database}")
+    print(f"钉钉模拟服务: 127.0.0.1:{args.port} 延迟 {args.latency}±{args.jitter}ms 错误率 {args.error_rate} 限速 {args.mock_rate_limit or '无'}")
+
+    with it_ops.app.app_context():
+        # 清理示例数据中的计划任务，避免干扰统计
+        PlanTask.query.delete()
+        db.session.commit()
+
+        due_at = (datetime.now() + timedelta(seconds=args.lead)).replace(microsecond=0) + timedelta(seconds=1)
+        webhooks = [f"http://127.0.0.1:{args.port}/robot/send?access_token=bench{i}" for i in range(args.robots)]
+        db.session.bulk_insert_mappings(PlanTask, [{
+            'title': f'压测任务 {i + 1}',
+            'task_type': '压测',
+            'schedule_type': 'once',
+            'plan_time': due_at,
+            'reminder_minutes': 0,
+            'reminder_enabled': True,
+            'reminder_sent': False,
+            'webhook_url': webhooks[i % len(webhooks)],
+            'status': '待执行',
+            'owner': '压测',
+            'created_at': datetime.now(),
+            'updated_at': datetime.now()
+        } for i in range(args.tasks)])
+        db.session.commit()
+        print(f"已写入 {args.tasks} 条计划任务，分布在 {args.robots} 个机器人，提醒时间 {due_at.strftime('%H:%M:%S')}")
+
+    waited = time.time() + 30
+    while not it_ops.reminder_lease.is_leader and time.time() < waited:
+        time.sleep(0.2)
+    if not it_ops.reminder_lease.is_leader:
+        print('ERROR: 30 秒内未获得调度租约，可能有其他进程正在运行调度器')
+        return 1
+
+    with log_sink:
+        it_ops.reminder_scheduler.request_reload()
+
+        deadline = time.time() + max(args.lead, 0) + args.timeout
+        with it_ops.app.app_context():
+            while time.time() < deadline:
+                remaining = db.session.query(db.func.count(NotificationOutbox.id)).filter(
+                    NotificationOutbox.status == '待发送').scalar()
+                enqueued = db.session.query(db.func.count(NotificationOutbox.id)).scalar()
+                db.session.remove()
+                if enqueued >= args.tasks and not remaining:
+                    break
+                time.sleep(0.2)
+
+    with it_ops.app.app_context():
+        messages = NotificationOutbox.query.all()
+        sent = [m for m in messages if m.status == '已发送']
+        dead = [m for m in messages if m.status == '死信']
+        pending = [m for m in messages if m.status == '待发送']
+        enqueue_lags = [(m.created_at - m.due_at).total_seconds() for m in messages if m.due_at]
+        send_lags = [(m.sent_at - m.due_at).total_seconds() for m in sent if m.due_at]
+        attempts = sum(m.attempts or 0 for m in messages)
+
+    metrics = it_ops.scheduler_metrics.snapshot()
+    print('\n==================== 压测结果 ====================')
+    print(f"入队 {len(messages)}/{args.tasks} 条，发送成功 {len(sent)}，死信 {len(dead)}，未完成 {len(pending)}，投递尝试 {attempts} 次")
+    if sent:
+        elapsed = max(send_lags) if send_lags else 0
+        print(f"端到端耗时 {elapsed:.2f}s，吞吐量 {len(sent) / elapsed if elapsed > 0 else float('inf'):.1f} 条/秒")
+        print(f"提醒延迟  p50 {percentile(send_lags, 0.5):.3f}s  p95 {percentile(send_lags, 0.95):.3f}s  max {max(send_lags):.3f}s")
+    if enqueue_lags:
+        print(f"入队延迟  p50 {percentile(enqueue_lags, 0.5):.3f}s  p95 {percentile(enqueue_lags, 0.95):.3f}s  max {max(enqueue_lags):.3f}s")
+    scan = metrics['scan_duration_seconds']
+    webhook = metrics['webhook_latency_seconds']
+    print(f"调度轮次 {metrics['scans']}，单轮耗时 avg {scan['avg']:.3f}s  max {scan['max']:.3f}s")
+    print(f"Webhook 往返 avg {webhook['avg']:.3f}s  p95 {webhook['p95']:.3f}s  max {webhook['max']:.3f}s")
+    mock_total = mock_state.snapshot()['total']
+    print(f"模拟服务收到 {mock_total['received']} 次请求：成功 {mock_total['ok']}，业务错误 {mock_total['errors']}，"
+          f"限速 {mock_total['rate_limited']}，HTTP 错误 {mock_total['http_errors']}")
+
+    server.shutdown()
+    if db_file and os.path.exists(db_file):
+        with contextlib.suppress(OSError):
+            os.remove(db_file)
+    return 0 if len(sent) == args.tasks else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
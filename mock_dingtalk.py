@@ -0,0 +1,178 @@
+"""本地钉钉机器人模拟服务
+
+模拟钉钉自定义机器人接口 POST /robot/send?access_token=xxx，用于在不访问
+oapi.dingtalk.com 的情况下联调与压测通知链路。支持：
+- 固定延迟 + 随机抖动，模拟网络与钉钉处理耗时
+- 按比例返回指定 errcode（默认 310000）或 HTTP 500
+- 按 access_token 限速，超出时返回 errcode 130101（与钉钉每分钟 20 条限制一致）
+
+GET /stats 返回各 access_token 的收发统计，POST /stats/reset 清零。
+
+用法示例：
+    python mock_dingtalk.py --port 18080 --latency 200 --jitter 50 --error-rate 0.05 --rate-limit 20
+    机器人 Webhook 配置为 http://127.0.0.1:18080/robot/send?access_token=test
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RATE_LIMIT_ERRCODE = 130101
+RATE_LIMIT_ERRMSG = 'send too fast, exceed 20 times per minute'
+
+
+class MockDingTalkState:
+    """模拟服务的行为配置与统计数据，多个请求线程共享"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, errcode=310000,
+                 http_error_rate=0.0, rate_limit=0, rate_period=60):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.errcode = errcode
+        self.http_error_rate = http_error_rate
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self._lock = threading.Lock()
+        self._windows = {}  # access_token -> 最近一个限速周期内的请求时间
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+            self.stats = {}
+            self.received = []  # (到达时间戳, access_token, 消息体)
+
+    def _token_stats(self, token):
+        return self.stats.setdefault(token, {'received': 0, 'ok': 0, 'errors': 0, 'rate_limited': 0, 'http_errors': 0})
+
+    def handle(self, token, payload):
+        """决定本次请求的响应，返回 (HTTP 状态码, 响应体字典)"""
+        now = time.time()
+        with self._lock:
+            stats = self._token_stats(token)
+            stats['received'] += 1
+            self.received.append((now, token, payload))
+
+            if self.rate_limit:
+                window = self._windows.setdefault(token, deque())
+                while window and window[0] <= now - self.rate_period:
+                    window.popleft()
+                if len(window) >= self.rate_limit:
+                    stats['rate_limited'] += 1
+                    return 200, {'errcode': RATE_LIMIT_ERRCODE, 'errmsg': RATE_LIMIT_ERRMSG}
+                window.append(now)
+
+            if self.http_error_rate and random.random() < self.http_error_rate:
+                stats['http_errors'] += 1
+                return 500, {'errcode': -1, 'errmsg': 'internal server error'}
+            if self.error_rate and random.random() < self.error_rate:
+                stats['errors'] += 1
+                return 200, {'errcode': self.errcode, 'errmsg': f'mock error {self.errcode}'}
+            stats['ok'] += 1
+            return 200, {'errcode': 0, 'errmsg': 'ok'}
+
+    def delay(self):
+        """本次请求的模拟耗时（秒）"""
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(latency, 0) / 1000.0
+
+    def snapshot(self):
+        with self._lock:
+            total = {'received': 0, 'ok': 0, 'errors': 0, 'rate_limited': 0, 'http_errors': 0}
+            for stats in self.stats.values():
+                for key in total:
+                    total[key] += stats[key]
+            return {'total': total, 'tokens': {token: dict(stats) for token, stats in self.stats.items()}}
+
+
+class MockDingTalkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持长连接，与钉钉一致
+    state = None
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+
+        if url.path == '/stats/reset':
+            self.state.reset()
+            return self._reply(200, {'errcode': 0, 'errmsg': 'ok'})
+        if url.path != '/robot/send':
+            return self._reply(404, {'errcode': 404, 'errmsg': 'not found'})
+
+        token = (parse_qs(url.query).get('access_token') or [''])[0]
+        if not token:
+            return self._reply(200, {'errcode': 300001, 'errmsg': 'token is not exist'})
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return self._reply(200, {'errcode': 40035, 'errmsg': '缺少参数 json'})
+
+        time.sleep(self.state.delay())
+        status, result = self.state.handle(token, payload)
+        self._reply(status, result)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            return self._reply(200, self.state.snapshot())
+        self._reply(404, {'errcode': 404, 'errmsg': 'not found'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(host='127.0.0.1', port=18080, **options):
+    """在后台线程启动模拟服务，返回 (server, state)，调用 server.shutdown() 停止"""
+    state = MockDingTalkState(**options)
+    handler = type('BoundMockDingTalkHandler', (MockDingTalkHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地钉钉机器人模拟服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的模拟耗时（毫秒）')
+    parser.add_argument('--jitter', type=float, default=0, help='耗时随机抖动范围（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回业务错误的比例 (0~1)')
+    parser.add_argument('--errcode', type=int, default=310000, help='业务错误时返回的 errcode')
+    parser.add_argument('--http-error-rate', type=float, default=0.0, help='返回 HTTP 500 的比例 (0~1)')
+    parser.add_argument('--rate-limit', type=int, default=0, help='每个 access_token 每周期最多接受的消息数，0 表示不限速')
+    parser.add_argument('--rate-period', type=float, default=60, help='限速周期（秒）')
+    args = parser.parse_args()
+
+    server, state = start_mock_server(
+        args.host, args.port,
+        latency_ms=args.latency, jitter_ms=args.jitter,
+        error_rate=args.error_rate, errcode=args.errcode,
+        http_error_rate=args.http_error_rate,
+        rate_limit=args.rate_limit, rate_period=args.rate_period
+    )
+    print(f"钉钉模拟服务已启动: http://{args.host}:{args.port}/robot/send?access_token=<任意值>")
+    print(f"统计信息: http://{args.host}:{args.port}/stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(state.snapshot(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -36,6 +36,10 @@ pip install -r requirements.txt
 mkdir -p uploads
 mkdir -p instance
 
+# 执行数据库迁移（已是最新版本时直接跳过）
+echo "检查数据库结构版本..."
+python3 -m flask --app app migrate
+
 # 启动应用
 echo "========================================"
 echo "启动IT运维管理系统..."
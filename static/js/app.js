@@ -25,6 +25,7 @@ const apiFetch = (url, options = {}) => {
 let currentPage = "dashboard";
 
 let currentEventId = null;
+let currentEventsPage = 1;
 let currentSystemId = null;
 let processStepCounter = 0;
 let eventAttachments = [];
@@ -176,6 +177,8 @@ async function checkCurrentUser() {
             if (!isAdmin && (currentPage === 'users' || currentPage === 'config')) {
                 showPage('dashboard');
             }
+
+            startChangeStream();
         } else {
             // 未登录或登录过期
             window.location.href = "/login.html";
@@ -648,7 +651,11 @@ function renderRecentEvents(events) {
     
     tbody.innerHTML = events.map(event => `
         <tr>
-            <td>${event.event_no}</td>
+            <td>
+                ${event.event_no}
+                ${event.duplicate_count ? `<span class="status-badge warning" title="最近一次: ${event.last_occurred_at || "-"}">重复 ×${event.duplicate_count}</span>` : ""}
+                ${event.parent_id ? `<span class="status-badge info" title="已归并到父事件">重复</span>` : ""}
+            </td>
             <td>${event.system_name}</td>
             <td>${event.event_type}</td>
             <td><span class="status-badge ${getSeverityClass(event.severity)}">${event.severity}</span></td>
@@ -1158,6 +1165,7 @@ function addHostRow(hostData = null) {
     const hostDiv = document.createElement("div");
     hostDiv.className = "host-row";
     hostDiv.setAttribute("data-host-id", hostCounter);
+    if (hostData?.id) hostDiv.dataset.recordId = hostData.id;  // 已保存记录的 id，保存时用于增量更新
     
     const hostTypeOptions = configCache["host_types"] 
         ? configCache["host_types"].map(t => `<option value="${t}" ${hostData && hostData.host_type === t ? "selected" : ""}>${t}</option>`).join("")
@@ -1225,6 +1233,7 @@ function addMiddlewareRow(mwData = null) {
     const mwDiv = document.createElement("div");
     mwDiv.className = "middleware-row";
     mwDiv.setAttribute("data-mw-id", middlewareCounter);
+    if (mwData?.id) mwDiv.dataset.recordId = mwData.id;  // 已保存记录的 id，保存时用于增量更新
     
     const mwTypeOptions = configCache["middleware_types"]
         ? configCache["middleware_types"].map(t => `<option value="${t}" ${mwData && mwData.middleware_type === t ? "selected" : ""}>${t}</option>`).join("")
@@ -1270,6 +1279,7 @@ function addIntegrationRow(intData = null) {
     const intDiv = document.createElement("div");
     intDiv.className = "integration-row";
     intDiv.setAttribute("data-int-id", integrationCounter);
+    if (intData?.id) intDiv.dataset.recordId = intData.id;  // 已保存记录的 id，保存时用于增量更新
     
     intDiv.innerHTML = `
         <span class="row-remove" onclick="removeIntegrationRow(${integrationCounter})">×</span>
@@ -1332,6 +1342,7 @@ async function saveSystem() {
         const cpuArch = row.querySelector(".host-cpu-arch").value;
         if (hostType || ipAddress) {
             hosts.push({
+                id: row.dataset.recordId ? parseInt(row.dataset.recordId) : undefined,
                 host_type: hostType,
                 ip_address: ipAddress,
                 host_purpose: hostPurpose,
@@ -1353,6 +1364,7 @@ async function saveSystem() {
         const quantity = parseInt(row.querySelector(".middleware-quantity").value) || 1;
         if (mwType) {
             middlewares.push({
+                id: row.dataset.recordId ? parseInt(row.dataset.recordId) : undefined,
                 middleware_type: mwType,
                 middleware_version: mwVersion,
                 quantity: quantity
@@ -1368,6 +1380,7 @@ async function saveSystem() {
         const networkType = row.querySelector(".network-type").value;
         if (remoteSystemName) {
             integrations.push({
+                id: row.dataset.recordId ? parseInt(row.dataset.recordId) : undefined,
                 integration_type: integrationType,
                 remote_system_name: remoteSystemName,
                 network_type: networkType
@@ -1643,28 +1656,40 @@ async function deleteSystem(systemId) {
 
 // ==================== 事件管理功能 ====================
 
+// 事件列表筛选条件（列表查询与导出共用）
+function getEventFilterQuery() {
+    const systemName = document.getElementById("event-system-name")?.value || "";
+    const title = document.getElementById("event-title-filter")?.value || "";
+    const status = document.getElementById("event-status-filter")?.value || "";
+    const startDate = document.getElementById("event-start-date")?.value || "";
+    const endDate = document.getElementById("event-end-date")?.value || "";
+    const eventType = document.getElementById("event-type-filter")?.value || "";
+    const severity = document.getElementById("event-severity-filter")?.value || "";
+    const progressStatus = document.getElementById("event-progress-filter")?.value || "";
+
+    let query = "";
+    if (systemName) query += `&system_name=${encodeURIComponent(systemName)}`;
+    if (title) query += `&title=${encodeURIComponent(title)}`;
+    if (status) query += `&status=${encodeURIComponent(status)}`;
+    if (progressStatus) query += `&progress_status=${encodeURIComponent(progressStatus)}`;
+    if (eventType) query += `&event_type=${encodeURIComponent(eventType)}`;
+    if (severity) query += `&severity=${encodeURIComponent(severity)}`;
+    if (startDate) query += `&start_date=${startDate}T00:00:00`;
+    if (endDate) query += `&end_date=${endDate}T23:59:59`;
+    if (document.getElementById("event-collapse-filter")?.checked) query += "&collapse=1";
+    return query;
+}
+
 async function loadEvents(page = 1) {
+    currentEventsPage = page;
     try {
-        const systemName = document.getElementById("event-system-name")?.value || "";
-        const title = document.getElementById("event-title-filter")?.value || "";
-        const status = document.getElementById("event-status-filter")?.value || "";
-        const startDate = document.getElementById("event-start-date")?.value || "";
-        const endDate = document.getElementById("event-end-date")?.value || "";
-        const eventType = document.getElementById("event-type-filter")?.value || "";
-        const severity = document.getElementById("event-severity-filter")?.value || "";
-        const progressStatus = document.getElementById("event-progress-filter")?.value || "";
+        const keyword = document.getElementById("event-keyword-filter")?.value.trim() || "";
         
-        let url = `${API_BASE}/events?page=${page}&per_page=10`;
-        if (systemName) url += `&system_name=${encodeURIComponent(systemName)}`;
-        if (title) url += `&title=${encodeURIComponent(title)}`;
-        if (status) url += `&status=${encodeURIComponent(status)}`;
-        if (progressStatus) url += `&progress_status=${encodeURIComponent(progressStatus)}`;
-
-        if (eventType) url += `&event_type=${encodeURIComponent(eventType)}`;
-
-        if (severity) url += `&severity=${encodeURIComponent(severity)}`;
-        if (startDate) url += `&start_date=${startDate}T00:00:00`;
-        if (endDate) url += `&end_date=${endDate}T23:59:59`;
+        // 填写全文检索关键词时按相关度排序返回
+        let url = keyword
+            ? `${API_BASE}/events/search?q=${encodeURIComponent(keyword)}&page=${page}&per_page=10`
+            : `${API_BASE}/events?page=${page}&per_page=10`;
+        url += getEventFilterQuery();
         
         const response = await apiFetch(url);
         const result = await response.json();
@@ -1684,9 +1709,19 @@ function renderEventsTable(events) {
     const tbody = document.getElementById("events-table-body");
     if (!tbody) return;
     
-    tbody.innerHTML = events.map(event => `
-        <tr>
-            <td>${event.event_no}</td>
+    const selectAll = document.getElementById("events-select-all");
+    if (selectAll) selectAll.checked = false;
+    tbody.innerHTML = events.map(event => `<tr data-event-id="${event.id}">${renderEventRow(event)}</tr>`).join("");
+}
+
+function renderEventRow(event) {
+    return `
+            <td style="text-align: center;"><input type="checkbox" class="event-checkbox" value="${event.id}"></td>
+            <td>
+                ${event.event_no}
+                ${event.duplicate_count ? `<span class="status-badge warning" title="最近一次: ${event.last_occurred_at || "-"}">重复 ×${event.duplicate_count}</span>` : ""}
+                ${event.parent_id ? `<span class="status-badge info" title="已归并到父事件">重复</span>` : ""}
+            </td>
             <td>${event.system_name}</td>
             <td>${event.event_type}</td>
             <td><span class="status-badge ${getSeverityClass(event.severity)}">${event.severity}</span></td>
@@ -1700,9 +1735,7 @@ function renderEventsTable(events) {
                 <button class="btn-action" onclick="showEventViewDialog(${event.id})">查看</button>
                 <button class="btn-action danger" onclick="deleteEvent(${event.id})">删除</button>
             </td>
-
-        </tr>
-    `).join("");
+    `;
 }
 
 async function showEventDialog(eventId = null) {
@@ -1710,14 +1743,13 @@ async function showEventDialog(eventId = null) {
     const dialog = document.getElementById("event-dialog");
     const title = document.getElementById("event-dialog-title");
     
-    // 加载业务系统选项
-    await loadSystemOptions();
-    
     if (eventId) {
         title.textContent = "编辑事件";
+        // 业务系统选项随事件详情一并返回
         await loadEventData(eventId);
     } else {
         title.textContent = "新增事件";
+        await loadSystemOptions();
         document.getElementById("event-form").reset();
         document.getElementById("event-id").value = "";
         document.getElementById("process-list").innerHTML = "";
@@ -1746,24 +1778,29 @@ async function loadSystemOptions() {
         const result = await response.json();
         
         if (result.code === 0) {
-            const select = document.getElementById("event-system-id");
-            select.innerHTML = '<option value="">请选择业务系统</option>' +
-                result.data.items.map(sys => 
-                    `<option value="${sys.id}">${sys.system_name}</option>`
-                ).join("");
+            renderSystemOptions(result.data.items);
         }
     } catch (error) {
         console.error("加载系统选项失败:", error);
     }
 }
 
+function renderSystemOptions(systems) {
+    const select = document.getElementById("event-system-id");
+    select.innerHTML = '<option value="">请选择业务系统</option>' +
+        systems.map(sys => 
+            `<option value="${sys.id}">${sys.system_name}</option>`
+        ).join("");
+}
+
 async function loadEventData(eventId) {
     try {
-        const response = await apiFetch(`${API_BASE}/events/${eventId}`);
+        const response = await apiFetch(`${API_BASE}/events/${eventId}?include=processes,attachments,system_options`);
         const result = await response.json();
         
         if (result.code === 0) {
             const event = result.data;
+            renderSystemOptions(event.system_options);
             document.getElementById("event-id").value = event.id;
             document.getElementById("event-system-id").value = event.system_id;
             
@@ -1810,6 +1847,7 @@ function addProcessStep(processData = null) {
     const stepDiv = document.createElement("div");
     stepDiv.className = "process-step";
     stepDiv.setAttribute("data-step-id", processStepCounter);
+    if (processData?.id) stepDiv.dataset.recordId = processData.id;  // 已保存记录的 id，保存时用于增量更新
     
     stepDiv.innerHTML = `
         <div class="process-step-header">
@@ -1932,6 +1970,7 @@ async function saveEvent() {
         const action = step.querySelector(".process-action").value;
         if (action) {
             processes.push({
+                id: step.dataset.recordId ? parseInt(step.dataset.recordId) : undefined,
                 action: action,
                 result: step.querySelector(".process-result").value,
                 operator: step.querySelector(".process-operator").value,
@@ -1982,7 +2021,7 @@ async function saveEvent() {
                 await uploadAttachments(eventId);
             }
             
-            showToast(eventId ? "更新成功" : "创建成功", "success");
+            showToast(eventId ? "更新成功" : result.message || "创建成功", "success");
             closeEventDialog();
             loadEvents();
         } else {
@@ -2022,7 +2061,7 @@ function viewEvent(eventId) {
 
 async function showEventViewDialog(eventId) {
     try {
-        const response = await apiFetch(`${API_BASE}/events/${eventId}`);
+        const response = await apiFetch(`${API_BASE}/events/${eventId}?include=processes,attachments,system,duplicates`);
         const result = await response.json();
         if (result.code === 0) {
             renderEventView(result.data);
@@ -2065,6 +2104,13 @@ function renderEventView(data) {
         </div>
     `).join("") || '<div class="event-view-desc">暂无附件</div>';
 
+    const duplicates = (data.duplicates || []).map(d => `
+        <div class="event-view-desc" style="display:flex;justify-content:space-between;gap:8px;">
+            <span>${d.event_no} ${d.title || ''}</span>
+            <span>${formatDateTimeDisplay(d.occurred_at)} · ${d.status || '-'}</span>
+        </div>
+    `).join("");
+
     body.innerHTML = `
         <div class="event-view-card">
             <div class="event-view-title-row">
@@ -2078,6 +2124,7 @@ function renderEventView(data) {
             <div class="event-view-desc">${data.title || '未填写标题'}</div>
             <div class="event-view-meta" style="margin-top:8px;">
                 <span>业务系统：${data.system_name || '-'}</span>
+                ${data.system && data.system.contact_person ? `<span>系统负责人：${data.system.contact_person}${data.system.contact_phone ? ` (${data.system.contact_phone})` : ''}</span>` : ''}
                 <span>类型：${data.event_type || '-'}</span>
                 <span>发生时间：${formatDateTimeDisplay(data.occurred_at)}</span>
                 <span>报告人：${data.reported_by || '-'}</span>
@@ -2103,6 +2150,11 @@ function renderEventView(data) {
             <div class="event-view-section-title">附件</div>
             ${attachments}
         </div>
+        ${data.duplicate_count ? `
+        <div class="event-view-card compact">
+            <div class="event-view-section-title">已归并的重复事件（${data.duplicate_count}）</div>
+            ${duplicates}
+        </div>` : ''}
     `;
 }
 
@@ -2140,9 +2192,67 @@ function searchEvents() {
     loadEvents();
 }
 
+function toggleSelectAllEvents(checkbox) {
+    document.querySelectorAll("#events-table-body .event-checkbox").forEach(cb => cb.checked = checkbox.checked);
+}
+
+// 批量修改状态：勾选的事件，未勾选时为当前筛选条件下的全部事件
+async function bulkUpdateEvents() {
+    const status = document.getElementById("event-bulk-status").value;
+    if (!status) {
+        showToast("请选择要修改的状态", "error");
+        return;
+    }
+    const selectedIds = Array.from(document.querySelectorAll("#events-table-body .event-checkbox:checked")).map(cb => parseInt(cb.value));
+    const payload = { status };
+    if (selectedIds.length > 0) {
+        if (!confirm(`确定将选中的 ${selectedIds.length} 个事件（含已归并的重复事件）状态改为“${status}”吗？`)) return;
+        payload.ids = selectedIds;
+    } else {
+        // 折叠只影响显示方式，不算筛选条件；服务端会把父事件的重复事件一并更新
+        const { collapse, ...filter } = Object.fromEntries(new URLSearchParams(getEventFilterQuery()));
+        if (Object.keys(filter).length === 0) {
+            showToast("请勾选事件或设置筛选条件", "error");
+            return;
+        }
+        if (!confirm(`未勾选事件，是否将当前筛选条件下的全部事件（含已归并的重复事件）状态改为“${status}”？`)) return;
+        payload.filter = filter;
+    }
+
+    try {
+        const response = await apiFetch(`${API_BASE}/events/bulk`, {
+            method: "POST",
+            body: JSON.stringify(payload)
+        });
+        const result = await response.json();
+        if (result.code === 0) {
+            showToast(result.message, result.data.failed ? "error" : "success");
+            loadEvents();
+        } else {
+            showToast(result.message || "批量更新失败", "error");
+        }
+    } catch (error) {
+        console.error("批量更新失败:", error);
+        showToast("批量更新失败", "error");
+    }
+}
+
+// 按当前筛选条件导出事件，由浏览器直接下载服务端流式输出的文件
+function exportEvents(format = "csv") {
+    const a = document.createElement("a");
+    a.href = `${API_BASE}/events/export?format=${format}${getEventFilterQuery()}`;
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+    showToast("正在导出，文件将在生成后开始下载", "info");
+}
+
 function resetEventFilters() {
     document.getElementById("event-system-name").value = "";
     document.getElementById("event-title-filter").value = "";
+    if (document.getElementById("event-keyword-filter")) {
+        document.getElementById("event-keyword-filter").value = "";
+    }
     document.getElementById("event-start-date").value = "";
 
     document.getElementById("event-end-date").value = "";
@@ -2156,6 +2266,70 @@ function resetEventFilters() {
 
 }
 
+// ==================== 实时变更推送 ====================
+
+// 订阅 /api/stream：已显示的事件行按 ID 就地刷新，新增/删除及计划任务、审计变更合并后刷新当前页
+let changeStream = null;
+const pendingEventPatches = new Set();
+const changeRefreshTimers = {};
+
+function startChangeStream() {
+    if (changeStream || !window.EventSource) return;
+    changeStream = new EventSource(`${API_BASE}/stream`);
+    changeStream.addEventListener("change", e => handleChange(JSON.parse(e.data)));
+    // 积压过多时服务端要求整体刷新
+    changeStream.addEventListener("reset", () => loadPageData(currentPage));
+}
+
+function scheduleChangeRefresh(key, callback, delay = 1000) {
+    if (changeRefreshTimers[key]) return;
+    changeRefreshTimers[key] = setTimeout(() => {
+        delete changeRefreshTimers[key];
+        callback();
+    }, delay);
+}
+
+function handleChange(change) {
+    if (change.entity === "event") {
+        if (currentPage === "dashboard") {
+            scheduleChangeRefresh("dashboard", loadDashboard, 5000);
+        }
+        if (currentPage !== "events") return;
+        const row = document.querySelector(`tr[data-event-id="${change.entity_id}"]`);
+        if (change.action === "updated" && row) {
+            pendingEventPatches.add(change.entity_id);
+            scheduleChangeRefresh("event-patch", patchEventRows, 300);
+        } else if (change.action === "deleted" && row) {
+            row.remove();
+        } else if (change.action === "created") {
+            scheduleChangeRefresh("events", () => loadEvents(currentEventsPage));
+        }
+    } else if (change.entity === "plan_task" && currentPage === "plan-tasks") {
+        scheduleChangeRefresh("plan-tasks", () => loadPlanTasks());
+    } else if (change.entity === "audit" && currentPage === "notification-audits") {
+        scheduleChangeRefresh("audits", () => loadNotificationAudits(notificationAuditPage));
+    }
+}
+
+async function patchEventRows() {
+    const ids = Array.from(pendingEventPatches);
+    pendingEventPatches.clear();
+    for (const id of ids) {
+        try {
+            const response = await apiFetch(`${API_BASE}/events/${id}?include=`);
+            const result = await response.json();
+            const row = document.querySelector(`tr[data-event-id="${id}"]`);
+            if (result.code === 0 && row) {
+                const checked = row.querySelector(".event-checkbox")?.checked;
+                row.innerHTML = renderEventRow(result.data);
+                if (checked) row.querySelector(".event-checkbox").checked = true;
+            }
+        } catch (error) {
+            console.error("刷新事件失败:", error);
+        }
+    }
+}
+
 // ==================== 系统配置功能 ====================
 
 async function loadConfigs() {
@@ -3397,6 +3571,9 @@ window.closeEventViewDialog = closeEventViewDialog;
 window.deleteEvent = deleteEvent;
 window.searchEvents = searchEvents;
 window.resetEventFilters = resetEventFilters;
+window.exportEvents = exportEvents;
+window.bulkUpdateEvents = bulkUpdateEvents;
+window.toggleSelectAllEvents = toggleSelectAllEvents;
 window.addProcessStep = addProcessStep;
 window.showStatusDialog = showStatusDialog;
 window.closeStatusDialog = closeStatusDialog;